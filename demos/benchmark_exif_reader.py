@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark of timestamp extraction: piexif.load vs header-only exif_reader.
+
+Reports bytes read from disk and files/sec for both readers on a folder of images.
+Usage: python demos/benchmark_exif_reader.py <image_folder> [repeats]
+If no folder is given, photos from test/test_97f.zip are used.
+"""
+
+import builtins
+import io
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, List, Tuple
+from unittest.mock import patch
+from zipfile import ZipFile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import piexif  # noqa: E402
+
+from exif_reader import read_exif_header  # noqa: E402
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.tiff', '.tif'}
+
+
+class CountingFile(io.BufferedReader):
+    """Binary file that counts bytes handed out by read()."""
+
+    counter = [0]
+
+    def read(self, size=-1):  # type: ignore[override]
+        data = super().read(size)
+        CountingFile.counter[0] += len(data)
+        return data
+
+
+def counting_open(file, mode='r', *args, **kwargs):
+    if 'b' in mode and 'r' in mode and '+' not in mode:
+        return CountingFile(io.FileIO(file, 'r'))
+    return builtins.open(file, mode, *args, **kwargs)
+
+
+def with_piexif(path: str) -> object:
+    return piexif.load(path)['0th'].get(306)
+
+
+def with_header_reader(path: str) -> object:
+    return read_exif_header(path).datetime
+
+
+def measure(reader: Callable[[str], object], paths: List[str], repeats: int) -> Tuple[int, float]:
+    CountingFile.counter[0] = 0
+    with patch('builtins.open', counting_open):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for path in paths:
+                reader(path)
+        elapsed = time.perf_counter() - start
+    return CountingFile.counter[0] // repeats, len(paths) * repeats / elapsed
+
+
+def main() -> None:
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        if len(sys.argv) > 1:
+            folder = sys.argv[1]
+        else:
+            folder = tmp
+            with ZipFile(os.path.join(ROOT_DIR, 'test', 'test_97f.zip')) as myzip:
+                myzip.extractall(folder)
+        paths = sorted(
+            os.path.join(folder, name)
+            for name in os.listdir(folder)
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+        )
+        if not paths:
+            print('No JPEG/TIFF files in folder')
+            sys.exit(1)
+        total_size = sum(os.path.getsize(path) for path in paths)
+        print(f'{len(paths)} files, {total_size / 1e6:.1f} MB on disk, {repeats} repeats\n')
+        print(f'{"reader":<16}{"bytes read":>14}{"bytes/file":>12}{"files/sec":>12}')
+        for title, reader in (('piexif.load', with_piexif), ('exif_reader', with_header_reader)):
+            bytes_read, rate = measure(reader, paths, repeats)
+            print(f'{title:<16}{bytes_read:>14}{bytes_read // len(paths):>12}{rate:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,608 @@
+"""
+Frame alignment engine: coarse-to-fine phase correlation on image pyramids.
+
+Every frame is aligned to the previous frame of its stack, because neighbours
+differ least in focus. The pair transforms are then chained back to the first
+frame. For each pair of frames:
+    1. Both luminance planes are reduced to pyramids of 2x2 block means, down to a
+       coarsest level of at most COARSEST_SIZE pixels per side.
+    2. On the coarsest level, rotation and scale are found first by phase
+       correlation of log-polar magnitude spectra (Fourier-Mellin). Scale here is
+       focus breathing. The translation follows, by phase correlation of the
+       frames themselves.
+    3. On every finer level, GRID x GRID windows of the reference are matched
+       against the frame warped by the current estimate. The subpixel residual
+       shifts of the windows are point correspondences. They are fitted to the
+       model (translation, similarity or affine) by least squares.
+Fine levels resample only the windows, so building the pyramids dominates the
+cost of a pair. Warps are vectorized bilinear remaps, done in row strips (separably, by
+rows then columns, when there is no rotation).
+Phase correlation keeps low frequencies only, because focus changes the high
+ones from frame to frame.
+
+Usage:
+    python aligner.py <folder | files...> [--model translation|similarity|affine] [--max-size N]
+"""
+import argparse
+import functools
+import math
+import os
+import sys
+import time
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+#  Transform models
+MODEL_TRANSLATION = 'translation'
+MODEL_SIMILARITY = 'similarity'
+MODEL_AFFINE = 'affine'
+MODELS = (MODEL_TRANSLATION, MODEL_SIMILARITY, MODEL_AFFINE)
+
+#  Longest side of coarsest pyramid level, pixels
+COARSEST_SIZE = 256
+
+#  Windows per side matched on every pyramid level, and their side in pixels
+GRID = 4
+WINDOW = 64
+
+#  Width of Gaussian weighting matched frequencies, cycles/pixel
+CORRELATION_SIGMA = 0.06
+
+#  Lowest correlation peak (1 is a perfect match) of a window used in fits
+MIN_RESPONSE = 0.1
+
+#  Rotation and scale change beyond these are not focus bracketing, ignored
+MAX_ROTATION = 10.0
+MAX_SCALE_CHANGE = 0.2
+
+#  Transforms this close to whole-pixel translations are applied without resampling
+INTEGER_TOLERANCE = 0.01
+
+#  Rows of output resampled at once by `warp`
+STRIP_ROWS = 256
+
+#  Samples of log-polar spectra
+LOG_POLAR_SIZE = 256
+
+
+class Transform(NamedTuple):
+    """
+    Affine map from pixel (x, y) of reference frame to pixel of aligned frame:
+        x' = a * x + b * y + tx
+        y' = c * x + d * y + ty
+    """
+
+    a: float = 1.0
+    b: float = 0.0
+    tx: float = 0.0
+    c: float = 0.0
+    d: float = 1.0
+    ty: float = 0.0
+
+    @classmethod
+    def from_matrix(cls, matrix: np.ndarray) -> 'Transform':
+        return cls(*(float(value) for value in np.asarray(matrix)[:2].ravel()))
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Homogeneous 3x3 matrix."""
+        return np.array([[self.a, self.b, self.tx], [self.c, self.d, self.ty], [0.0, 0.0, 1.0]])
+
+    @property
+    def scale(self) -> float:
+        return math.sqrt(abs(self.a * self.d - self.b * self.c))
+
+    @property
+    def rotation(self) -> float:
+        """Rotation angle, degrees."""
+        return math.degrees(math.atan2(self.c, self.a))
+
+    def after(self, inner: 'Transform') -> 'Transform':
+        """Composition applying `inner` first."""
+        return Transform.from_matrix(self.matrix @ inner.matrix)
+
+    def rescaled(self, factor: float) -> 'Transform':
+        """
+        Same transform on frames `factor` times larger, e.g. estimated on reduced frames
+        and applied to full ones (pixel x there is factor * (x + 0.5) - 0.5).
+        """
+        offset = (factor - 1) / 2
+        scale = np.array([[factor, 0.0, offset], [0.0, factor, offset], [0.0, 0.0, 1.0]])
+        return Transform.from_matrix(scale @ self.matrix @ np.linalg.inv(scale))
+
+    def integer_shift(self) -> Optional[Tuple[int, int]]:
+        """(ty, tx) rounded if transform is a whole-pixel translation, None otherwise."""
+        linear = (self.a - 1.0, self.b, self.c, self.d - 1.0)
+        if any(abs(value) > 1e-6 for value in linear):
+            return None
+        ty, tx = round(self.ty), round(self.tx)
+        if abs(self.ty - ty) > INTEGER_TOLERANCE or abs(self.tx - tx) > INTEGER_TOLERANCE:
+            return None
+        return int(ty), int(tx)
+
+
+class AlignmentReport(NamedTuple):
+    """Transform of every frame to the first one and time spent on every frame."""
+
+    transforms: List[Transform]
+    seconds: List[float]
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(self.seconds)
+
+
+@functools.lru_cache(maxsize=16)
+def _hann(shape: Tuple[int, int]) -> np.ndarray:
+    return np.outer(np.hanning(shape[0]), np.hanning(shape[1])).astype(np.float32)
+
+
+@functools.lru_cache(maxsize=16)
+def _band(shape: Tuple[int, int], sigma: float) -> Tuple[np.ndarray, float]:
+    """Gaussian weights of rfft2 frequencies and correlation peak of a perfect match."""
+    freq_y = np.fft.fftfreq(shape[0])[:, None]
+    freq_x = np.fft.rfftfreq(shape[1])[None, :]
+    weights = np.exp(-(freq_y**2 + freq_x**2) / (2 * sigma**2))
+    return weights, float(np.fft.irfft2(weights, s=shape)[0, 0])
+
+
+def _parabolic(before: float, peak: float, after: float) -> float:
+    """Subpixel offset of peak from three samples around it."""
+    denominator = before - 2 * peak + after
+    if denominator >= 0:
+        return 0.0
+    return 0.5 * (before - after) / denominator
+
+
+def phase_correlation(
+    ref: np.ndarray, image: np.ndarray, sigma: float = CORRELATION_SIGMA
+) -> Tuple[float, float, float]:
+    """
+    Translation between two planes of the same shape by phase correlation.
+    Args:
+        ref: reference plane
+        image: plane to match
+        sigma: width of Gaussian weighting frequencies, cycles/pixel
+    Returns:
+        (dy, dx, response): `image` moved by subpixel (dy, dx) matches `ref`, response
+        is the correlation peak, 1 for a perfect match
+    """
+    window = _hann(ref.shape)
+    cross = np.fft.rfft2((ref - ref.mean()) * window) * np.conj(
+        np.fft.rfft2((image - image.mean()) * window)
+    )
+    cross /= np.maximum(np.abs(cross), 1e-12)
+    weights, norm = _band(ref.shape, sigma)
+    correlation = np.fft.irfft2(cross * weights, s=ref.shape) / norm
+    height, width = correlation.shape
+    py, px = np.unravel_index(int(np.argmax(correlation)), correlation.shape)
+    peak = correlation[py, px]
+    dy = py + _parabolic(correlation[py - 1, px], peak, correlation[(py + 1) % height, px])
+    dx = px + _parabolic(correlation[py, px - 1], peak, correlation[py, (px + 1) % width])
+    #  Peaks past the middle are negative shifts
+    if dy > height / 2:
+        dy -= height
+    if dx > width / 2:
+        dx -= width
+    return float(dy), float(dx), float(peak)
+
+
+def downsample(plane: np.ndarray, factor: int = 2) -> np.ndarray:
+    """Mean of factor x factor blocks, partial blocks at the edges dropped."""
+    if factor <= 1:
+        return plane
+    height, width = plane.shape[0] // factor, plane.shape[1] // factor
+    if factor == 2:
+        #  Sum of strided views, several times faster than a reduction over blocks
+        plane = plane[: height * 2, : width * 2]
+        total = plane[0::2, 0::2].astype(np.float32)
+        total += plane[1::2, 0::2]
+        total += plane[0::2, 1::2]
+        total += plane[1::2, 1::2]
+        total *= 0.25
+        return total
+    blocks = plane[: height * factor, : width * factor].reshape(height, factor, width, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def build_pyramid(gray: np.ndarray) -> List[np.ndarray]:
+    """Levels of 2x2 block means from full resolution down to COARSEST_SIZE."""
+    levels = [gray.astype(np.float32, copy=False)]
+    while max(levels[-1].shape) > COARSEST_SIZE and min(levels[-1].shape) >= 2 * WINDOW:
+        levels.append(downsample(levels[-1]))
+    return levels
+
+
+def upscale(transform: Transform) -> Transform:
+    """Transform of pyramid level to the next finer one (pixel x there is 2x + 0.5)."""
+    a, b, tx, c, d, ty = transform
+    return Transform(
+        a, b, 2 * tx + 0.5 - 0.5 * (a + b), c, d, 2 * ty + 0.5 - 0.5 * (c + d)
+    )
+
+
+def _sample_axis(
+    coords: np.ndarray, size: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Neighbour indices, interpolation fractions and inside mask of coordinates on one axis."""
+    inside = (coords >= -1e-3) & (coords <= size - 1 + 1e-3)
+    coords = np.clip(coords, 0, size - 1)
+    lower = np.minimum(coords.astype(np.intp), max(size - 2, 0))
+    upper = np.minimum(lower + 1, size - 1)
+    return lower, upper, (coords - lower).astype(np.float32), inside
+
+
+def remap(image: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Bilinear samples of image at float coordinates.
+    Args:
+        image: plane (height, width) or image (height, width, channels)
+        xs, ys: coordinates of samples, arrays of one shape
+    Returns:
+        float32 samples, mask of samples inside the image
+    """
+    height, width = image.shape[:2]
+    x0, x1, fx, inside_x = _sample_axis(xs, width)
+    y0, y1, fy, inside_y = _sample_axis(ys, height)
+    #  Gather the four neighbours from flat pixel rows by index
+    pixels = image.reshape(height * width, -1)
+    neighbours = [y0 * width + x0, y0 * width + x1, y1 * width + x0, y1 * width + x1]
+    weights = [(1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy]
+    values = np.zeros(xs.shape + (pixels.shape[1],), dtype=np.float32)
+    neighbour = np.empty_like(values)
+    for index, weight in zip(neighbours, weights):
+        #  In place: no temporaries of the strip size
+        neighbour[...] = np.take(pixels, index.ravel(), axis=0).reshape(values.shape)
+        neighbour *= weight[..., None]
+        values += neighbour
+    if image.ndim == 2:
+        values = values[..., 0]
+    return values, inside_x & inside_y
+
+
+def _shift(image: np.ndarray, dy: int, dx: int, shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Whole-pixel translation: output pixel (y, x) is image pixel (y + dy, x + dx)."""
+    out = np.zeros(shape + image.shape[2:], dtype=image.dtype)
+    valid = np.zeros(shape, dtype=bool)
+    height, width = image.shape[:2]
+    top, left = max(-dy, 0), max(-dx, 0)
+    bottom, right = min(shape[0], height - dy), min(shape[1], width - dx)
+    if top < bottom and left < right:
+        out[top:bottom, left:right] = image[top + dy : bottom + dy, left + dx : right + dx]
+        valid[top:bottom, left:right] = True
+    return out, valid
+
+
+def warp(
+    image: np.ndarray,
+    transform: Transform,
+    shape: Optional[Tuple[int, int]] = None,
+    origin: Tuple[int, int] = (0, 0),
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Resample image onto pixel grid of reference frame.
+    Args:
+        image: plane or RGB image of aligned frame
+        transform: transform from reference frame to `image`
+        shape: (height, width) of output, shape of `image` by default
+        origin: (x, y) of reference pixel at output (0, 0), to warp a window only
+    Returns:
+        warped image of `image` dtype, mask of pixels covered by `image`
+    """
+    if shape is None:
+        shape = image.shape[:2]
+    shift = transform.integer_shift()
+    if shift is not None:
+        return _shift(image, shift[0] + origin[1], shift[1] + origin[0], shape)
+    out = np.empty(shape + image.shape[2:], dtype=image.dtype)
+    valid = np.empty(shape, dtype=bool)
+    a, b, tx, c, d, ty = transform
+    xs = np.arange(shape[1], dtype=np.float32) + origin[0]
+    #  Without rotation or shear, source columns are the same on every row: rows are
+    #  interpolated first, then columns, from 1-D indices
+    separable = b == 0 and c == 0
+    if separable:
+        x0, x1, fx, inside_x = _sample_axis(a * xs + tx, image.shape[1])
+        if image.ndim == 3:
+            fx = fx[:, None]
+    for row in range(0, shape[0], STRIP_ROWS):
+        ys = np.arange(row, min(row + STRIP_ROWS, shape[0]), dtype=np.float32)[:, None] + origin[1]
+        if separable:
+            y0, y1, fy, inside_y = _sample_axis(d * ys + ty, image.shape[0])
+            fy = fy.reshape((-1,) + (1,) * (image.ndim - 1))
+            rows = image[y0[:, 0]].astype(np.float32)
+            below = image[y1[:, 0]].astype(np.float32)
+            below -= rows
+            below *= fy
+            rows += below
+            values = np.take(rows, x0, axis=1)
+            right = np.take(rows, x1, axis=1)
+            right -= values
+            right *= fx
+            values += right
+            inside = inside_y & inside_x
+        else:
+            values, inside = remap(image, a * xs + b * ys + tx, c * xs + d * ys + ty)
+        if np.issubdtype(image.dtype, np.integer):
+            info = np.iinfo(image.dtype)
+            values = np.clip(np.rint(values), info.min, info.max)
+        out[row : row + len(ys)] = values
+        valid[row : row + len(ys)] = inside
+    return out, valid
+
+
+def _high_pass(shape: Tuple[int, int]) -> np.ndarray:
+    freq_y = np.fft.fftshift(np.fft.fftfreq(shape[0]))[:, None]
+    freq_x = np.fft.fftshift(np.fft.fftfreq(shape[1]))[None, :]
+    x = np.cos(np.pi * freq_y) * np.cos(np.pi * freq_x)
+    return (1.0 - x) * (2.0 - x)
+
+
+def _log_polar_spectrum(plane: np.ndarray) -> Tuple[np.ndarray, float]:
+    """High-passed magnitude spectrum in log-polar coordinates (angle 0..180, log radius)."""
+    spectrum = np.abs(np.fft.fftshift(np.fft.fft2((plane - plane.mean()) * _hann(plane.shape))))
+    spectrum *= _high_pass(plane.shape)
+    center_y, center_x = plane.shape[0] / 2, plane.shape[1] / 2
+    log_base = math.log(min(center_y, center_x)) / LOG_POLAR_SIZE
+    angles = np.linspace(0, np.pi, LOG_POLAR_SIZE, endpoint=False)[:, None]
+    radii = np.exp(np.arange(LOG_POLAR_SIZE) * log_base)[None, :]
+    values, _ = remap(
+        spectrum.astype(np.float32), center_x + radii * np.cos(angles), center_y - radii * np.sin(angles)
+    )
+    return values, log_base
+
+
+def _similarity(angle: float, scale: float, center: Tuple[float, float]) -> Transform:
+    """Rotation (degrees) and scaling about center point (x, y)."""
+    cos, sin = scale * math.cos(math.radians(angle)), scale * math.sin(math.radians(angle))
+    cx, cy = center
+    return Transform(cos, -sin, cx - cos * cx + sin * cy, sin, cos, cy - sin * cx - cos * cy)
+
+
+def estimate_rotation_scale(ref: np.ndarray, image: np.ndarray) -> Transform:
+    """
+    Rotation and scaling of `image` against `ref` about the frame center, by phase
+    correlation of log-polar magnitude spectra. Identity if implausible for a stack.
+    """
+    ref_spectrum, log_base = _log_polar_spectrum(ref)
+    image_spectrum, _ = _log_polar_spectrum(image)
+    d_angle, d_radius, _ = phase_correlation(ref_spectrum, image_spectrum, sigma=0.25)
+    angle = d_angle * 180.0 / LOG_POLAR_SIZE
+    #  Spectrum of a frame scaled up shrinks
+    scale = math.exp(d_radius * log_base)
+    if abs(angle) > MAX_ROTATION or abs(scale - 1) > MAX_SCALE_CHANGE:
+        return Transform()
+    center = ((ref.shape[1] - 1) / 2, (ref.shape[0] - 1) / 2)
+    return _similarity(angle, scale, center)
+
+
+def coarse_transform(ref: np.ndarray, image: np.ndarray, model: str) -> Transform:
+    """Initial estimate on coarsest pyramid level: rotation and scale, then translation."""
+    transform = Transform()
+    if model != MODEL_TRANSLATION:
+        transform = estimate_rotation_scale(ref, image)
+    warped, _ = warp(image, transform, ref.shape)
+    dy, dx, _ = phase_correlation(ref, warped)
+    #  ref(p) matches warped(p - d), which is image(transform(p - d))
+    return transform.after(Transform(tx=-dx, ty=-dy))
+
+
+def fit_transform(model: str, points: np.ndarray, targets: np.ndarray, weights: np.ndarray) -> Transform:
+    """
+    Weighted least-squares transform of model mapping `points` to `targets`.
+    Args:
+        model: one of MODELS
+        points, targets: arrays (n, 2) of (x, y)
+        weights: weight of every pair
+    """
+    if model == MODEL_TRANSLATION:
+        tx, ty = np.average(targets - points, axis=0, weights=weights)
+        return Transform(tx=float(tx), ty=float(ty))
+    x, y = points[:, 0], points[:, 1]
+    ones, zeros = np.ones_like(x), np.zeros_like(x)
+    if model == MODEL_SIMILARITY:
+        #  x' = p * x - q * y + tx, y' = q * x + p * y + ty
+        rows = np.concatenate(
+            [np.stack([x, -y, ones, zeros], axis=1), np.stack([y, x, zeros, ones], axis=1)]
+        )
+    else:
+        rows = np.concatenate(
+            [
+                np.stack([x, y, ones, zeros, zeros, zeros], axis=1),
+                np.stack([zeros, zeros, zeros, x, y, ones], axis=1),
+            ]
+        )
+    root = np.sqrt(np.concatenate([weights, weights]))
+    values = np.concatenate([targets[:, 0], targets[:, 1]])
+    solution = np.linalg.lstsq(rows * root[:, None], values * root, rcond=None)[0]
+    if model == MODEL_SIMILARITY:
+        p, q, tx, ty = solution
+        return Transform(float(p), float(-q), float(tx), float(q), float(p), float(ty))
+    return Transform(*(float(value) for value in solution))
+
+
+#  Correspondences needed to fit every model
+MIN_POINTS = {MODEL_TRANSLATION: 1, MODEL_SIMILARITY: 2, MODEL_AFFINE: 3}
+
+
+def refine(ref: np.ndarray, image: np.ndarray, transform: Transform, model: str) -> Transform:
+    """
+    Refine transform on one pyramid level by residual shifts of a grid of windows.
+    Args:
+        ref: reference plane of the level
+        image: plane of aligned frame of the level
+        transform: current estimate in pixels of the level
+        model: one of MODELS
+    Returns:
+        refined transform, `transform` if too few windows match
+    """
+    size = min(WINDOW, min(ref.shape) // 2)
+    points, targets, weights = [], [], []
+    ys = np.linspace(size // 2, ref.shape[0] - size - size // 2, GRID).astype(int)
+    xs = np.linspace(size // 2, ref.shape[1] - size - size // 2, GRID).astype(int)
+    for top in ys:
+        for left in xs:
+            ref_window = ref[top : top + size, left : left + size]
+            if ref_window.std() < 1.0:
+                #  Flat area, nothing to match
+                continue
+            window, inside = warp(image, transform, (size, size), (left, top))
+            if not inside.all():
+                continue
+            dy, dx, response = phase_correlation(ref_window, window.astype(np.float32, copy=False))
+            if response < MIN_RESPONSE:
+                continue
+            center = (left + (size - 1) / 2, top + (size - 1) / 2)
+            x, y = center[0] - dx, center[1] - dy
+            points.append(center)
+            targets.append(
+                (transform.a * x + transform.b * y + transform.tx, transform.c * x + transform.d * y + transform.ty)
+            )
+            weights.append(response)
+    if len(points) < MIN_POINTS[model]:
+        return transform
+    points_, targets_, weights_ = np.array(points), np.array(targets), np.array(weights)
+    fitted = fit_transform(model, points_, targets_, weights_)
+    #  Drop windows disagreeing with the others (moving subject, repeated texture)
+    predicted = points_ @ fitted.matrix[:2, :2].T + fitted.matrix[:2, 2]
+    errors = np.hypot(*(predicted - targets_).T)
+    keep = errors <= max(1.0, 3 * float(np.median(errors)))
+    if keep.sum() >= MIN_POINTS[model] and not keep.all():
+        fitted = fit_transform(model, points_[keep], targets_[keep], weights_[keep])
+    return fitted
+
+
+def align_pair(ref_pyramid: List[np.ndarray], pyramid: List[np.ndarray], model: str) -> Transform:
+    """Transform from reference frame to frame, both given as pyramids."""
+    levels = min(len(ref_pyramid), len(pyramid))
+    transform = coarse_transform(ref_pyramid[levels - 1], pyramid[levels - 1], model)
+    transform = refine(ref_pyramid[levels - 1], pyramid[levels - 1], transform, model)
+    for level in reversed(range(levels - 1)):
+        transform = refine(ref_pyramid[level], pyramid[level], upscale(transform), model)
+    return transform
+
+
+class StreamAligner:
+    """Aligns frames of a stack to its first one as they come, keeping only the pyramid of the previous frame."""
+
+    def __init__(self, model: str = MODEL_SIMILARITY) -> None:
+        self.model = model
+        self._previous: Optional[List[np.ndarray]] = None
+        self._transform = Transform()
+
+    @classmethod
+    def resume(cls, gray: np.ndarray, transform: Transform, model: str = MODEL_SIMILARITY) -> 'StreamAligner':
+        """
+        Aligner going on from a frame aligned before: luminance plane `gray` of it and
+        its `transform` from the first frame. Frames added then are its neighbours, in
+        shooting order after it or in reverse order before it.
+        """
+        stream = cls(model)
+        stream._previous = build_pyramid(gray)
+        stream._transform = transform
+        return stream
+
+    def add(self, gray: np.ndarray) -> Transform:
+        """Transform from the first frame to the frame of luminance plane `gray`."""
+        pyramid = build_pyramid(gray)
+        if self._previous is not None:
+            self._transform = align_pair(self._previous, pyramid, self.model).after(self._transform)
+        self._previous = pyramid
+        return self._transform
+
+
+def align_frames(grays: Iterable[np.ndarray], model: str = MODEL_SIMILARITY) -> AlignmentReport:
+    """
+    Align luminance planes of a stack to its first frame.
+    Args:
+        grays: planes of one shape in shooting order, consumed one at a time (only
+            the pyramid of the previous frame is kept)
+        model: one of MODELS
+    Returns:
+        transform from first frame to every frame and seconds spent on every frame
+    """
+    transforms: List[Transform] = []
+    seconds: List[float] = []
+    stream = StreamAligner(model)
+    for gray in grays:
+        start = time.perf_counter()
+        transforms.append(stream.add(gray))
+        seconds.append(time.perf_counter() - start)
+    return AlignmentReport(transforms, seconds)
+
+
+def valid_region(valid: np.ndarray) -> Tuple[int, int, int, int]:
+    """
+    Axis-aligned rectangle (top, bottom, left, right) inside mask of pixels covered by
+    every frame, shrunk greedily from the side with most uncovered pixels.
+    """
+    top, bottom, left, right = 0, valid.shape[0], 0, valid.shape[1]
+    while top < bottom and left < right:
+        region = valid[top:bottom, left:right]
+        missing = [
+            int((~region[0]).sum()),
+            int((~region[-1]).sum()),
+            int((~region[:, 0]).sum()),
+            int((~region[:, -1]).sum()),
+        ]
+        worst = int(np.argmax(missing))
+        if missing[worst] == 0:
+            return top, bottom, left, right
+        if worst == 0:
+            top += 1
+        elif worst == 1:
+            bottom -= 1
+        elif worst == 2:
+            left += 1
+        else:
+            right -= 1
+    return 0, valid.shape[0], 0, valid.shape[1]
+
+
+def main() -> int:
+    #  Pillow is needed to decode files only
+    from image_loader import decode_counts, describe_decodes, image_shape, load_image, to_gray
+    from scanner import is_image_name, scan_directory
+
+    parser = argparse.ArgumentParser(description='Align frames of a focus stack')
+    parser.add_argument('paths', nargs='+', help='stack folder or image files in shooting order')
+    parser.add_argument('--model', choices=MODELS, default=MODEL_SIMILARITY, help='transform model')
+    parser.add_argument(
+        '--max-size',
+        type=int,
+        default=0,
+        help='align frames reduced to this longest side (draft decoding), transforms in full-size pixels',
+    )
+    args = parser.parse_args()
+    paths = args.paths
+    if len(paths) == 1 and os.path.isdir(paths[0]):
+        paths = [entry.path for entry in scan_directory(paths[0]) if is_image_name(entry.name)]
+    widths = []
+
+    def grays() -> Iterable[np.ndarray]:
+        for path in paths:
+            image = load_image(path, args.max_size)
+            widths.append(image.shape[1])
+            yield to_gray(image)
+
+    try:
+        report = align_frames(grays(), args.model)
+        if args.max_size and widths:
+            #  Ratio of full to reduced width (frames of a stack share a shape)
+            factor = image_shape(paths[0])[1] / widths[0]
+            report = report._replace(transforms=[t.rescaled(factor) for t in report.transforms])
+    except OSError as e:
+        print(f'❌ Alignment failed: {e}')
+        return 1
+    for path, transform, seconds in zip(paths, report.transforms, report.seconds):
+        print(
+            f'{os.path.basename(path)}: dx {transform.tx:+.2f} dy {transform.ty:+.2f} '
+            f'rotation {transform.rotation:+.3f}° scale {transform.scale:.4f} ({seconds * 1000:.0f} ms)'
+        )
+    print(f'Aligned {len(paths)} frames in {report.total_seconds:.2f}s (decodes: {describe_decodes(decode_counts())})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,300 @@
+"""
+Multi-band blending of aligned frames: Laplacian pyramid fusion.
+
+Every frame is split into a Laplacian pyramid (band-pass levels of 5-tap binomial
+filtering) and the fused pyramid keeps, per pixel of every level, the coefficient
+of the frame with the highest contrast there; the coarsest level is averaged over
+frames, which keeps tones and colours even. Collapsing the fused pyramid gives an
+image free of the halos and seams of per-pixel selection, the job Photoshop's
+`mergeAlignedLayers` with `colorCorrection` does in stacker.js.
+
+Frames are added one at a time. All buffers are float32 channel planes allocated
+once per stack: pyramid levels and fused levels per level, filter scratch once for
+the finest level and reused as views by the coarser ones.
+
+Presets:
+    fast      4 levels, coefficient magnitude as contrast
+    quality   levels down to 16 pixels, contrast averaged over 3x3 neighbourhood
+
+Usage:
+    python blender.py --benchmark [--preset fast|quality] [--size WxH] [--frames N]
+"""
+import argparse
+import sys
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+#  Presets
+PRESET_FAST = 'fast'
+PRESET_QUALITY = 'quality'
+
+
+class BlendPreset(NamedTuple):
+    """Pyramid depth limit and whether contrast is averaged over 3x3 neighbourhood."""
+
+    max_levels: int
+    smooth_contrast: bool
+
+
+PRESETS = {
+    PRESET_FAST: BlendPreset(max_levels=4, smooth_contrast=False),
+    PRESET_QUALITY: BlendPreset(max_levels=16, smooth_contrast=True),
+}
+
+#  Coarsest level is not reduced below this side, pixels
+MIN_LEVEL_SIZE = 16
+
+#  5-tap binomial filter of reduce/expand
+KERNEL = (1 / 16, 4 / 16, 6 / 16, 4 / 16, 1 / 16)
+
+
+def level_shapes(height: int, width: int, max_levels: int) -> List[Tuple[int, int]]:
+    """(height, width) of pyramid levels, finest first."""
+    shapes = [(height, width)]
+    while len(shapes) < max_levels and min(shapes[-1]) >= 2 * MIN_LEVEL_SIZE:
+        h, w = shapes[-1]
+        shapes.append(((h + 1) // 2, (w + 1) // 2))
+    return shapes
+
+
+class _Scratch:
+    """Flat float32 buffers handing out views of any shape up to their size."""
+
+    def __init__(self, count: int, size: int) -> None:
+        self._buffers = [np.empty(size, dtype=np.float32) for _ in range(count)]
+
+    def view(self, index: int, shape: Tuple[int, ...]) -> np.ndarray:
+        return self._buffers[index][: int(np.prod(shape))].reshape(shape)
+
+
+def _pad_into(src: np.ndarray, dst: np.ndarray, pad: int) -> np.ndarray:
+    """Copy planes src (c, h, w) into dst with `pad` (1 or 2) mirrored pixels on every side."""
+    h, w = src.shape[1:]
+    dst[:, pad : pad + h, pad : pad + w] = src
+    for i in range(1, pad + 1):
+        dst[:, pad - i, pad : pad + w] = src[:, i]
+        dst[:, pad + h - 1 + i, pad : pad + w] = src[:, h - 1 - i]
+    for i in range(1, pad + 1):
+        dst[..., pad - i] = dst[..., pad + i]
+        dst[..., pad + w - 1 + i] = dst[..., pad + w - 1 - i]
+    return dst
+
+
+def _binomial_into(p0, p1, p2, p3, p4, out: np.ndarray, term: np.ndarray) -> None:
+    """out = (p0 + 4 p1 + 6 p2 + 4 p3 + p4) / 16 with one scratch array."""
+    np.add(p1, p3, out=out)
+    out *= 4
+    np.add(p0, p4, out=term)
+    out += term
+    np.multiply(p2, 6, out=term)
+    out += term
+    out *= 1 / 16
+
+
+def reduce_into(src: np.ndarray, dst: np.ndarray, scratch: _Scratch) -> None:
+    """Blur planes src (c, h, w) with the binomial filter and take every second pixel into dst."""
+    c, h, w = src.shape
+    ho, wo = dst.shape[1:]
+    padded = _pad_into(src, scratch.view(0, (c, h + 4, w + 4)), 2)
+    #  Rows first: the horizontal pass then runs on half of them
+    rows = scratch.view(1, (c, ho, w + 4))
+    taps = [padded[:, k : k + 2 * ho : 2] for k in range(5)]
+    _binomial_into(*taps, out=rows, term=scratch.view(2, rows.shape))
+    taps = [rows[..., k : k + 2 * wo : 2] for k in range(5)]
+    _binomial_into(*taps, out=dst, term=scratch.view(2, dst.shape))
+
+
+def expand_into(src: np.ndarray, dst: np.ndarray, scratch: _Scratch) -> None:
+    """Upsample planes src (c, h, w) twice into dst: binomial interpolation, even and odd pixels apart."""
+    c, hs, ws = src.shape
+    h, w = dst.shape[1:]
+    padded = _pad_into(src, scratch.view(0, (c, hs + 2, ws + 2)), 1)
+    cols = scratch.view(1, (c, hs + 2, w))
+    even, odd = (w + 1) // 2, w // 2
+    #  Even pixels: (1 6 1) / 8 around source pixel, odd ones: mean of two neighbours
+    term = scratch.view(2, (c, hs + 2, even))
+    np.multiply(padded[..., 1 : even + 1], 6 / 8, out=cols[..., 0::2])
+    np.add(padded[..., 0:even], padded[..., 2 : even + 2], out=term)
+    term *= 1 / 8
+    cols[..., 0::2] += term
+    np.add(padded[..., 1 : odd + 1], padded[..., 2 : odd + 2], out=cols[..., 1::2])
+    cols[..., 1::2] *= 0.5
+    even, odd = (h + 1) // 2, h // 2
+    term = scratch.view(2, (c, even, w))
+    np.multiply(cols[:, 1 : even + 1], 6 / 8, out=dst[:, 0::2])
+    np.add(cols[:, 0:even], cols[:, 2 : even + 2], out=term)
+    term *= 1 / 8
+    dst[:, 0::2] += term
+    np.add(cols[:, 1 : odd + 1], cols[:, 2 : odd + 2], out=dst[:, 1::2])
+    dst[:, 1::2] *= 0.5
+
+
+def _box3_into(src: np.ndarray, dst: np.ndarray, tmp: np.ndarray) -> None:
+    """Sum over 3x3 neighbourhood (2x3/3x2 at borders)."""
+    np.copyto(tmp, src)
+    tmp[1:] += src[:-1]
+    tmp[:-1] += src[1:]
+    np.copyto(dst, tmp)
+    dst[:, 1:] += tmp[:, :-1]
+    dst[:, :-1] += tmp[:, 1:]
+
+
+class PyramidBlender:
+    """Fuses aligned frames of one shape added one at a time."""
+
+    def __init__(
+        self, shape: Tuple[int, ...], preset: str = PRESET_QUALITY, max_levels: Optional[int] = None
+    ) -> None:
+        """
+        Args:
+            shape: (height, width) or (height, width, channels) of frames
+            preset: PRESET_FAST or PRESET_QUALITY
+            max_levels: tighter limit of pyramid depth than the preset one
+        """
+        height, width = shape[:2]
+        self.shape = tuple(shape)
+        self.channels = shape[2] if len(shape) > 2 else 1
+        self.preset = PRESETS[preset]
+        levels = self.preset.max_levels if max_levels is None else min(max_levels, self.preset.max_levels)
+        self.shapes = level_shapes(height, width, levels)
+        #  Levels are channel planes (c, h, w): every filter and selection step runs
+        #  on contiguous planes
+        c = self.channels
+        self._gauss = [np.empty((c,) + s, dtype=np.float32) for s in self.shapes]
+        self._band = [np.empty((c,) + s, dtype=np.float32) for s in self.shapes[:-1]]
+        self._fused = [np.zeros((c,) + s, dtype=np.float32) for s in self.shapes]
+        self._best = [np.full(s, -1.0, dtype=np.float32) for s in self.shapes[:-1]]
+        #  Scratch sized for the finest level, shared by all levels
+        self._scratch = _Scratch(3, c * (height + 4) * (width + 4))
+        self._plane = _Scratch(3, height * width)
+        self._mask = np.empty(height * width, dtype=bool)
+        self.frames = 0
+
+    def add(self, image: np.ndarray) -> None:
+        """Add aligned frame (uint8 or float, of the blender shape)."""
+        gauss = self._gauss
+        planes = image.reshape(self.shapes[0] + (self.channels,))
+        np.copyto(gauss[0], planes.transpose(2, 0, 1))
+        for level in range(1, len(gauss)):
+            reduce_into(gauss[level - 1], gauss[level], self._scratch)
+        for level, band in enumerate(self._band):
+            expand_into(gauss[level + 1], band, self._scratch)
+            np.subtract(gauss[level], band, out=band)
+            self._select(level, band)
+        self._fused[-1] += gauss[-1]
+        self.frames += 1
+
+    def _select(self, level: int, band: np.ndarray) -> None:
+        """Keep coefficients of band where its contrast beats the frames before."""
+        shape = band.shape[1:]
+        #  Contrast: sum of coefficient magnitudes over channels
+        contrast = self._plane.view(1, shape)
+        tmp = self._plane.view(0, shape)
+        np.abs(band[0], out=contrast)
+        for channel in range(1, self.channels):
+            np.abs(band[channel], out=tmp)
+            contrast += tmp
+        if self.preset.smooth_contrast:
+            smoothed = self._plane.view(2, shape)
+            _box3_into(contrast, smoothed, tmp)
+            contrast = smoothed
+        mask = self._mask[: shape[0] * shape[1]].reshape(shape)
+        np.greater(contrast, self._best[level], out=mask)
+        np.copyto(self._fused[level], band, where=mask)
+        np.copyto(self._best[level], contrast, where=mask)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """Fused pyramid and selection contrasts, to resume blending later with `restore`."""
+        state = {'frames': np.array(self.frames)}
+        for level, fused in enumerate(self._fused):
+            state[f'fused_{level}'] = fused
+        for level, best in enumerate(self._best):
+            state[f'best_{level}'] = best
+        return state
+
+    def restore(self, state: Dict[str, np.ndarray]) -> None:
+        """
+        Resume blending from `state` of a blender of the same shape and preset.
+        Raises:
+            ValueError: state is of another pyramid
+        """
+        try:
+            for level, fused in enumerate(self._fused):
+                np.copyto(fused, state[f'fused_{level}'], casting='no')
+            for level, best in enumerate(self._best):
+                np.copyto(best, state[f'best_{level}'], casting='no')
+        except (KeyError, ValueError, TypeError) as e:
+            raise ValueError(f'Blender state does not match the pyramid: {e}') from e
+        self.frames = int(state['frames'])
+
+    def result(self) -> np.ndarray:
+        """Collapse fused pyramid into uint8 image of the frame shape."""
+        if not self.frames:
+            raise ValueError('No frames to blend')
+        image = self._gauss[-1]
+        np.multiply(self._fused[-1], 1 / self.frames, out=image)
+        for level in reversed(range(len(self._band))):
+            expanded = self._gauss[level]
+            expand_into(image, expanded, self._scratch)
+            expanded += self._fused[level]
+            image = expanded
+        np.clip(image, 0, 255, out=image)
+        np.rint(image, out=image)
+        return image.transpose(1, 2, 0).astype(np.uint8).reshape(self.shape)
+
+
+def fuse(images: Iterable[np.ndarray], preset: str = PRESET_QUALITY) -> np.ndarray:
+    """
+    Fuse aligned frames by Laplacian pyramid.
+    Args:
+        images: frames of one shape (height, width, channels)
+        preset: PRESET_FAST or PRESET_QUALITY
+    Returns:
+        uint8 image
+    Raises:
+        ValueError: no frames
+    """
+    blender = None
+    for image in images:
+        if blender is None:
+            blender = PyramidBlender(image.shape, preset)
+        blender.add(image)
+    if blender is None:
+        raise ValueError('No frames to blend')
+    return blender.result()
+
+
+def benchmark(size: Tuple[int, int], frames: int, preset: str) -> float:
+    """Blend random frames of `size` (width, height), megapixels per second."""
+    width, height = size
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    blender = PyramidBlender(image.shape, preset)
+    start = time.perf_counter()
+    for _ in range(frames):
+        blender.add(image)
+    blender.result()
+    seconds = time.perf_counter() - start
+    return width * height * frames / 1e6 / seconds
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Laplacian pyramid blending')
+    parser.add_argument('--benchmark', action='store_true', help='report blending throughput')
+    parser.add_argument('--preset', choices=tuple(PRESETS), default=PRESET_QUALITY)
+    parser.add_argument('--size', default='6000x4000', help='frame size WxH (default 24 MP)')
+    parser.add_argument('--frames', type=int, default=5, help='frames to blend')
+    args = parser.parse_args()
+    if not args.benchmark:
+        parser.print_help()
+        return 1
+    width, height = (int(value) for value in args.size.lower().split('x'))
+    throughput = benchmark((width, height), args.frames, args.preset)
+    print(f'Blended {args.frames} frames of {width}x{height} ({args.preset}): {throughput:.1f} MP/s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+Cost and memory estimates of stacks, before any frame is decoded.
+
+Stacking time and peak memory of a stack grow with its frame count F and the pixel
+count P of its frames, which is read from the header of the first frame. Both are
+modelled as linear in F*P (work and memory per frame, e.g. decoded frames held by
+batch stacking) and in P (per-stack buffers, e.g. accumulator maps):
+
+    seconds = a * F*P + b * P
+    memory  = c * F*P + d * P (+ memory budget of tiled stacking, frame slots of
+                                 pipelined decoding, or frames decoded ahead)
+
+with coefficients per profile, the way stacks are stacked ('batch', 'streaming'
+(pipelined decoding included) or 'tiled', and the blending method). Default coefficients are rough measurements of
+the native stacker; they are replaced by a least-squares fit over the run history
+once a profile has MIN_SAMPLES succeeded stacks recorded there.
+
+Run history is a JSON-lines file, one record per succeeded stack, appended by the
+scheduler after every run.
+"""
+import json
+import os
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+import numpy as np
+from PIL import Image
+
+import native_stacker
+
+#  Run history, in the storage folder (parent of the current folder)
+HISTORY_FILE_NAME = '.fs_stack_history.jsonl'
+
+#  Records of a profile needed to replace its default coefficients
+MIN_SAMPLES = 3
+
+#  Most recent records of a profile used for calibration
+MAX_SAMPLES = 200
+
+#  Default (per frame-pixel, per pixel) coefficients of seconds and of bytes, by mode
+DEFAULT_SECONDS = {
+    'batch': (9e-8, 0.0),
+    'streaming': (1.3e-7, 0.0),
+    'tiled': (2e-7, 0.0),
+}
+DEFAULT_MEMORY = {
+    'batch': (18.0, 40.0),
+    'streaming': (0.0, 70.0),
+    'tiled': (0.0, 8.0),
+}
+
+#  Extra (per frame-pixel, per pixel) bytes of pyramid blending over the default
+PYRAMID_MEMORY = (0.0, 60.0)
+
+
+class HistoryRecord(NamedTuple):
+    """One succeeded stack of a past run; memory is 0 if it wasn't measured."""
+
+    profile: str
+    frames: int
+    pixels: int
+    seconds: float
+    memory: int
+
+
+class Coefficients(NamedTuple):
+    """Coefficients of F*P and P in seconds and in bytes."""
+
+    seconds: Tuple[float, float]
+    memory: Tuple[float, float]
+    samples: int
+
+
+class JobEstimate(NamedTuple):
+    """
+    Estimate of one stack.
+    Attributes:
+        frames: number of frames
+        pixels: pixels per frame, 0 if the header can't be read
+        seconds: estimated stacking time, the cost jobs are ordered by
+        memory: estimated peak memory, bytes
+    """
+
+    frames: int
+    pixels: int
+    seconds: float
+    memory: int
+
+
+def profile(options: native_stacker.StackOptions) -> str:
+    """Profile name of stacking options: '<mode>/<method>'."""
+    if options.memory_mb:
+        mode = 'tiled'
+    elif options.streaming or options.decoders or options.incremental:
+        mode = 'streaming'
+    else:
+        mode = 'batch'
+    return f'{mode}/{options.method}'
+
+
+def default_coefficients(name: str) -> Coefficients:
+    mode, method = name.split('/')
+    memory = DEFAULT_MEMORY[mode]
+    if method == native_stacker.METHOD_PYRAMID:
+        memory = (memory[0] + PYRAMID_MEMORY[0], memory[1] + PYRAMID_MEMORY[1])
+    return Coefficients(DEFAULT_SECONDS[mode], memory, 0)
+
+
+def frame_pixels(path: str) -> int:
+    """Pixel count of image from its header (nothing is decoded), 0 if unreadable."""
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+    except OSError:
+        return 0
+    return width * height
+
+
+def _fit(features: np.ndarray, values: np.ndarray) -> Tuple[float, float]:
+    """Non-negative least-squares coefficients of two features (columns)."""
+    coefficients = np.linalg.lstsq(features, values, rcond=None)[0]
+    if coefficients.min() < 0:
+        #  Negative term is dropped and the other one refitted alone
+        keep = int(np.argmax(coefficients))
+        coefficients = np.zeros(2)
+        column = features[:, keep]
+        coefficients[keep] = max(float(column @ values) / float(column @ column), 0.0)
+    return float(coefficients[0]), float(coefficients[1])
+
+
+def calibrate(records: Iterable[HistoryRecord]) -> Dict[str, Coefficients]:
+    """
+    Fit coefficients of every profile with at least MIN_SAMPLES records, from its
+    MAX_SAMPLES most recent ones; memory ones from the records with memory measured,
+    if there are MIN_SAMPLES of them.
+    """
+    by_profile: Dict[str, List[HistoryRecord]] = {}
+    for record in records:
+        by_profile.setdefault(record.profile, []).append(record)
+    fitted = {}
+    for name, samples in by_profile.items():
+        samples = samples[-MAX_SAMPLES:]
+        if len(samples) < MIN_SAMPLES:
+            continue
+        features = np.array([(r.frames * r.pixels, r.pixels) for r in samples], dtype=np.float64)
+        if not features.any():
+            continue
+        seconds = _fit(features, np.array([r.seconds for r in samples]))
+        measured = [r for r in samples if r.memory]
+        if len(measured) >= MIN_SAMPLES:
+            memory = _fit(
+                np.array([(r.frames * r.pixels, r.pixels) for r in measured], dtype=np.float64),
+                np.array([r.memory for r in measured], dtype=np.float64),
+            )
+        else:
+            memory = default_coefficients(name).memory
+        fitted[name] = Coefficients(seconds, memory, len(samples))
+    return fitted
+
+
+class CostModel:
+    """Estimates of stacks by profile coefficients, calibrated from run history."""
+
+    def __init__(self, history: Iterable[HistoryRecord] = ()) -> None:
+        self.coefficients = calibrate(history)
+
+    def coefficients_of(self, name: str) -> Coefficients:
+        return self.coefficients.get(name) or default_coefficients(name)
+
+    def estimate(self, files: List[str], options: native_stacker.StackOptions) -> JobEstimate:
+        """Estimate of stack of `files` from the header of its first frame."""
+        frames = len(files)
+        pixels = frame_pixels(files[0]) if files else 0
+        coefficients = self.coefficients_of(profile(options))
+        work = frames * pixels
+        seconds = coefficients.seconds[0] * work + coefficients.seconds[1] * pixels
+        memory = coefficients.memory[0] * work + coefficients.memory[1] * pixels
+        if options.memory_mb:
+            memory += options.memory_mb << 20
+        elif options.decoders:
+            #  Shared-memory slots of the decoders and of the frame being stacked
+            memory += (options.decoders + 1) * 3 * pixels
+        elif options.prefetch:
+            #  Frames decoded ahead, up to the prefetch budget
+            ahead = options.prefetch * 3 * pixels
+            memory += min(ahead, options.prefetch_mb << 20) if options.prefetch_mb else ahead
+        return JobEstimate(frames, pixels, seconds, int(memory))
+
+
+def read_history(path: str) -> List[HistoryRecord]:
+    """Records of run history file, oldest first; none if the file is missing."""
+    records = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(HistoryRecord(**json.loads(line)))
+                except (TypeError, ValueError):
+                    #  Line cut short by an interrupted append
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def append_history(path: str, records: List[HistoryRecord]) -> None:
+    """Append records to run history file."""
+    if not records:
+        return
+    data = ''.join(json.dumps(record._asdict()) + '\n' for record in records).encode('utf-8')
+    with open(path, 'ab+') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                #  Last line was cut short by an interrupted append: it is closed, and skipped on reading
+                data = b'\n' + data
+        f.write(data)
+
+
+def history_path(path: str) -> str:
+    """Default run history of grouped folder or job list: in the parent of the current folder."""
+    current_folder = os.path.dirname(os.path.abspath(path.rstrip(os.sep)))
+    return os.path.join(os.path.dirname(current_folder), HISTORY_FILE_NAME)
@@ -0,0 +1,251 @@
+"""
+Header-only EXIF reader.
+
+Reads just the APP1/TIFF header region of an image file and walks the IFDs to the
+few tags the grouper needs. Unlike `piexif.load`, nothing past the EXIF segment is
+read, no thumbnail/GPS/MakerNote IFDs are decoded and timestamps are parsed from
+their fixed-width layout without `strptime`.
+"""
+import struct
+from datetime import datetime
+from typing import BinaryIO, Dict, NamedTuple, Optional, Tuple
+
+#  JPEG markers
+_SOI = b'\xff\xd8'
+_APP1 = 0xE1
+_SOS = 0xDA
+_EOI = 0xD9
+#  Markers without a length field (RSTn, TEM)
+_STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+
+_EXIF_HEADER = b'Exif\x00\x00'
+
+#  Never look further than this into a file for the EXIF segment
+MAX_HEADER_SCAN = 256 * 1024
+
+#  Bounded first read of the TIFF structure, offsets beyond it are fetched lazily.
+#  IFD0 and the Exif IFD normally sit right after the header, while the embedded
+#  thumbnail that makes up most of APP1 is never touched.
+TIFF_HEAD_READ = 4 * 1024
+
+#  IFD0 tags
+TAG_MAKE = 271
+TAG_MODEL = 272
+TAG_DATETIME = 306
+TAG_EXIF_IFD = 34665
+#  Exif IFD tags
+TAG_DATETIME_ORIGINAL = 36867
+TAG_SUBSEC_TIME_ORIGINAL = 37521
+TAG_PIXEL_X = 40962
+TAG_PIXEL_Y = 40963
+
+_IFD0_TAGS = {TAG_MAKE, TAG_MODEL, TAG_DATETIME, TAG_EXIF_IFD}
+_EXIF_TAGS = {
+    TAG_DATETIME_ORIGINAL,
+    TAG_SUBSEC_TIME_ORIGINAL,
+    TAG_PIXEL_X,
+    TAG_PIXEL_Y,
+}
+
+#  TIFF field type -> size of one value in bytes
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+_TYPE_ASCII = 2
+_TYPE_SHORT = 3
+_TYPE_LONG = 4
+
+
+class ExifFormatError(ValueError):
+    """File is not a JPEG/TIFF or its EXIF structure cannot be walked."""
+
+
+class ExifHeader(NamedTuple):
+    """Fields extracted from the EXIF header. Missing tags are None."""
+
+    datetime: Optional[str]
+    datetime_original: Optional[str]
+    subsec_original: Optional[str]
+    make: Optional[str]
+    model: Optional[str]
+    width: Optional[int]
+    height: Optional[int]
+    bytes_read: int
+
+
+def parse_exif_datetime(value: str) -> datetime:
+    """
+    Parse fixed-width EXIF timestamp 'YYYY:MM:DD HH:MM:SS' without strptime.
+    Args:
+        value: timestamp string as stored in EXIF
+    Returns:
+        naive datetime
+    Raises:
+        ValueError: if string is not a valid EXIF timestamp
+    """
+    if (
+        len(value) < 19
+        or value[4] != ':'
+        or value[7] != ':'
+        or value[13] != ':'
+        or value[16] != ':'
+    ):
+        raise ValueError(f'Bad EXIF timestamp: {value!r}')
+    return datetime(
+        int(value[0:4]),
+        int(value[5:7]),
+        int(value[8:10]),
+        int(value[11:13]),
+        int(value[14:16]),
+        int(value[17:19]),
+    )
+
+
+class _Tiff:
+    """TIFF structure backed by a header buffer, extended lazily from the open file."""
+
+    def __init__(
+        self, data: bytes, fileobj: BinaryIO, base: int, limit: int
+    ) -> None:
+        if data[:2] == b'II':
+            self.order = '<'
+        elif data[:2] == b'MM':
+            self.order = '>'
+        else:
+            raise ExifFormatError('Bad TIFF byte order mark')
+        if struct.unpack(self.order + 'H', data[2:4])[0] != 42:
+            raise ExifFormatError('Bad TIFF magic number')
+        self.data = data
+        self.fileobj = fileobj
+        self.base = base
+        self.limit = limit
+        self.extra_read = 0
+
+    def read(self, offset: int, size: int) -> bytes:
+        """Return `size` bytes at TIFF `offset`, reading from file if out of buffer."""
+        if offset + size <= len(self.data):
+            return self.data[offset : offset + size]
+        if offset < 0 or offset + size > self.limit:
+            raise ExifFormatError('IFD offset out of range')
+        self.fileobj.seek(self.base + offset)
+        chunk = self.fileobj.read(size)
+        self.extra_read += len(chunk)
+        if len(chunk) != size:
+            raise ExifFormatError('Truncated TIFF structure')
+        return chunk
+
+    def first_ifd(self) -> int:
+        return struct.unpack(self.order + 'I', self.data[4:8])[0]
+
+    def walk(self, offset: int, wanted: set) -> Dict[int, object]:
+        """Read wanted tags from IFD at `offset`."""
+        count = struct.unpack(self.order + 'H', self.read(offset, 2))[0]
+        entries = self.read(offset + 2, count * 12)
+        values: Dict[int, object] = {}
+        for i in range(count):
+            tag, typ, num, raw = struct.unpack(
+                self.order + 'HHI4s', entries[i * 12 : i * 12 + 12]
+            )
+            if tag not in wanted:
+                continue
+            size = _TYPE_SIZES.get(typ, 1) * num
+            if size > 4:
+                value_offset = struct.unpack(self.order + 'I', raw)[0]
+                raw = self.read(value_offset, size)
+            if typ == _TYPE_ASCII:
+                values[tag] = raw[:size].split(b'\x00', 1)[0].decode('ascii', 'replace')
+            elif typ == _TYPE_SHORT:
+                values[tag] = struct.unpack(self.order + 'H', raw[:2])[0]
+            elif typ == _TYPE_LONG:
+                values[tag] = struct.unpack(self.order + 'I', raw[:4])[0]
+        return values
+
+
+def _find_jpeg_exif(f: BinaryIO) -> Tuple[int, int, int]:
+    """
+    Walk JPEG segment headers up to the EXIF APP1 segment, seeking over the others.
+    Returns:
+        file offset of EXIF TIFF payload (0 if none), its length & number of bytes read
+    """
+    pos, bytes_read = 2, 2
+    while pos < MAX_HEADER_SCAN:
+        head = f.read(4)
+        bytes_read += len(head)
+        if len(head) < 4 or head[0] != 0xFF:
+            raise ExifFormatError('Corrupted JPEG segment header')
+        marker = head[1]
+        if marker == 0xFF:
+            #  Fill byte, realign by one
+            f.seek(pos + 1)
+            pos += 1
+            continue
+        if marker in (_SOS, _EOI):
+            return 0, 0, bytes_read
+        if marker in _STANDALONE_MARKERS:
+            f.seek(pos + 2)
+            pos += 2
+            continue
+        length = struct.unpack('>H', head[2:4])[0]
+        if marker == _APP1:
+            signature = f.read(6)
+            bytes_read += len(signature)
+            if signature == _EXIF_HEADER:
+                return pos + 10, length - 8, bytes_read
+        pos += 2 + length
+        f.seek(pos)
+    return 0, 0, bytes_read
+
+
+def read_exif_header(file_path: str) -> ExifHeader:
+    """
+    Read EXIF timestamp and camera fields touching only the header region of a file.
+    Args:
+        file_path: path to JPEG or TIFF file
+    Returns:
+        ExifHeader with extracted fields (None where a tag is absent)
+    Raises:
+        ExifFormatError: unsupported format or EXIF structure that cannot be walked
+        OSError: file cannot be read
+    """
+    with open(file_path, 'rb') as f:
+        magic = f.read(2)
+        if magic == _SOI:
+            base, limit, bytes_read = _find_jpeg_exif(f)
+            if not base:
+                return ExifHeader(None, None, None, None, None, None, None, bytes_read)
+        elif magic in (b'II', b'MM'):
+            base, limit, bytes_read = 0, MAX_HEADER_SCAN, 2
+        else:
+            raise ExifFormatError('Neither JPEG nor TIFF')
+        f.seek(base)
+        head = f.read(min(limit, TIFF_HEAD_READ))
+        bytes_read += len(head)
+        if len(head) < 8:
+            raise ExifFormatError('Truncated TIFF header')
+        tiff = _Tiff(head, f, base, limit)
+
+        try:
+            ifd0 = tiff.walk(tiff.first_ifd(), _IFD0_TAGS)
+            exif: Dict[int, object] = {}
+            exif_offset = ifd0.get(TAG_EXIF_IFD)
+            if isinstance(exif_offset, int):
+                exif = tiff.walk(exif_offset, _EXIF_TAGS)
+        except struct.error as e:
+            raise ExifFormatError(f'Truncated IFD: {e}') from e
+
+    def text(tags: Dict[int, object], tag: int) -> Optional[str]:
+        value = tags.get(tag)
+        return value.strip() or None if isinstance(value, str) else None
+
+    def number(tags: Dict[int, object], tag: int) -> Optional[int]:
+        value = tags.get(tag)
+        return value if isinstance(value, int) else None
+
+    return ExifHeader(
+        datetime=text(ifd0, TAG_DATETIME),
+        datetime_original=text(exif, TAG_DATETIME_ORIGINAL),
+        subsec_original=text(exif, TAG_SUBSEC_TIME_ORIGINAL),
+        make=text(ifd0, TAG_MAKE),
+        model=text(ifd0, TAG_MODEL),
+        width=number(exif, TAG_PIXEL_X),
+        height=number(exif, TAG_PIXEL_Y),
+        bytes_read=bytes_read + tiff.extra_read,
+    )
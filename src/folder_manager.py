@@ -6,42 +6,55 @@ import os
 import re
 from typing import Tuple, List, Optional
 
+from journal import JOURNAL_FILE_NAME
+from ledger import LEDGER_NAME, Ledger, result_path
+from manifest import find_jobs, manifest_jobs, manifest_name, manifest_path, read_manifest
+from scanner import DirectoryScans, ScanEntry, list_directory
 
-def has_image_files(folder_path: str) -> bool:
+
+def _listing(folder_path: str, scans: Optional[DirectoryScans]) -> Optional[List[ScanEntry]]:
+    """Single-pass listing of folder, or None if it doesn't exist or isn't a folder."""
+    try:
+        return list_directory(folder_path, scans)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def has_image_files(folder_path: str, scans: Optional[DirectoryScans] = None) -> bool:
     """
     Check if folder contains any image files.
     
     Args:
         folder_path: Path to check for image files
+        scans: Run-wide folder listings to reuse
         
     Returns:
         True if folder contains image files, False otherwise
     """
-    image_extensions = {'.jpg', '.jpeg', '.tiff', '.tif', '.bmp', '.png', '.heic'}
-    
-    if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
+    entries = _listing(folder_path, scans)
+    if entries is None:
         return False
-        
-    for file in os.listdir(folder_path):
-        if os.path.isfile(os.path.join(folder_path, file)):
-            _, ext = os.path.splitext(file)
-            if ext.lower() in image_extensions:
-                return True
-    return False
+    return any(entry.is_image for entry in entries)
 
 
-def find_existing_folders(path_all_storing: str, folder_current_pattern: str) -> List[Tuple[str, int]]:
+def find_existing_folders(
+    path_all_storing: str,
+    folder_current_pattern: str,
+    scans: Optional[DirectoryScans] = None,
+) -> List[Tuple[str, int]]:
     """
     Find all existing folders that match the pattern.
     
     Args:
         path_all_storing: Base directory to search in
         folder_current_pattern: Base pattern for folder names (without increment)
+        scans: Run-wide folder listings to reuse
         
     Returns:
         List of tuples (folder_name, increment_number) sorted by increment
     """
-    if not os.path.exists(path_all_storing):
+    entries = _listing(path_all_storing, scans)
+    if entries is None:
         return []
         
     folders = []
@@ -51,50 +64,96 @@ def find_existing_folders(path_all_storing: str, folder_current_pattern: str) ->
     # Match folders like "!newstack", "!newstack_1", "!newstack_2", etc.
     regex_pattern = rf"^{re.escape(pattern)}(?:_(\d+))?$"
     
-    for item in os.listdir(path_all_storing):
-        item_path = os.path.join(path_all_storing, item)
-        if os.path.isdir(item_path):
-            match = re.match(regex_pattern, item)
+    for entry in entries:
+        if entry.is_dir:
+            match = re.match(regex_pattern, entry.name)
             if match:
                 increment = int(match.group(1)) if match.group(1) else 0
-                folders.append((item, increment))
+                folders.append((entry.name, increment))
                 
     return sorted(folders, key=lambda x: x[1])
 
 
-def get_folder_state(folder_path: str, folder_grouped: str) -> str:
+def stacking_done(folder_path: str, folder_grouped: str) -> bool:
+    """
+    Check if every stack of the grouped folder (or of its manifest) was stacked.
+    
+    Args:
+        folder_path: Path to the grouped photo folder
+        folder_grouped: Name of the grouped folder (e.g., "fs")
+        
+    Returns:
+        True if the results ledger has every stack as stacked; without a ledger
+        (folder stacked before ledgers were kept, or never stacked), if every stack
+        has its result file
+    """
+    path_grouped = os.path.join(folder_path, folder_grouped)
+    path_manifest = manifest_path(folder_path, folder_grouped)
+    try:
+        if os.path.exists(path_manifest):
+            _, stacks = read_manifest(path_manifest)
+            jobs = manifest_jobs(folder_path, stacks, path_grouped)
+            #  Next to the job list of the manifest
+            path_ledger = os.path.join(folder_path, LEDGER_NAME)
+        else:
+            jobs = find_jobs(path_grouped)
+            path_ledger = os.path.join(path_grouped, LEDGER_NAME)
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+    if not os.path.exists(path_ledger):
+        return all(os.path.isfile(result_path(*job)) for job in jobs)
+    return not Ledger(path_ledger).unstacked(jobs)
+
+
+def get_folder_state(
+    folder_path: str, folder_grouped: str, scans: Optional[DirectoryScans] = None
+) -> str:
     """
     Determine the state of a folder for workflow decision.
     
     Args:
         folder_path: Path to the folder to check
         folder_grouped: Name of the grouped folder (e.g., "fs")
+        scans: Run-wide folder listings to reuse
         
     Returns:
-        "completed" - folder has been processed (grouped folder exists)
+        "interrupted" - grouper was interrupted while moving files (move journal exists)
+        "completed" - folder has been processed (grouped folder or its manifest exists
+                      and every stack was stacked)
+        "stacking_incomplete" - folder was grouped but stacks are left to stack (Step 3
+                      failed or never ran)
         "ready_for_grouper" - folder has images but no grouped folder
         "empty" - folder is empty or has no images
         "not_exists" - folder doesn't exist
     """
-    if not os.path.exists(folder_path):
+    entries = _listing(folder_path, scans)
+    if entries is None:
         return "not_exists"
         
-    if not os.path.isdir(folder_path):
-        return "not_exists"
-        
-    grouped_path = os.path.join(folder_path, folder_grouped)
-    has_grouped_folder = os.path.exists(grouped_path) and os.path.isdir(grouped_path)
-    has_images = has_image_files(folder_path)
+    # Both answers come from the same single listing of the folder
+    has_grouped_folder = any(
+        (entry.is_dir and entry.name == folder_grouped) or entry.name == manifest_name(folder_grouped)
+        for entry in entries
+    )
+    has_images = any(entry.is_image for entry in entries)
+    has_journal = any(entry.name == JOURNAL_FILE_NAME for entry in entries)
     
-    if has_grouped_folder:
-        return "completed"
+    if has_journal:
+        return "interrupted"
+    elif has_grouped_folder:
+        return "completed" if stacking_done(folder_path, folder_grouped) else "stacking_incomplete"
     elif has_images:
         return "ready_for_grouper"
     else:
         return "empty"
 
 
-def determine_workflow_action(path_all_storing: str, folder_current_pattern: str, folder_grouped: str) -> Tuple[str, str]:
+def determine_workflow_action(
+    path_all_storing: str,
+    folder_current_pattern: str,
+    folder_grouped: str,
+    scans: Optional[DirectoryScans] = None,
+) -> Tuple[str, str]:
     """
     Determine what action to take based on existing folders.
     
@@ -102,11 +161,13 @@ def determine_workflow_action(path_all_storing: str, folder_current_pattern: str
         path_all_storing: Base directory for all storage
         folder_current_pattern: Pattern for current folder names
         folder_grouped: Name of grouped folder
+        scans: Run-wide folder listings to reuse
         
     Returns:
         Tuple of (action, folder_path) where action is:
         - "run_fetcher": Run fetcher to create new photos in returned folder
         - "run_grouper": Run grouper on existing photos in returned folder
+        - "run_stacker": Stack the stacks left in returned folder
         - "error": Something went wrong
     """
     # Ensure the base storage directory exists
@@ -118,7 +179,7 @@ def determine_workflow_action(path_all_storing: str, folder_current_pattern: str
             return "error", f"Cannot create storage directory: {e}"
     
     # Find existing folders
-    existing_folders = find_existing_folders(path_all_storing, folder_current_pattern.lstrip('/'))
+    existing_folders = find_existing_folders(path_all_storing, folder_current_pattern.lstrip('/'), scans)
     
     if not existing_folders:
         # No folders exist, create the first one
@@ -131,7 +192,7 @@ def determine_workflow_action(path_all_storing: str, folder_current_pattern: str
     last_folder_name, last_increment = existing_folders[-1]
     last_folder_path = os.path.join(path_all_storing, last_folder_name)
     
-    state = get_folder_state(last_folder_path, folder_grouped)
+    state = get_folder_state(last_folder_path, folder_grouped, scans)
     
     if state == "completed":
         # Last folder is completed, create next one
@@ -141,8 +202,14 @@ def determine_workflow_action(path_all_storing: str, folder_current_pattern: str
         next_folder_path = os.path.join(path_all_storing, next_folder_name)
         return "run_fetcher", next_folder_path
         
-    elif state == "ready_for_grouper":
-        # Last folder has images but no grouped folder, run grouper
+    elif state == "stacking_incomplete":
+        # Last folder was grouped but not all of its stacks were stacked: resume
+        # Step 3, the results ledger skips stacks already stacked
+        return "run_stacker", last_folder_path
+        
+    elif state in ("ready_for_grouper", "interrupted"):
+        # Last folder has images but no grouped folder, or its grouping was
+        # interrupted: run grouper, it resumes from the move journal
         return "run_grouper", last_folder_path
         
     elif state == "empty":
@@ -0,0 +1,180 @@
+"""
+Cache of decoded frames on disk, shared by stacking runs and worker processes.
+
+Decoding the source JPEGs is most of the cost of re-running a stack after changing
+blending parameters or after a crash. The cache keeps decoded frames as raw `.npy`
+files in a cache directory, one per entry, named after the BLAKE2b digest of the
+source file contents and the decode parameters (reduced size), so a renamed or
+copied file still hits and an edited one misses. Hits are memory-mapped read-only:
+pages come from the OS page cache, nothing is copied into the process.
+
+Entries are written under a temporary name and renamed, so processes sharing the
+directory see whole entries or none. Every hit touches the entry modification time;
+after a store, least recently used entries are removed until the directory fits
+the byte budget. An entry removed by another process while mapped here stays
+readable until unmapped.
+
+Any array can be stored under a key of the caller's (`get`, `put`); `load` is the
+frame loader of the native stacker (`load_image` with the cache in front).
+"""
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from image_loader import load_image
+from transfer import file_digest
+from user_dirs import make_private_dir, user_temp_dir
+
+#  Default cache directory, per user in the system temporary folder
+CACHE_FOLDER_NAME = 'pyfocusstack-frames'
+
+#  Default byte budget of the cache directory, megabytes
+DEFAULT_CACHE_MB = 4096
+
+#  Extension of entries; files being written end with '.tmp'
+ENTRY_SUFFIX = '.npy'
+
+#  Room for the header of an entry over its pixels, bytes
+HEADER_BYTES = 128
+
+
+class CacheStats(NamedTuple):
+    """Lookups of this cache object: served from disk, decoded and stored, evictions."""
+
+    hits: int
+    misses: int
+    evicted: int
+
+
+def default_cache_dir() -> str:
+    return user_temp_dir(CACHE_FOLDER_NAME)
+
+
+class FrameCache:
+    """Directory of decoded frames as `.npy` files, LRU-evicted under a byte budget."""
+
+    def __init__(self, folder: Optional[str] = None, budget: int = DEFAULT_CACHE_MB << 20) -> None:
+        """
+        Args:
+            folder: cache directory, created if missing; `default_cache_dir()`, private
+                to the user, if None
+            budget: bytes of entries kept in the directory
+        """
+        self.budget = budget
+        if folder is None:
+            self.folder = make_private_dir(default_cache_dir())
+        else:
+            self.folder = folder
+            os.makedirs(self.folder, exist_ok=True)
+        self._digests: Dict[Tuple[str, int, int], str] = {}
+        self._hits = 0
+        self._misses = 0
+        self._evicted = 0
+
+    def content_key(self, path: str) -> str:
+        """
+        Digest of file contents, computed once per file version in this process.
+        Raises:
+            OSError: file can't be read
+        """
+        stat = os.stat(path)
+        identity = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(identity)
+        if digest is None:
+            digest = self._digests[identity] = file_digest(path).hex()[:40]
+        return digest
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.folder, key + ENTRY_SUFFIX)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Stored array as a read-only memmap, None if there is none."""
+        path = self.entry_path(key)
+        try:
+            array = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            #  Missing, evicted meanwhile by another process, or not a whole entry
+            return None
+        self._hits += 1
+        return array
+
+    def put(self, key: str, array: np.ndarray) -> np.ndarray:
+        """
+        Store array, evicting least recently used entries to keep the budget.
+        Returns:
+            stored array as a read-only memmap, or `array` itself if it alone is over
+            the budget (then it is not stored)
+        """
+        self._misses += 1
+        if array.nbytes + HEADER_BYTES > self.budget:
+            return array
+        self.evict(self.budget - array.nbytes - HEADER_BYTES)
+        path = self.entry_path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(array), allow_pickle=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            #  Cache is best effort: a full disk must not fail the stack
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return array
+        return np.load(path, mmap_mode='r')
+
+    def load(self, path: str, max_size: int = 0) -> np.ndarray:
+        """
+        Decoded frame, from the cache or decoded by `load_image` and stored.
+        Raises:
+            OSError: file can't be read or decoded
+        """
+        key = f'{self.content_key(path)}-{max_size}' if max_size else self.content_key(path)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        return self.put(key, load_image(path, max_size))
+
+    def size(self) -> int:
+        """Bytes of entries in the directory."""
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self) -> List[Tuple[int, int, str]]:
+        """(mtime, size, path) of entries, of every process."""
+        entries = []
+        with os.scandir(self.folder) as scan:
+            for entry in scan:
+                if not entry.name.endswith(ENTRY_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
+
+    def evict(self, keep: int) -> int:
+        """
+        Remove least recently used entries until at most `keep` bytes are left.
+        Returns:
+            number of entries removed
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= keep:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                #  Evicted by another process
+                pass
+            total -= size
+        self._evicted += removed
+        return removed
+
+    def stats(self) -> CacheStats:
+        return CacheStats(self._hits, self._misses, self._evicted)
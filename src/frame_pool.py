@@ -0,0 +1,154 @@
+"""
+Pool of shared-memory frame buffers for passing frames between processes.
+
+Pickling a decoded 24 MP frame through a multiprocessing queue copies 72 MB twice
+and costs more than decoding it. With the pool, the owning process creates a fixed
+set of `multiprocessing.shared_memory` segments (slots) once, leases a free slot
+to a worker as a FrameHandle (segment name, shape, dtype: a few dozen bytes
+pickled), the worker writes the pixels into the segment in place, and the owner
+reads them from there and returns the slot to the free list when done.
+
+Only the owner creates, leases, releases and unlinks segments. A worker that dies
+with a leased slot loses nothing: the owner releases the lease when the worker's
+task fails, and `close` unlinks every segment, leased or not. If the owner itself
+dies, the multiprocessing resource tracker unlinks the segments it registered.
+"""
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Deque, Dict, Iterator, NamedTuple, Tuple
+
+import numpy as np
+
+
+class FrameHandle(NamedTuple):
+    """What a worker gets instead of pixels: slot segment name and array layout."""
+
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+
+class PoolExhaustedError(Exception):
+    """Raised when every slot is leased."""
+
+
+class FramePool:
+    """Fixed set of shared-memory slots of equal size, with a free list, owned by one process."""
+
+    def __init__(self, slots: int, slot_bytes: int) -> None:
+        """
+        Args:
+            slots: number of buffers
+            slot_bytes: size of every buffer, bytes
+        """
+        if slots < 1 or slot_bytes < 1:
+            raise ValueError('Frame pool needs at least one slot of at least one byte')
+        self.slot_bytes = slot_bytes
+        self._segments: Dict[str, shared_memory.SharedMemory] = {}
+        self._free: Deque[str] = deque()
+        self._leased: Dict[str, FrameHandle] = {}
+        try:
+            for _ in range(slots):
+                segment = shared_memory.SharedMemory(create=True, size=slot_bytes)
+                self._segments[segment.name] = segment
+                self._free.append(segment.name)
+        except OSError:
+            self.close()
+            raise
+
+    @property
+    def slots(self) -> int:
+        return len(self._segments)
+
+    @property
+    def free(self) -> int:
+        return len(self._free)
+
+    def acquire(self, shape: Tuple[int, ...], dtype: str = 'uint8') -> FrameHandle:
+        """
+        Lease a free slot for an array of `shape` and `dtype`.
+        Raises:
+            PoolExhaustedError: every slot is leased
+            ValueError: array doesn't fit a slot
+        """
+        handle = FrameHandle('', tuple(int(n) for n in shape), np.dtype(dtype).str)
+        if handle.nbytes > self.slot_bytes:
+            raise ValueError(f'Frame of {handle.nbytes} bytes does not fit {self.slot_bytes}-byte slots')
+        if not self._free:
+            raise PoolExhaustedError(f'All {self.slots} frame slots are in use')
+        handle = handle._replace(name=self._free.popleft())
+        self._leased[handle.name] = handle
+        return handle
+
+    def release(self, handle: FrameHandle) -> None:
+        """
+        Return leased slot to the free list.
+        Raises:
+            ValueError: slot is not leased (released twice, or of another pool)
+        """
+        if self._leased.pop(handle.name, None) is None:
+            raise ValueError(f'Frame slot {handle.name} is not leased')
+        self._free.append(handle.name)
+
+    def view(self, handle: FrameHandle) -> np.ndarray:
+        """Array over leased slot in the owning process, valid until the slot is released."""
+        if handle.name not in self._leased:
+            raise ValueError(f'Frame slot {handle.name} is not leased')
+        buffer = self._segments[handle.name].buf
+        return np.ndarray(handle.shape, np.dtype(handle.dtype), buffer=buffer)
+
+    def close(self) -> None:
+        """Release and unlink every segment; views of the pool must be dropped first."""
+        segments, self._segments = self._segments, {}
+        self._free.clear()
+        self._leased.clear()
+        for segment in segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                #  A view is still alive: the mapping goes with it, the name goes now
+                pass
+            segment.unlink()
+
+    def __enter__(self) -> 'FramePool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+@contextmanager
+def open_frame(handle: FrameHandle) -> Iterator[np.ndarray]:
+    """
+    Array over slot of `handle` in a worker process, writable in place; the segment
+    is detached when the block ends, and arrays over it must not outlive the block.
+    Raises:
+        FileNotFoundError: pool was closed
+    """
+    segment = shared_memory.SharedMemory(name=handle.name)
+    try:
+        yield np.ndarray(handle.shape, np.dtype(handle.dtype), buffer=segment.buf)
+    finally:
+        try:
+            segment.close()
+        except BufferError:
+            #  Caller still holds an array: the mapping is unmapped when it is collected
+            pass
+
+
+def write_frame(handle: FrameHandle, image: np.ndarray) -> None:
+    """
+    Copy image into slot of `handle`, in a worker process.
+    Raises:
+        ValueError: image shape differs from the handle one
+    """
+    if image.shape != handle.shape:
+        raise ValueError(f'Frame of shape {image.shape} does not match slot shape {handle.shape}')
+    with open_frame(handle) as array:
+        np.copyto(array, image, casting='unsafe')
+        del array
@@ -10,16 +10,46 @@
 
 # You should have received a copy of the GNU General Public License along with this
 # program.  If not, see <https://www.gnu.org/licenses/>.
-"""This is the only file needed to run ultimate_focusstacking_with_apple_and_adobe. Check settings before using."""
+"""This is the only file needed to run ultimate_focusstacking_with_apple_and_adobe. Check settings before using.
 
+Can be used as a library: `run_grouping` groups a folder in-process, returns
+`GroupingResult` and raises `GroupingError` subclasses instead of exiting.
+"""
+
+import argparse
+import contextlib
+import heapq
 import operator
 import os
+import shutil
 import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
 
 import piexif
 
+from exif_reader import (
+    TAG_DATETIME,
+    TAG_DATETIME_ORIGINAL,
+    TAG_MAKE,
+    TAG_MODEL,
+    TAG_PIXEL_X,
+    TAG_PIXEL_Y,
+    TAG_SUBSEC_TIME_ORIGINAL,
+    ExifFormatError,
+    ExifHeader,
+    parse_exif_datetime,
+    read_exif_header,
+)
+from journal import JournalState, MoveJournal, journal_path, read_journal
+from manifest import ManifestStack, manifest_path, write_manifest
+from metadata_cache import CacheKey, MetadataCache, close_cache, open_cache
+from photo_model import PhotoRecord, PhotoTable, Stack, parse_subsec, to_seconds
+from scanner import DirectoryScans, ScanEntry, image_entries, list_directory
+from transfer import DEFAULT_WORKERS, PART_SUFFIX, TransferEngine, TransferReport, is_completed_copy
+
 #  Name of the future root folder where stacks will be located
 FOLDER_NAME_ROOT = 'fs'
 
@@ -32,254 +62,1294 @@ MIN_STACK_LEN = 5
 #  If stack larger than this, program will print warning message, but create stack
 LENGTH_STACK_WARNING = 10
 
-#  Datetime format used in cameras exif
-TIMESTAMP_FORMAT_EXIF = '%Y:%m:%d %H:%M:%S'
+#  Number of files to hand to one process-pool task at once
+PROCESS_CHUNKSIZE = 32
+
+#  Photos buffered by streaming grouper to restore time order of files read by name
+REORDER_WINDOW = 64
+
+#  Grouping engines: plain Python loop or NumPy arrays (large archives)
+ENGINE_PYTHON = 'python'
+ENGINE_NUMPY = 'numpy'
+
+#  Metadata cache file, created in storage root (parent of the processed folder)
+CACHE_FILE_NAME = '.fs_metadata_cache.sqlite'
 
+#  Grouping modes: move files into 'fs' stack folders, only write stack manifest
+#  'fs.json', or build the 'fs' tree of hard links / symbolic links to the files
+MODE_MOVE = 'move'
+MODE_MANIFEST = 'manifest'
+MODE_HARDLINK = 'hardlink'
+MODE_SYMLINK = 'symlink'
+GROUPING_MODES = (MODE_MOVE, MODE_MANIFEST, MODE_HARDLINK, MODE_SYMLINK)
 
-def read_jpg(jpg_folder: str) -> Tuple[List[str], List[datetime]]:
+#  Link modes build 'fs' tree under this name first and rename it when complete
+STAGING_FOLDER_NAME = f'.{FOLDER_NAME_ROOT}.partial'
+
+#  Metadata cache modes
+CACHE_ON = 'on'
+CACHE_OFF = 'off'
+CACHE_REBUILD = 'rebuild'
+
+
+class GroupingError(Exception):
     """
-    Read names of image files in source folder and timestamps when they were taken.
+    Grouper can't proceed. Message lines are printed by `report`, `exit_code` is the
+    exit status of grouper.py command line.
+    """
+
+    exit_code = 1
+
+    def report(self) -> None:
+        """Print error in grouper's console format."""
+        print(f'\n🚨 CRITICAL ERROR 🚨')
+        for line in str(self).splitlines():
+            print(f'❌ {line}')
+
+
+class NoImageFilesError(GroupingError):
+    """Source folder has no image files."""
+
+    def report(self) -> None:
+        print(f'\n{self}! Exit')
+
+
+class NoValidTimestampsError(GroupingError):
+    """No image file has a valid EXIF timestamp."""
+
+
+class NoStacksError(GroupingError):
+    """Photos were read, but none of them form a stack."""
+
+    exit_code = 2
+
+    def report(self) -> None:
+        print(f'{self}! Exit')
+
+
+class FolderExistsError(GroupingError):
+    """'fs' folder or a stack folder exists already, moving could overwrite files."""
+
+
+class MoveError(GroupingError):
+    """File of a stack could not be moved."""
+
+
+class GroupingResult(NamedTuple):
+    """
+    Outcome of grouping one folder.
+    Attributes:
+        folder: source folder
+        table: photos with valid timestamps in time order (rows of `stacks`)
+        stacks: created stacks
+        stack_paths: created stack folders, in order of `stacks`
+        skipped_files: files left out (no valid timestamp, out of time order)
+        stack_stat: statistics on stack sizes {size: count}
+        timings: seconds spent per stage ('read', 'group', 'move' or 'first_stack'
+            in streaming mode) and 'total'
+        transfer: totals of file moves of the run, throughput of cross-device copies
+    """
+
+    folder: str
+    table: PhotoTable
+    stacks: List[Stack]
+    stack_paths: List[str]
+    skipped_files: List[str]
+    stack_stat: Dict[int, int]
+    timings: Dict[str, float]
+    transfer: Optional[TransferReport] = None
+
+    @property
+    def file_count(self) -> int:
+        return sum(len(stack) for stack in self.stacks)
+
+
+def _piexif_header(file_path: str) -> ExifHeader:
+    """
+    Read EXIF header fields with piexif. Slow path for files `read_exif_header` can't walk.
+    Args:
+        file_path: path to image file
+    Returns:
+        ExifHeader with extracted fields
+    """
+    exif_dict = piexif.load(file_path)
+
+    def text(ifd: str, tag: int) -> Optional[str]:
+        value = exif_dict.get(ifd, {}).get(tag)
+        if value is None:
+            return None
+        # Proper EXIF datetime decoding
+        if isinstance(value, bytes):
+            value = value.decode('ascii', 'replace').rstrip('\x00')
+        return str(value).strip() or None
+
+    def number(ifd: str, tag: int) -> Optional[int]:
+        value = exif_dict.get(ifd, {}).get(tag)
+        return value if isinstance(value, int) else None
+
+    return ExifHeader(
+        datetime=text('0th', TAG_DATETIME),
+        datetime_original=text('Exif', TAG_DATETIME_ORIGINAL),
+        subsec_original=text('Exif', TAG_SUBSEC_TIME_ORIGINAL),
+        make=text('0th', TAG_MAKE),
+        model=text('0th', TAG_MODEL),
+        width=number('Exif', TAG_PIXEL_X),
+        height=number('Exif', TAG_PIXEL_Y),
+        bytes_read=os.path.getsize(file_path),
+    )
+
+
+def read_header(file_path: str) -> ExifHeader:
+    """
+    Read EXIF header fields of image. Header-only EXIF reader is tried first,
+    piexif is used only if the file can't be walked by it (unusual layout/format).
+    Args:
+        file_path: path to image file
+    Returns:
+        ExifHeader with extracted fields
+    """
+    try:
+        return read_exif_header(file_path)
+    except ExifFormatError:
+        return _piexif_header(file_path)
+
+
+def header_timestamp(header: ExifHeader) -> Optional[datetime]:
+    """
+    Moment image was taken according to its EXIF header.
+    Args:
+        header: EXIF header fields
+    Returns:
+        DateTime (falling back to DateTimeOriginal) or None if header has no timestamp
+    """
+    date_str = header.datetime or header.datetime_original
+    if date_str is None:
+        return None
+    return parse_exif_datetime(date_str)
+
+
+def read_timestamp(file_path: str) -> Optional[datetime]:
+    """
+    Read the moment image was taken.
+    Args:
+        file_path: path to image file
+    Returns:
+        DateTime (falling back to DateTimeOriginal) or None if file has no timestamp
+    """
+    return header_timestamp(read_header(file_path))
+
+
+def _extract_header(file_path: str) -> Tuple[Optional[ExifHeader], Optional[str]]:
+    """
+    Pool worker: read EXIF header of one file, never raising.
+    Args:
+        file_path: path to image file
+    Returns:
+        header (None if unreadable) & error message if reading failed
+    """
+    try:
+        return read_header(file_path), None
+    except Exception as e:
+        return None, str(e)
+
+
+def extract_headers(
+    paths: List[str], workers: int = 1, use_processes: bool = False
+) -> Iterator[Tuple[Optional[ExifHeader], Optional[str]]]:
+    """
+    Read EXIF headers of files, concurrently if `workers` > 1. Results are produced in
+    the order of `paths` whatever order the workers finish in.
+    Args:
+        paths: paths to image files
+        workers: number of concurrent readers, 1 reads files one by one
+        use_processes: use process pool (CPU-bound parsing) instead of threads (I/O-bound
+            volumes, network shares, USB disks)
+    Returns:
+        iterator over (header, error message) pairs, see `_extract_header`
+    """
+    if workers <= 1 or len(paths) <= 1:
+        yield from map(_extract_header, paths)
+        return
+    executor: Executor
+    if use_processes:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        chunksize = PROCESS_CHUNKSIZE
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        chunksize = 1
+    with executor:
+        yield from executor.map(_extract_header, paths, chunksize=chunksize)
+
+
+def read_headers(
+    entries: List[ScanEntry],
+    workers: int = 1,
+    use_processes: bool = False,
+    cache: Optional[MetadataCache] = None,
+) -> Iterator[Tuple[Optional[ExifHeader], Optional[str]]]:
+    """
+    Read EXIF headers of files, serving unchanged files from metadata cache and
+    storing freshly read headers into it.
+    Args:
+        entries: scanned image files, their size & mtime are the cache key
+        workers: number of concurrent readers for files missing in cache
+        use_processes: read EXIF in process pool instead of thread pool
+        cache: opened metadata cache or None to read every file
+    Returns:
+        iterator over (header, error message) pairs in the order of `entries`
+    """
+    if cache is None:
+        yield from extract_headers([entry.path for entry in entries], workers, use_processes)
+        return
+    keys = [CacheKey(entry.path, entry.size, entry.mtime_ns) for entry in entries]
+    cached = cache.lookup(keys)
+    missing = [key for key, header in zip(keys, cached) if header is None]
+    fresh = zip(missing, extract_headers([key.path for key in missing], workers, use_processes))
+    for header in cached:
+        if header is not None:
+            yield header, None
+            continue
+        key, (header, error) = next(fresh)
+        if header is not None:
+            cache.store(key, header)
+        yield header, error
+
+
+def scan_images(jpg_folder: str, scans: Optional[DirectoryScans] = None) -> List[ScanEntry]:
+    """
+    List image files in source folder.
     Args:
         jpg_folder: path to folder where image files are stored
+        scans: run-wide folder listings to reuse, None to list folder anew
     Returns:
-        list of names & list of datetimes (synchronized pairs)
+        scanned image files in name order
+    Raises:
+        NoImageFilesError: there are no image files
+        GroupingError: folder can't be listed
     """
     print('\nRead image files...', end='')
-    
-    # Supported image file extensions
-    image_extensions = {'.jpg', '.jpeg', '.tiff', '.tif', '.bmp', '.png', '.heic'}
-    
-    names = []
-    for file in os.listdir(jpg_folder):
-        if os.path.isfile(os.path.join(jpg_folder, file)):
-            _, ext = os.path.splitext(file)
-            if ext.lower() in image_extensions:
-                names.append(file)
-    
-    names = sorted(names)
 
-    if len(names) != 0:
-        print(f'ok.\nGot {len(names)} image files in folder')
-    else:
-        print('\nNo image files in folder! Exit')
-        sys.exit(1)
+    try:
+        entries = image_entries(list_directory(jpg_folder, scans))
+    except OSError as e:
+        raise GroupingError(f'CANNOT LIST FOLDER: {jpg_folder}\n{e}') from e
 
-    # Extract timestamps with error handling
-    photo_data = []
-    skipped_files = []
-    
-    for name in names:
-        try:
-            file_path = os.path.join(jpg_folder, name)
-            exif_dict = piexif.load(file_path)
-            
-            # Check if EXIF has DateTime tag
-            if '0th' in exif_dict and 306 in exif_dict['0th']:
-                date_bytes = exif_dict['0th'][306]
-                # Proper EXIF datetime decoding
-                if isinstance(date_bytes, bytes):
-                    date_str = date_bytes.decode('ascii').rstrip('\x00')
-                else:
-                    date_str = str(date_bytes).strip()
-                
-                date_obj = datetime.strptime(date_str, TIMESTAMP_FORMAT_EXIF)
-                photo_data.append((name, date_obj))
-            else:
-                print(f'\n⚠️  WARNING: No DateTime EXIF data in {name} - skipping file')
-                skipped_files.append(name)
-                
-        except Exception as e:
+    if len(entries) == 0:
+        raise NoImageFilesError('No image files in folder')
+    print(f'ok.\nGot {len(entries)} image files in folder')
+    return entries
+
+
+def iter_records(
+    entries: List[ScanEntry],
+    workers: int = 1,
+    use_processes: bool = False,
+    cache: Optional[MetadataCache] = None,
+    skipped_files: Optional[List[str]] = None,
+) -> Iterator[PhotoRecord]:
+    """
+    Read timestamps of image files as they arrive from EXIF readers, in name order.
+    Files without valid timestamp are reported and left out.
+    Args:
+        entries: scanned image files
+        workers: number of concurrent EXIF readers
+        use_processes: read EXIF in process pool instead of thread pool
+        cache: metadata cache to serve unchanged files from, None to read every file
+        skipped_files: list to collect names of skipped files into
+    Returns:
+        iterator over photo records
+    """
+    if skipped_files is None:
+        skipped_files = []
+    for entry, (header, error) in zip(
+        entries, read_headers(entries, workers, use_processes, cache)
+    ):
+        name = entry.name
+        date_obj = None
+        if header is not None:
+            try:
+                date_obj = header_timestamp(header)
+            except ValueError as e:
+                error = str(e)
+        if date_obj is not None:
+            camera = ' '.join(filter(None, (header.make, header.model)))  # type: ignore
+            yield PhotoRecord(
+                name,
+                entry.path,
+                entry.size,
+                to_seconds(date_obj),
+                parse_subsec(header.subsec_original),  # type: ignore
+                camera,
+            )
+        elif error is None:
+            print(f'\n⚠️  WARNING: No DateTime EXIF data in {name} - skipping file')
+            skipped_files.append(name)
+        else:
             print(f'\n🚨 CRITICAL EXIF ERROR 🚨')
             print(f'❌ FAILED TO READ EXIF FROM: {name}')
-            print(f'❌ ERROR: {str(e)}')
+            print(f'❌ ERROR: {error}')
             print(f'❌ THIS FILE WILL BE SKIPPED')
             skipped_files.append(name)
-    
-    if not photo_data:
-        print(f'\n🚨 CRITICAL ERROR 🚨')
-        print(f'❌ NO FILES WITH VALID EXIF TIMESTAMPS FOUND!')
-        print(f'❌ CANNOT PROCEED WITH FOCUS STACKING')
-        sys.exit(1)
-    
+
+
+def report_timestamps(
+    photo_count: int, skipped_files: List[str], cache: Optional[MetadataCache]
+) -> None:
+    """
+    Print summary of timestamp reading.
+    Args:
+        photo_count: number of files with valid timestamps
+        skipped_files: names of files without valid timestamps
+        cache: metadata cache used for reading, if any
+    Raises:
+        NoValidTimestampsError: no file had a valid timestamp
+    """
+    if not photo_count:
+        raise NoValidTimestampsError(
+            'NO FILES WITH VALID EXIF TIMESTAMPS FOUND!\nCANNOT PROCEED WITH FOCUS STACKING'
+        )
+
     if skipped_files:
         print(f'\n⚠️  Skipped {len(skipped_files)} files without valid EXIF timestamps')
+
+    if cache is not None:
+        print(f'Metadata cache: {cache.hits} files unchanged, {cache.misses} files read')
+
+
+def read_jpg(
+    jpg_folder: str,
+    workers: int = 1,
+    use_processes: bool = False,
+    cache: Optional[MetadataCache] = None,
+    scans: Optional[DirectoryScans] = None,
+    skipped_files: Optional[List[str]] = None,
+) -> PhotoTable:
+    """
+    Read names of image files in source folder and timestamps when they were taken.
+    Args:
+        jpg_folder: path to folder where image files are stored
+        workers: number of concurrent EXIF readers
+        use_processes: read EXIF in process pool instead of thread pool
+        cache: metadata cache to serve unchanged files from, None to read every file
+        scans: run-wide folder listings to reuse, None to list folder anew
+        skipped_files: list to collect names of skipped files into
+    Returns:
+        table of photos with valid timestamps, sorted by time
+    Raises:
+        NoImageFilesError, NoValidTimestampsError
+    """
+    entries = scan_images(jpg_folder, scans)
+
+    # Extract timestamps with error handling
+    if skipped_files is None:
+        skipped_files = []
+    table = PhotoTable(jpg_folder)
+    for record in iter_records(entries, workers, use_processes, cache, skipped_files):
+        table.append(record)
+    report_timestamps(len(table), skipped_files, cache)
     
-    # Sort by timestamp to maintain name-date synchronization
-    photo_data.sort(key=lambda x: x[1])
-    names, dates = zip(*photo_data)
-    names, dates = list(names), list(dates)
+    # Sort by timestamp, photos taken in the same second stay in name order
+    table = table.sorted_by_time()
 
     print(
-        f'Got {len(dates)} valid timestamps in image files\nFROM: {dates[0]} \nTO  : {dates[-1]}\n'
+        f'Got {len(table)} valid timestamps in image files\n'
+        f'FROM: {table.datetime(0)} \nTO  : {table.datetime(len(table) - 1)}\n'
     )
 
-    return names, dates
+    return table
+
+
+def keep_stack(stack: Stack, stack_stat: Dict[int, int]) -> bool:
+    """
+    Decide if 'closed' jpg-filenames-list is long enough to become a stack, and refresh
+    statistics on stack lenghts.
+    Args:
+        stack: current ended ('closed') stack
+        stack_stat: dict with statistics on stack sizes
+    Returns:
+        True if stack should be created
+    """
+    if len(stack) < MIN_STACK_LEN:
+        return False
+    stack_stat[len(stack)] = stack_stat.get(len(stack), 0) + 1
+    if len(stack) > LENGTH_STACK_WARNING:
+        print(f'Strange long stack ({len(stack)}) elements. From {stack[0]} to {stack[-1]}')
+    return True
+
+
+def print_stack_stat(stack_stat: Dict[int, int]) -> None:
+    """Prettyprint statistics on stack sizes."""
+    for stacksize, stackcount in sorted(stack_stat.items(), key=operator.itemgetter(0)):
+        spacer = ' ' if stacksize < 10 else ''
+        print(f'Stack size {spacer}{stacksize} files: {stackcount} stacks')
 
 
-def get_stacks(names: List[str], dates: List[datetime]) -> List[List[str]]:
+def get_stacks(table: PhotoTable, stack_stat: Optional[Dict[int, int]] = None) -> List[Stack]:
     """
-    Main function, creating list of stacks (list of lists) and print statistics on size
-    of stacks.
+    Main function, creating list of stacks and print statistics on size of stacks.
     Args:
-        names: list of photo names
-        dates: list of dates from photos
+        table: photos sorted by time
+        stack_stat: dict to collect statistics on stack sizes into
     Returns:
-        List of stacks
-    """
-
-    def done_stack(
-        stacks: List[List[str]],
-        stack_stat: Dict[int, int],
-        stack: List[str],
-    ) -> Tuple[List[List[str]], Dict[int, int]]:
-        """
-        Function to send new 'closed' jpg-filenames-list (stack) to list of stacks if
-        needed, and refresh statistics on stack lenghts.
-        Args:
-            stacks: list of stacks
-            stack_stat: dict with statistics on stack sizes
-            stack: current ended ('closed') stack
-        Returns:
-            renewed list of stacks & renewed statistics
-        """
-        if len(stack) >= MIN_STACK_LEN:
+        List of stacks, each a view of rows of `table`
+    """
+    stacks: List[Stack] = []
+    if stack_stat is None:
+        stack_stat = {}
+    max_delta = MAX_TIME_DELTA.total_seconds()
+    timestamps = table.timestamps
+
+    start = 0
+    for i in range(1, len(timestamps) + 1):
+        if i < len(timestamps) and timestamps[i] - timestamps[i - 1] <= max_delta:
+            #  Dates near each other -> photo belongs to current stack
+            continue
+        #  Dates far from each other (or photos are over) -> close current stack
+        stack = Stack(table, start, i)
+        if keep_stack(stack, stack_stat):
             stacks.append(stack)
-            stack_stat[len(stack)] = stack_stat.get(len(stack), 0) + 1
-            if len(stack) > LENGTH_STACK_WARNING:
-                print(
-                    f'Strange long stack ({len(stack)}) elements. From {stack[0]} to {stack[-1]}'
-                )
-        return stacks, stack_stat
-
-    stack = []
-    stacks: List[List[str]] = []
-    stack_stat: Dict[int, int] = {}
+        start = i
+
+    #  Below just prettyprint
+    print_stack_stat(stack_stat)
+    return stacks
+
+
+def get_stacks_vectorized(
+    table: PhotoTable, stack_stat: Optional[Dict[int, int]] = None
+) -> List[Stack]:
+    """
+    Same as `get_stacks`, computed by NumPy engine (see vector_grouper.py) for archives
+    of hundreds of thousands of photos.
+    Args:
+        table: photos sorted by time
+        stack_stat: dict to collect statistics on stack sizes into
+    Returns:
+        List of stacks, each a view of rows of `table`
+    """
+    #  NumPy is imported only when this engine is selected
+    import vector_grouper
+
+    ranges, vector_stat = vector_grouper.group(
+        table.names,
+        table.timestamps,
+        MAX_TIME_DELTA.total_seconds(),
+        MIN_STACK_LEN,
+        LENGTH_STACK_WARNING,
+    )
+    if stack_stat is not None:
+        stack_stat.update(vector_stat)
+    print_stack_stat(vector_stat)
+    return [
+        Stack(table, start, end)
+        for start, end in zip(ranges.starts.tolist(), ranges.ends.tolist())
+    ]
+
+
+def iter_stacks(
+    records: Iterable[PhotoRecord],
+    table: PhotoTable,
+    stack_stat: Dict[int, int],
+    reorder_window: int = REORDER_WINDOW,
+    late_files: Optional[List[str]] = None,
+) -> Iterator[Stack]:
+    """
+    Streaming counterpart of `get_stacks`: yield every stack as soon as a time gap
+    larger than MAX_TIME_DELTA closes it, while photos are still being read.
+    Photos may arrive slightly out of time order (files are read in name order): they
+    pass a reorder buffer of `reorder_window` photos. A photo older than one already
+    released from the buffer can't be placed any more and is left out with a warning.
+    Args:
+        records: photos in arrival order
+        table: empty table, released photos are appended to it in time order
+        stack_stat: dict to collect statistics on stack sizes into
+        reorder_window: size of reorder buffer, 0 if photos arrive sorted by time
+        late_files: list to collect names of photos that came too late
+    Returns:
+        iterator over stacks, views of rows of `table`
+    """
+    #  Ties are broken by name, as in the stable sort of name-ordered `read_jpg` output
+    buffer: List[Tuple[int, str, PhotoRecord]] = []
+    released: Optional[int] = None
+    max_delta = MAX_TIME_DELTA.total_seconds()
+    start = len(table)
+
+    def release() -> Iterator[Stack]:
+        nonlocal released, start
+        timestamp, _, record = heapq.heappop(buffer)
+        if released is not None and timestamp - released > max_delta:
+            stack = Stack(table, start, len(table))
+            if keep_stack(stack, stack_stat):
+                yield stack
+            start = len(table)
+        table.append(record)
+        released = timestamp
+
+    for record in records:
+        if released is not None and record.timestamp < released:
+            print(f'\n⚠️  WARNING: {record.name} is out of time order beyond reorder window - skipping file')
+            if late_files is not None:
+                late_files.append(record.name)
+            continue
+        heapq.heappush(buffer, (record.timestamp, record.name, record))
+        if len(buffer) > reorder_window:
+            yield from release()
+
+    while buffer:
+        yield from release()
+    stack = Stack(table, start, len(table))
+    if stack and keep_stack(stack, stack_stat):
+        yield stack
+
+
+def check_root_folder(jpg_folder: str) -> str:
+    """
+    Make sure neither 'fs' folder nor stack manifest exist yet. An empty 'fs' symlink
+    is accepted: it points stacks to another volume (files are copied there then).
+    Args:
+        jpg_folder: folder with image files
+    Returns:
+        path of future 'fs' folder
+    Raises:
+        FolderExistsError: 'fs' folder or stack manifest exists
+    """
+    fs_folder_path = os.path.join(jpg_folder, FOLDER_NAME_ROOT)
+    prepared_target = (
+        os.path.islink(fs_folder_path)
+        and os.path.isdir(fs_folder_path)
+        and not os.listdir(fs_folder_path)
+    )
+    manifest = manifest_path(jpg_folder, FOLDER_NAME_ROOT)
+    if os.path.exists(manifest):
+        raise FolderExistsError(
+            f'STACK MANIFEST ALREADY EXISTS!\n'
+            f'PATH: {manifest}\n'
+            f'CANNOT PROCEED - THIS INDICATES PHOTOS WERE ALREADY PROCESSED'
+        )
+    if os.path.exists(fs_folder_path) and not prepared_target:
+        raise FolderExistsError(
+            f'FOLDER "{FOLDER_NAME_ROOT}" ALREADY EXISTS!\n'
+            f'PATH: {fs_folder_path}\n'
+            f'CANNOT PROCEED - THIS INDICATES PHOTOS WERE ALREADY PROCESSED\n'
+            f'PLEASE REMOVE THE FOLDER OR USE A DIFFERENT DIRECTORY'
+        )
+    return fs_folder_path
+
+
+def stack_dirname(stack: Sequence[str]) -> str:
+    """Name of stack folder: {FIRST_FILE}_to_{LAST_FILE} without extensions."""
+
+    # Safer filename handling for folder naming
+    def safe_filename_for_folder(filename):
+        name, ext = os.path.splitext(filename)
+        return name if name else filename
+
+    first_name = safe_filename_for_folder(stack[0])
+    last_name = safe_filename_for_folder(stack[-1])
+    return f"{first_name}_to_{last_name}"
+
+
+def check_move(name: str, src_folder: str, dst_folder: str) -> None:
+    """
+    Make sure file can be moved without overwriting.
+    Raises:
+        MoveError: file is missing or exists in `dst_folder`
+    """
+    src = os.path.join(src_folder, name)
+    dst = os.path.join(dst_folder, name)
+    
+    # Check if source file exists
+    if not os.path.exists(src):
+        raise MoveError(
+            f'SOURCE FILE NOT FOUND: {name}\nPATH: {src}\nCANNOT CONTINUE FILE MOVING'
+        )
     
-    # Handle edge case: no photos to process
+    # Check if destination file already exists
+    if os.path.exists(dst):
+        raise MoveError(
+            f'DESTINATION FILE ALREADY EXISTS: {name}\n'
+            f'PATH: {dst}\n'
+            f'ABORTING TO PREVENT FILE OVERWRITE'
+        )
+
+
+def move_files(
+    names: Sequence[str],
+    src_folder: str,
+    dst_folder: str,
+    transfer: Optional[TransferEngine] = None,
+    on_moved: Optional[Callable[[], None]] = None,
+) -> None:
+    """
+    Move files between folders, never overwriting. Across devices files are copied by
+    `transfer` in parallel and their sources deleted once copies are durable.
+    Args:
+        names: file names
+        src_folder: folder files are in
+        dst_folder: folder to move files into
+        transfer: transfer engine, None to move one file at a time
+        on_moved: called after every moved file, in order of `names`
+    Raises:
+        MoveError: file can't be moved
+    """
     if not names:
-        return stacks
+        return
+    for name in names:
+        check_move(name, src_folder, dst_folder)
+    if transfer is None:
+        transfer = TransferEngine(1)
+    moved = transfer.move_many(src_folder, dst_folder, list(names))
+    while True:
+        try:
+            next(moved)
+        except StopIteration:
+            break
+        except OSError as e:
+            raise MoveError(
+                f'FAILED TO MOVE: {os.path.basename(e.filename or "")}\n'
+                f'FROM: {src_folder}\nTO: {dst_folder}\nERROR: {str(e)}'
+            ) from e
+        if on_moved is not None:
+            on_moved()
+
+
+def move_stack(
+    stack: Sequence[str],
+    jpg_folder: str,
+    fs_folder_path: str,
+    journal: Optional[MoveJournal] = None,
+    transfer: Optional[TransferEngine] = None,
+) -> str:
+    """
+    Create stack folder inside 'fs' folder and move files of stack into it.
+    Args:
+        stack: names of files in stack
+        jpg_folder: folder where located files in `stack`
+        fs_folder_path: 'fs' folder
+        journal: journal the stack is planned in, every move is recorded there
+        transfer: transfer engine, None to move one file at a time
+    Returns:
+        path of created stack folder
+    Raises:
+        FolderExistsError: stack folder exists
+        MoveError: file can't be moved
+    """
+    #  Prepare folder for moving files to
+    dirname = stack_dirname(stack)
+    stack_path = os.path.join(fs_folder_path, dirname)
     
-    stack.append(names[0])
-
-    for i in range(1, len(dates)):
-        delta = dates[i] - dates[i - 1]
-        if delta <= MAX_TIME_DELTA:
-            #  Dates near each other -> Add name to stack.
-            stack.append(names[i])  # type: ignore
-            if i == (len(dates) - 1):
-                #  Finish cycle with adding stack to stacks.
-                stacks, stack_stat = done_stack(stacks, stack_stat, stack)  # type: ignore
-                del stack  # type: ignore
-        else:
-            # Dates far from each other -> Add stack to stacks
-            stacks, stack_stat = done_stack(stacks, stack_stat, stack)  # type: ignore
-            if i == (len(dates) - 1):
-                # Finish cycle
-                del stack  # type: ignore
-            else:
-                # Start new stack
-                stack = [names[i]]
+    # Check if stack folder already exists
+    if os.path.exists(stack_path):
+        raise FolderExistsError(
+            f'STACK FOLDER ALREADY EXISTS: {dirname}\n'
+            f'THIS SHOULD NOT HAPPEN - ABORTING TO PREVENT DATA LOSS'
+        )
     
-    # Handle single photo edge case - if stack still exists, process it
-    if 'stack' in locals() and stack:
-        stacks, stack_stat = done_stack(stacks, stack_stat, stack)
+    os.mkdir(stack_path)
     
-    #  Below just prettyprint
-    for stacksize, stackcount in sorted(stack_stat.items(), key=operator.itemgetter(0)):
-        spacer = ' ' if stacksize < 10 else ''
-        print(f'Stack size {spacer}{stacksize} files: {stackcount} stacks')
-    return stacks
+    #  Move files from origin to new folders
+    on_moved = None
+    if journal is not None:
+        on_moved = lambda: journal.record_move(stack_path)  # noqa: E731
+    move_files(stack, jpg_folder, stack_path, transfer, on_moved)
+    return stack_path
+
 
+def plan_stack(journal: MoveJournal, stack: Stack, sync: bool = True) -> None:
+    """Record stack in move journal before its files are moved."""
+    journal.plan(stack_dirname(stack), list(stack), stack.timestamps, sync)
 
-def move_stacks(stacks: List[List[str]], jpg_folder: str) -> None:
+
+def move_stacks(
+    stacks: Sequence[Stack],
+    jpg_folder: str,
+    journal: Optional[MoveJournal] = None,
+    transfer: Optional[TransferEngine] = None,
+) -> List[str]:
     """
     Create 'fs' folder -> all the stack-folders inside of it -> move image-files-list
-    (stacks) to their final folders
+    (stacks) to their final folders. All stacks are planned in the move journal first,
+    so an interrupted run can be resumed or rolled back.
     Args:
         stacks: list of stacks
         jpg_folder: folder where located files in `stacks`
+        journal: journal of interrupted run to continue ('fs' folder exists then),
+            left open for the caller to complete; None to start a new journal
+        transfer: transfer engine, None to move one file at a time
+    Returns:
+        paths of created stack folders
+    Raises:
+        NoStacksError: `stacks` is empty
+        FolderExistsError, MoveError
     """
-    if not stacks:
-        print('No stacks here! Exit')
-        sys.exit(2)
+    if len(stacks) == 0:
+        raise NoStacksError('No stacks here')
     
-    # Check if 'fs' folder already exists
-    fs_folder_path = os.path.join(jpg_folder, FOLDER_NAME_ROOT)
-    if os.path.exists(fs_folder_path):
-        print(f'\n🚨 CRITICAL ERROR 🚨')
-        print(f'❌ FOLDER "{FOLDER_NAME_ROOT}" ALREADY EXISTS!')
-        print(f'❌ PATH: {fs_folder_path}')
-        print(f'❌ CANNOT PROCEED - THIS INDICATES PHOTOS WERE ALREADY PROCESSED')
-        print(f'❌ PLEASE REMOVE THE FOLDER OR USE A DIFFERENT DIRECTORY')
-        sys.exit(1)
+    if journal is None:
+        # Check if 'fs' folder already exists
+        fs_folder_path = check_root_folder(jpg_folder)
+        with MoveJournal(jpg_folder, fs_folder_path) as journal:
+            stack_paths = move_stacks(stacks, jpg_folder, journal, transfer)
+            journal.complete()
+        return stack_paths
+    fs_folder_path = journal.fs_folder_path
+    
+    for stack in stacks:
+        plan_stack(journal, stack, sync=False)
+    journal.all_planned()
     
-    folder_count, file_count = 0, 0
-    os.mkdir(fs_folder_path)
-    print(f'\nRoot folder {FOLDER_NAME_ROOT} created')
+    stack_paths: List[str] = []
+    file_count = 0
+    if not os.path.isdir(fs_folder_path):
+        os.mkdir(fs_folder_path)
+        print(f'\nRoot folder {FOLDER_NAME_ROOT} created')
     print('Start moving files...', end='')
     
     for stack in stacks:
-        # Safer filename handling for folder naming
-        def safe_filename_for_folder(filename):
-            name, ext = os.path.splitext(filename)
-            return name if name else filename
-        
-        #  Prepare folder for moving files to
-        first_name = safe_filename_for_folder(stack[0])
-        last_name = safe_filename_for_folder(stack[-1])
-        stack_dirname = f"{first_name}_to_{last_name}"
-        stack_path = os.path.join(fs_folder_path, stack_dirname)
-        
-        # Check if stack folder already exists
-        if os.path.exists(stack_path):
-            print(f'\n🚨 CRITICAL ERROR 🚨')
-            print(f'❌ STACK FOLDER ALREADY EXISTS: {stack_dirname}')
-            print(f'❌ THIS SHOULD NOT HAPPEN - ABORTING TO PREVENT DATA LOSS')
-            sys.exit(1)
-        
+        stack_paths.append(move_stack(stack, jpg_folder, fs_folder_path, journal, transfer))
+        file_count += len(stack)
+
+    print(f'Ok:\n{len(stack_paths)} folders created\n{file_count} files moved')
+    return stack_paths
+
+
+def replay_moves(
+    jpg_folder: str,
+    state: JournalState,
+    journal: MoveJournal,
+    transfer: Optional[TransferEngine] = None,
+) -> Tuple[PhotoTable, List[Stack], List[str]]:
+    """
+    Finish moves planned in journal of interrupted run. Files up to the last commit
+    are known to be moved, the rest is checked one by one. No folder is listed and no
+    EXIF is read: names and timestamps come from the journal.
+    Args:
+        jpg_folder: processed folder
+        state: journal contents
+        journal: journal to record moves into
+        transfer: transfer engine, None to move one file at a time
+    Returns:
+        table of planned photos, planned stacks & paths of their folders
+    Raises:
+        MoveError: file is missing or is both in source folder and stack folder
+    """
+    table = PhotoTable(jpg_folder)
+    stacks: List[Stack] = []
+    stack_paths: List[str] = []
+    os.makedirs(journal.fs_folder_path, exist_ok=True)
+    index = 0
+    for planned in state.stacks:
+        start = len(table)
+        for name, timestamp in zip(planned.names, planned.timestamps):
+            table.append(PhotoRecord(name, os.path.join(jpg_folder, name), 0, timestamp))
+        stack_path = os.path.join(journal.fs_folder_path, planned.dirname)
+        os.makedirs(stack_path, exist_ok=True)
+        pending: List[str] = []
+        for name in planned.names:
+            if index >= state.committed:
+                src = os.path.join(jpg_folder, name)
+                dst = os.path.join(stack_path, name)
+                if is_completed_copy(src, dst):
+                    #  Cross-device copy is durable, only its source wasn't deleted
+                    os.remove(src)
+                if os.path.exists(dst) and not os.path.exists(src):
+                    journal.record_move(stack_path)
+                else:
+                    pending.append(name)
+            index += 1
+        move_files(
+            pending, jpg_folder, stack_path, transfer, lambda: journal.record_move(stack_path)
+        )
+        stacks.append(Stack(table, start, len(table)))
+        stack_paths.append(stack_path)
+    return table, stacks, stack_paths
+
+
+def remove_empty_folder(folder_path: str) -> None:
+    """Remove folder left empty by rollback, keep it with a warning otherwise."""
+    try:
+        os.rmdir(folder_path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        print(f'\n⚠️  WARNING: {folder_path} is not empty - folder kept')
+
+
+def rollback_moves(jpg_folder: str, transfer: Optional[TransferEngine] = None) -> int:
+    """
+    Undo interrupted run recorded in move journal: move files back into the source
+    folder, remove emptied stack folders, 'fs' folder and the journal.
+    Args:
+        jpg_folder: processed folder
+        transfer: transfer engine, None to move one file at a time
+    Returns:
+        number of files moved back
+    Raises:
+        GroupingError: there is no journal (run completed or never started)
+        MoveError: file is both in source folder and stack folder
+    """
+    jpg_folder = os.path.abspath(os.path.expanduser(jpg_folder))
+    state = read_journal(jpg_folder)
+    if state is None:
+        raise GroupingError(
+            f'NO INTERRUPTED RUN TO ROLL BACK IN: {jpg_folder}\n'
+            f'MOVE JOURNAL IS REMOVED WHEN A RUN COMPLETES'
+        )
+    fs_folder_path = os.path.join(jpg_folder, FOLDER_NAME_ROOT)
+    restored = 0
+    for planned in state.stacks:
+        stack_path = os.path.join(fs_folder_path, planned.dirname)
+        moved: List[str] = []
+        for name in planned.names:
+            dst = os.path.join(stack_path, name)
+            if is_completed_copy(os.path.join(jpg_folder, name), dst):
+                #  Source of interrupted cross-device copy is still in place
+                os.remove(dst)
+            elif os.path.exists(dst):
+                moved.append(name)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(dst + PART_SUFFIX)
+        move_files(moved, stack_path, jpg_folder, transfer)
+        restored += len(moved)
+        remove_empty_folder(stack_path)
+    remove_empty_folder(fs_folder_path)
+    os.remove(journal_path(jpg_folder))
+    print(f'Rolled back: {restored} files moved back to {jpg_folder}')
+    return restored
+
+
+def link_stacks(stacks: Sequence[Stack], jpg_folder: str, mode: str) -> List[str]:
+    """
+    Build 'fs' tree of stack folders with hard links or relative symbolic links to
+    the files, which stay in place. The tree is built in a staging folder renamed to
+    'fs' when complete, so an interrupted run leaves no 'fs' folder behind.
+    Args:
+        stacks: list of stacks
+        jpg_folder: folder where located files in `stacks`
+        mode: MODE_HARDLINK or MODE_SYMLINK
+    Returns:
+        paths of created stack folders
+    Raises:
+        NoStacksError: `stacks` is empty
+        FolderExistsError: 'fs' exists (also as symlink to another volume)
+        MoveError: link can't be created
+    """
+    if len(stacks) == 0:
+        raise NoStacksError('No stacks here')
+    fs_folder_path = os.path.join(jpg_folder, FOLDER_NAME_ROOT)
+    if os.path.lexists(fs_folder_path):
+        raise FolderExistsError(
+            f'FOLDER "{FOLDER_NAME_ROOT}" ALREADY EXISTS!\n'
+            f'PATH: {fs_folder_path}\n'
+            f'{mode.upper()} MODE BUILDS THE FOLDER ITSELF, REMOVE IT FIRST'
+        )
+    staging_path = os.path.join(jpg_folder, STAGING_FOLDER_NAME)
+    #  Left by an interrupted run, holds nothing but links
+    shutil.rmtree(staging_path, ignore_errors=True)
+    os.mkdir(staging_path)
+    print(f'\nBuilding {FOLDER_NAME_ROOT} tree of {mode}s...', end='')
+
+    dirnames: List[str] = []
+    file_count = 0
+    for stack in stacks:
+        dirname = stack_dirname(stack)
+        stack_path = os.path.join(staging_path, dirname)
         os.mkdir(stack_path)
-        folder_count += 1
-        
-        #  Move files from origin to new folders
         for name in stack:
-            src = os.path.join(jpg_folder, name)
-            dst = os.path.join(stack_path, name)
-            
-            # Check if source file exists
-            if not os.path.exists(src):
-                print(f'\n🚨 CRITICAL ERROR 🚨')
-                print(f'❌ SOURCE FILE NOT FOUND: {name}')
-                print(f'❌ PATH: {src}')
-                print(f'❌ CANNOT CONTINUE FILE MOVING')
-                sys.exit(1)
-            
-            # Check if destination file already exists
-            if os.path.exists(dst):
-                print(f'\n🚨 CRITICAL ERROR 🚨')
-                print(f'❌ DESTINATION FILE ALREADY EXISTS: {name}')
-                print(f'❌ PATH: {dst}')
-                print(f'❌ ABORTING TO PREVENT FILE OVERWRITE')
-                sys.exit(1)
-            
+            link = os.path.join(stack_path, name)
             try:
-                os.rename(src, dst)
-                file_count += 1
-            except Exception as e:
-                print(f'\n🚨 CRITICAL FILE MOVE ERROR 🚨')
-                print(f'❌ FAILED TO MOVE: {name}')
-                print(f'❌ FROM: {src}')
-                print(f'❌ TO: {dst}')
-                print(f'❌ ERROR: {str(e)}')
-                sys.exit(1)
+                if mode == MODE_HARDLINK:
+                    os.link(os.path.join(jpg_folder, name), link)
+                else:
+                    os.symlink(os.path.join(os.pardir, os.pardir, name), link)
+            except OSError as e:
+                raise MoveError(f'FAILED TO LINK: {name}\nTO: {link}\nERROR: {str(e)}') from e
+        dirnames.append(dirname)
+        file_count += len(stack)
 
-    print(f'Ok:\n{folder_count} folders created\n{file_count} files moved')
+    os.rename(staging_path, fs_folder_path)
+    print(f'Ok:\n{len(dirnames)} folders created\n{file_count} files linked')
+    return [os.path.join(fs_folder_path, dirname) for dirname in dirnames]
 
 
-def main(jpg_folder: str) -> None:
+def write_stack_manifest(stacks: Sequence[Stack], jpg_folder: str) -> str:
+    """
+    Write stack index 'fs.json' instead of moving files.
+    Args:
+        stacks: list of stacks
+        jpg_folder: folder where located files in `stacks`
+    Returns:
+        path of manifest
+    Raises:
+        NoStacksError: `stacks` is empty
+    """
+    if len(stacks) == 0:
+        raise NoStacksError('No stacks here')
+    path = manifest_path(jpg_folder, FOLDER_NAME_ROOT)
+    write_manifest(
+        path,
+        MODE_MANIFEST,
+        [
+            ManifestStack(
+                stack_dirname(stack),
+                list(stack),
+                stack.table.datetime(stack.start).isoformat(),
+                stack.table.datetime(stack.end - 1).isoformat(),
+            )
+            for stack in stacks
+        ],
+    )
+    print(f'\nStack manifest {os.path.basename(path)} written: {len(stacks)} stacks, files not moved')
+    return path
+
+
+def check_mode(mode: str) -> None:
+    """
+    Raises:
+        ValueError: `mode` is not one of GROUPING_MODES (files would be moved when
+            the caller asked for something else)
+    """
+    if mode not in GROUPING_MODES:
+        raise ValueError(f'Unknown grouping mode {mode!r}, expected one of {", ".join(GROUPING_MODES)}')
+
+
+def group_folder(
+    jpg_folder: str,
+    workers: int = 1,
+    use_processes: bool = False,
+    cache: Optional[MetadataCache] = None,
+    engine: str = ENGINE_PYTHON,
+    scans: Optional[DirectoryScans] = None,
+    journal: Optional[MoveJournal] = None,
+    transfer: Optional[TransferEngine] = None,
+    mode: str = MODE_MOVE,
+) -> GroupingResult:
+    """
+    Batch pipeline: read timestamps of the whole folder, group and move stacks (or
+    write their manifest / link them, depending on `mode`).
+    Args:
+        jpg_folder: folder with image files
+        workers: number of concurrent EXIF readers
+        use_processes: read EXIF in process pool instead of thread pool
+        cache: metadata cache to serve unchanged files from, None to read every file
+        engine: grouping engine, ENGINE_PYTHON or ENGINE_NUMPY
+        scans: run-wide folder listings to reuse, None to list folder anew
+        journal: move journal of interrupted run to continue, see `move_stacks`
+        transfer: transfer engine, None to move one file at a time
+        mode: grouping mode, one of GROUPING_MODES
+    Returns:
+        grouping result
+    Raises:
+        GroupingError
+        ValueError: unknown grouping mode
+    """
+    check_mode(mode)
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    if journal is None:
+        #  Fail before reading the folder, moving would be refused anyway
+        check_root_folder(jpg_folder)
+    skipped_files: List[str] = []
+    table = read_jpg(jpg_folder, workers, use_processes, cache, scans, skipped_files)
+    timings['read'] = time.perf_counter() - start
+
+    stack_stat: Dict[int, int] = {}
+    if engine == ENGINE_NUMPY:
+        stacks = get_stacks_vectorized(table, stack_stat)
+    else:
+        stacks = get_stacks(table, stack_stat)
+    timings['group'] = time.perf_counter() - start - timings['read']
+
+    if mode == MODE_MANIFEST:
+        write_stack_manifest(stacks, jpg_folder)
+        stack_paths: List[str] = []
+    elif mode in (MODE_HARDLINK, MODE_SYMLINK):
+        stack_paths = link_stacks(stacks, jpg_folder, mode)
+    else:
+        stack_paths = move_stacks(stacks, jpg_folder, journal, transfer)
+    timings['total'] = time.perf_counter() - start
+    timings['move'] = timings['total'] - timings['read'] - timings['group']
+    return GroupingResult(
+        jpg_folder, table, stacks, stack_paths, skipped_files, stack_stat, timings
+    )
+
+
+def stream_stacks(
+    jpg_folder: str,
+    workers: int = 1,
+    use_processes: bool = False,
+    cache: Optional[MetadataCache] = None,
+    reorder_window: int = REORDER_WINDOW,
+    on_stack: Optional[Callable[[str], None]] = None,
+    scans: Optional[DirectoryScans] = None,
+    journal: Optional[MoveJournal] = None,
+    transfer: Optional[TransferEngine] = None,
+) -> GroupingResult:
+    """
+    Streaming pipeline: read timestamps, group and move every stack as soon as it is
+    closed by a time gap, without waiting for the whole folder to be read.
+    Args:
+        jpg_folder: folder with image files
+        workers: number of concurrent EXIF readers
+        use_processes: read EXIF in process pool instead of thread pool
+        cache: metadata cache to serve unchanged files from, None to read every file
+        reorder_window: size of reorder buffer for photos out of time order
+        on_stack: called with path of every created stack folder (e.g. to hand it to
+            stacking backend right away)
+        scans: run-wide folder listings to reuse, None to list folder anew
+        journal: move journal of interrupted run to continue ('fs' folder exists then),
+            left open for the caller to complete; None to start a new journal with
+            the first stack
+        transfer: transfer engine, None to move one file at a time
+    Returns:
+        grouping result
+    Raises:
+        GroupingError
+    """
+    start = time.perf_counter()
+    timings: Dict[str, float] = {}
+    own_journal = journal is None
+    if own_journal:
+        fs_folder_path = check_root_folder(jpg_folder)
+    else:
+        fs_folder_path = journal.fs_folder_path  # type: ignore
+    entries = scan_images(jpg_folder, scans)
+
+    skipped_files: List[str] = []
+    late_files: List[str] = []
+    stack_stat: Dict[int, int] = {}
+    records = iter_records(entries, workers, use_processes, cache, skipped_files)
+    table = PhotoTable(jpg_folder)
+    stacks: List[Stack] = []
+    stack_paths: List[str] = []
+    file_count, photo_count = 0, 0
+
+    def counted() -> Iterator[PhotoRecord]:
+        nonlocal photo_count
+        for record in records:
+            photo_count += 1
+            yield record
+
+    try:
+        for stack in iter_stacks(counted(), table, stack_stat, reorder_window, late_files):
+            if not stacks:
+                if journal is None:
+                    journal = MoveJournal(jpg_folder, fs_folder_path)
+                if not os.path.isdir(fs_folder_path):
+                    os.mkdir(fs_folder_path)
+                    print(f'\nRoot folder {FOLDER_NAME_ROOT} created')
+                timings['first_stack'] = time.perf_counter() - start
+                print(f'First stack ready in {timings["first_stack"]:.2f}s')
+            plan_stack(journal, stack)  # type: ignore
+            stack_path = move_stack(stack, jpg_folder, fs_folder_path, journal, transfer)
+            stacks.append(stack)
+            stack_paths.append(stack_path)
+            file_count += len(stack)
+            print(f'Stack {len(stacks)}: {len(stack)} files moved to {os.path.basename(stack_path)}')
+            if on_stack is not None:
+                on_stack(stack_path)
+        if own_journal and journal is not None:
+            journal.all_planned()
+            journal.complete()
+    finally:
+        if own_journal and journal is not None:
+            journal.close()
+
+    skipped_files += late_files
+    report_timestamps(photo_count, skipped_files, cache)
+    print(f'Got {photo_count} valid timestamps in image files\n')
+    print_stack_stat(stack_stat)
+    if not stacks:
+        raise NoStacksError('No stacks here')
+    print(f'Ok:\n{len(stacks)} folders created\n{file_count} files moved')
+    timings['total'] = time.perf_counter() - start
+    return GroupingResult(
+        jpg_folder, table, stacks, stack_paths, skipped_files, stack_stat, timings
+    )
+
+
+def resume_grouping(
+    jpg_folder: str,
+    state: JournalState,
+    workers: int = 1,
+    use_processes: bool = False,
+    cache: Optional[MetadataCache] = None,
+    stream: bool = False,
+    reorder_window: int = REORDER_WINDOW,
+    engine: str = ENGINE_PYTHON,
+    scans: Optional[DirectoryScans] = None,
+    on_stack: Optional[Callable[[str], None]] = None,
+    transfer: Optional[TransferEngine] = None,
+) -> GroupingResult:
+    """
+    Resume interrupted run from its move journal: finish planned moves, then group the
+    rest of the folder if the run stopped before planning all stacks (streaming mode).
+    Remaining photos group exactly as before: planned stacks are separated from them by
+    time gaps. Arguments are those of `run_grouping`.
+    Returns:
+        grouping result, replayed stacks first
+    Raises:
+        MoveError: planned file is missing or both in source folder and stack folder
+    """
+    start = time.perf_counter()
+    print(
+        f'\nResuming interrupted run: {len(state.stacks)} stacks planned, '
+        f'{state.committed} files moved before'
+    )
+    fs_folder_path = os.path.join(jpg_folder, FOLDER_NAME_ROOT)
+    with MoveJournal(jpg_folder, fs_folder_path, state) as journal:
+        table, stacks, stack_paths = replay_moves(jpg_folder, state, journal, transfer)
+        print(f'{len(stack_paths)} planned stacks completed')
+        if on_stack is not None:
+            for stack_path in stack_paths:
+                on_stack(stack_path)
+        skipped_files: List[str] = []
+        stack_stat: Dict[int, int] = {}
+        for stack in stacks:
+            stack_stat[len(stack)] = stack_stat.get(len(stack), 0) + 1
+        if not state.planned:
+            if scans is not None:
+                scans.invalidate(jpg_folder)
+            try:
+                if stream:
+                    rest = stream_stacks(
+                        jpg_folder, workers, use_processes, cache, reorder_window, on_stack,
+                        scans, journal, transfer,
+                    )
+                else:
+                    rest = group_folder(
+                        jpg_folder, workers, use_processes, cache, engine, scans, journal, transfer
+                    )
+            except (NoImageFilesError, NoValidTimestampsError, NoStacksError):
+                print('No more stacks in the rest of the folder')
+            else:
+                stacks += rest.stacks
+                stack_paths += rest.stack_paths
+                skipped_files = rest.skipped_files
+                for size, count in rest.stack_stat.items():
+                    stack_stat[size] = stack_stat.get(size, 0) + count
+            journal.all_planned()
+        journal.complete()
+    timings = {'total': time.perf_counter() - start}
+    return GroupingResult(
+        jpg_folder, table, stacks, stack_paths, skipped_files, stack_stat, timings
+    )
+
+
+def run_grouping(
+    jpg_folder: str,
+    workers: int = 1,
+    use_processes: bool = False,
+    cache_mode: str = CACHE_ON,
+    cache_path: Optional[str] = None,
+    stream: bool = False,
+    reorder_window: int = REORDER_WINDOW,
+    engine: str = ENGINE_PYTHON,
+    scans: Optional[DirectoryScans] = None,
+    on_stack: Optional[Callable[[str], None]] = None,
+    transfer: Optional[TransferEngine] = None,
+    mode: str = MODE_MOVE,
+) -> GroupingResult:
+    """
+    Group photos of a folder in-process: library entry point of the grouper.
+    Interrupted run found in the folder (move journal) is resumed instead.
+    Args:
+        jpg_folder: folder with image files
+        workers: number of concurrent EXIF readers
+        use_processes: read EXIF in process pool instead of thread pool
+        cache_mode: CACHE_ON, CACHE_OFF or CACHE_REBUILD (ignore cached entries)
+        cache_path: metadata cache file, by default one per storage root (parent
+            folder of `jpg_folder`)
+        stream: move every stack as soon as it is closed instead of after reading
+            the whole folder
+        reorder_window: size of reorder buffer for photos out of time order (stream)
+        engine: grouping engine for non-streaming mode, ENGINE_PYTHON or ENGINE_NUMPY
+        scans: run-wide folder listings to reuse, the listing of `jpg_folder` is
+            invalidated when the run ends
+        on_stack: called with path of every created stack folder (stream)
+        transfer: engine moving files, copies across devices (`fs` folder on another
+            volume); TransferEngine() by default
+        mode: MODE_MOVE, or MODE_MANIFEST / MODE_HARDLINK / MODE_SYMLINK to leave
+            files in place (no stack folders in manifest mode, stream is ignored)
+    Returns:
+        grouping result
+    Raises:
+        GroupingError: NoImageFilesError, NoValidTimestampsError, NoStacksError,
+            FolderExistsError, MoveError
+        ValueError: unknown grouping mode
+    """
+    check_mode(mode)
+    jpg_folder = os.path.abspath(os.path.expanduser(jpg_folder))
+    cache = None
+    if cache_mode != CACHE_OFF:
+        if cache_path is None:
+            cache_path = os.path.join(os.path.dirname(jpg_folder), CACHE_FILE_NAME)
+        cache = open_cache(cache_path, rebuild=cache_mode == CACHE_REBUILD)
+    if transfer is None:
+        transfer = TransferEngine()
+    try:
+        state = read_journal(jpg_folder)
+        if state is not None:
+            result = resume_grouping(
+                jpg_folder, state, workers, use_processes, cache, stream, reorder_window,
+                engine, scans, on_stack, transfer,
+            )
+        elif stream and mode == MODE_MOVE:
+            result = stream_stacks(
+                jpg_folder, workers, use_processes, cache, reorder_window, on_stack, scans,
+                transfer=transfer,
+            )
+        else:
+            if stream and mode != MODE_MOVE:
+                print(f'Stream is not supported in {mode} mode, grouping whole folder')
+            result = group_folder(
+                jpg_folder, workers, use_processes, cache, engine, scans, transfer=transfer, mode=mode
+            )
+            if mode != MODE_MOVE:
+                #  Nothing was moved
+                return result
+        report = transfer.report()
+        print(report.summary())
+        return result._replace(transfer=report)
+    finally:
+        if cache is not None:
+            #  Files are moved by now: a cache that can't be saved doesn't fail the run
+            close_cache(cache)
+        if scans is not None:
+            scans.invalidate(jpg_folder)
+
+
+def main(
+    jpg_folder: str,
+    workers: int = 1,
+    use_processes: bool = False,
+    cache_mode: str = CACHE_ON,
+    cache_path: Optional[str] = None,
+    stream: bool = False,
+    reorder_window: int = REORDER_WINDOW,
+    engine: str = ENGINE_PYTHON,
+    rollback: bool = False,
+    transfer_workers: int = DEFAULT_WORKERS,
+    verify: bool = False,
+    mode: str = MODE_MOVE,
+) -> None:
     """
     Start the process. Start!
     Args:
         jpg_folder: Path to folder with image files.
+        workers: number of concurrent EXIF readers
+        use_processes: read EXIF in process pool instead of thread pool
+        cache_mode: CACHE_ON, CACHE_OFF or CACHE_REBUILD (ignore cached entries)
+        cache_path: metadata cache file, by default one per storage root (parent
+            folder of `jpg_folder`)
+        stream: move every stack as soon as it is closed instead of after reading
+            the whole folder
+        reorder_window: size of reorder buffer for photos out of time order (stream)
+        engine: grouping engine for non-streaming mode, ENGINE_PYTHON or ENGINE_NUMPY
+        rollback: undo interrupted run instead of resuming it
+        transfer_workers: parallel copies when 'fs' folder is on another device
+        verify: verify copies with a hash before deleting their sources
+        mode: grouping mode, one of GROUPING_MODES
     """
     print('START\n')
     
@@ -294,16 +1364,115 @@ def main(jpg_folder: str) -> None:
         print(f"Error: Path is not a directory: {jpg_folder}")
         sys.exit(1)
     
-    names, dates = read_jpg(jpg_folder)
-    stacks = get_stacks(names, dates)
-    move_stacks(stacks, jpg_folder)
+    transfer = TransferEngine(transfer_workers, verify)
+    try:
+        if rollback:
+            rollback_moves(jpg_folder, transfer)
+        else:
+            run_grouping(
+                jpg_folder, workers, use_processes, cache_mode, cache_path, stream, reorder_window, engine,
+                transfer=transfer, mode=mode,
+            )
+    except GroupingError as e:
+        e.report()
+        sys.exit(e.exit_code)
     print('\nFINISH')
 
 
+def parse_arguments() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Group photos taken for focus stacking into folders by EXIF timestamp',
+        epilog="Note: If path contains special characters like '!', wrap it in single quotes",
+    )
+    parser.add_argument('jpg_folder', help='Path to folder with image files')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of concurrent EXIF readers (default: 1, read one file at a time)',
+    )
+    parser.add_argument(
+        '--processes',
+        action='store_true',
+        help='Read EXIF in a process pool instead of a thread pool',
+    )
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument(
+        '--no-cache',
+        dest='cache_mode',
+        action='store_const',
+        const=CACHE_OFF,
+        default=CACHE_ON,
+        help='Read EXIF of every file, do not use metadata cache',
+    )
+    cache_group.add_argument(
+        '--rebuild-cache',
+        dest='cache_mode',
+        action='store_const',
+        const=CACHE_REBUILD,
+        help='Ignore cached metadata and refresh it from the files',
+    )
+    parser.add_argument(
+        '--cache-path',
+        help=f'Metadata cache file (default: {CACHE_FILE_NAME} in the parent folder)',
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='Move every stack as soon as it is closed, while files are still being read',
+    )
+    parser.add_argument(
+        '--reorder-window',
+        type=int,
+        default=REORDER_WINDOW,
+        help=f'Photos buffered to restore time order in --stream mode (default: {REORDER_WINDOW})',
+    )
+    parser.add_argument(
+        '--engine',
+        choices=[ENGINE_PYTHON, ENGINE_NUMPY],
+        default=ENGINE_PYTHON,
+        help='Grouping engine, numpy is faster on archives of 100k+ photos (default: python)',
+    )
+    parser.add_argument(
+        '--mode',
+        choices=GROUPING_MODES,
+        default=MODE_MOVE,
+        help='move files into stack folders (default), only write stack manifest fs.json, '
+        'or build fs tree of hard/symbolic links leaving files in place',
+    )
+    parser.add_argument(
+        '--transfer-workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f'Parallel copies when "fs" folder is on another device (default: {DEFAULT_WORKERS})',
+    )
+    parser.add_argument(
+        '--verify',
+        action='store_true',
+        help='Verify copies across devices with a hash before deleting source files',
+    )
+    parser.add_argument(
+        '--rollback',
+        action='store_true',
+        help='Move files of an interrupted run back and remove its folders',
+    )
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: python group_photos.py <image_folder_path>")
-        print("Note: If path contains special characters like '!', wrap it in single quotes")
-        print("Example: python group_photos.py '/path/with/special!chars'")
-        sys.exit(1)
-    main(sys.argv[1])
+    args = parse_arguments()
+    main(
+        args.jpg_folder,
+        args.workers,
+        args.processes,
+        args.cache_mode,
+        args.cache_path,
+        args.stream,
+        args.reorder_window,
+        args.engine,
+        args.rollback,
+        args.transfer_workers,
+        args.verify,
+        args.mode,
+    )
@@ -0,0 +1,210 @@
+"""
+Image reading and writing for the native stacking backend.
+
+Frames are decoded with Pillow (EXIF orientation applied) into uint8 RGB arrays of
+shape (height, width, 3); focus measures and alignment work on float32 luminance
+planes made from them. Results are saved the way `SaveJPG` of stacker.js saves them:
+top-quality progressive JPEG, no chroma subsampling, with the EXIF of a source frame.
+
+Analysis stages that need no full-resolution pixels ask `load_image` for a maximum
+size. The frame then comes from the embedded EXIF thumbnail if it is large enough,
+or from a JPEG decoded in draft mode (libjpeg scales the DCT blocks by 1/2, 1/4 or
+1/8, skipping most of the decoding work), and is reduced to fit. Decodes are counted
+by resolution (`decode_counts`, per process), so that a run can be checked to decode
+every frame at full resolution once, for the composite.
+"""
+import io
+import os
+import threading
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import ExifTags, Image, ImageOps
+
+#  Rec. 601 luma weights, as used by JPEG
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+#  Pillow equivalent of Photoshop quality 12
+JPEG_QUALITY = 95
+
+#  Suffix of result being written, renamed to the final name once complete
+PART_SUFFIX = '.part'
+
+
+#  Resolutions counted by `decode_counts`, besides draft scales '1/2', '1/4', '1/8'
+RESOLUTION_FULL = 'full'
+RESOLUTION_THUMBNAIL = 'thumbnail'
+
+#  Most the aspect ratio of EXIF thumbnail may differ from the frame one (letterboxed
+#  thumbnails are not used)
+THUMBNAIL_ASPECT_TOLERANCE = 0.01
+
+#  EXIF IFD1 tags of the embedded JPEG thumbnail: offset in the TIFF block, length
+THUMBNAIL_OFFSET_TAG = 0x0201
+THUMBNAIL_LENGTH_TAG = 0x0202
+
+#  EXIF Orientation tag, reset once pixels are transposed by `load_image`
+ORIENTATION_TAG = 0x0112
+
+_decode_counts: Counter = Counter()
+_decode_counts_lock = threading.Lock()
+
+
+def _count_decode(resolution: str) -> None:
+    with _decode_counts_lock:
+        _decode_counts[resolution] += 1
+
+
+def decode_counts() -> Dict[str, int]:
+    """Decodes of this process so far, by resolution ('full', '1/2'.., 'thumbnail')."""
+    with _decode_counts_lock:
+        return dict(_decode_counts)
+
+
+def reset_decode_counts() -> None:
+    with _decode_counts_lock:
+        _decode_counts.clear()
+
+
+def describe_decodes(counts: Dict[str, int]) -> str:
+    return ', '.join(f'{count} {resolution}' for resolution, count in sorted(counts.items())) or 'none'
+
+
+def load_image(path: str, max_size: int = 0) -> np.ndarray:
+    """
+    Decode image file into uint8 RGB array.
+    Args:
+        path: image file
+        max_size: longest side of the array, at most; 0 decodes at full resolution
+    Returns:
+        array of shape (height, width, 3)
+    Raises:
+        OSError: file can't be read or decoded
+    """
+    with Image.open(path) as image:
+        if max_size:
+            thumbnail = _exif_thumbnail(image, max_size)
+            if thumbnail is not None:
+                _count_decode(RESOLUTION_THUMBNAIL)
+                return np.asarray(_fit(thumbnail, max_size))
+            width, height = image.size
+            longest = max(width, height)
+            #  Size the frame is fitted to: libjpeg scales by the largest factor keeping it covered
+            image.draft('RGB', (max(width * max_size // longest, 1), max(height * max_size // longest, 1)))
+            scale = width // image.size[0]
+            _count_decode(f'1/{scale}' if scale > 1 else RESOLUTION_FULL)
+            image = ImageOps.exif_transpose(image)
+            return np.asarray(_fit(image.convert('RGB'), max_size))
+        _count_decode(RESOLUTION_FULL)
+        image = ImageOps.exif_transpose(image)
+        return np.asarray(image.convert('RGB'))
+
+
+def _fit(image: Image.Image, max_size: int) -> Image.Image:
+    """Image reduced (box filter) so its longest side is at most `max_size`."""
+    if max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.Resampling.BOX)
+    return image
+
+
+#  Transpose of EXIF orientation, for thumbnails (they carry no orientation of their own)
+ORIENTATION_TRANSPOSES = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def _exif_thumbnail(image: Image.Image, max_size: int) -> Optional[Image.Image]:
+    """
+    Embedded EXIF thumbnail of opened image, upright in RGB, if its longest side is at
+    least `max_size` and its aspect ratio is the frame one; None otherwise.
+    """
+    raw = image.info.get('exif')
+    if not raw:
+        return None
+    exif = image.getexif()
+    ifd1 = exif.get_ifd(ExifTags.IFD.IFD1)
+    offset, length = ifd1.get(THUMBNAIL_OFFSET_TAG), ifd1.get(THUMBNAIL_LENGTH_TAG)
+    if not offset or not length:
+        return None
+    #  Offset counts from the TIFF header, after the 'Exif\0\0' marker
+    data = raw[6 + offset : 6 + offset + length]
+    try:
+        thumbnail = Image.open(io.BytesIO(data))
+        (thumbnail_width, thumbnail_height), (width, height) = thumbnail.size, image.size
+        if max(thumbnail_width, thumbnail_height) < max_size:
+            return None
+        if abs(thumbnail_width * height / (thumbnail_height * width) - 1) > THUMBNAIL_ASPECT_TOLERANCE:
+            return None
+        thumbnail = thumbnail.convert('RGB')
+    except OSError:
+        #  Broken thumbnail: the frame itself is decoded
+        return None
+    transpose = ORIENTATION_TRANSPOSES.get(exif.get(ORIENTATION_TAG))
+    return thumbnail.transpose(transpose) if transpose is not None else thumbnail
+
+
+#  EXIF orientations of frames stored rotated by 90 degrees
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def image_shape(path: str) -> Tuple[int, int, int]:
+    """
+    Shape of array `load_image` returns, from the file header (nothing is decoded).
+    Raises:
+        OSError: file can't be read
+    """
+    with Image.open(path) as image:
+        width, height = image.size
+        if image.getexif().get(ORIENTATION_TAG) in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+    return (height, width, 3)
+
+
+def read_exif(path: str) -> Optional[bytes]:
+    """EXIF block of image file for result, None if it has none."""
+    with Image.open(path) as image:
+        exif = image.getexif()
+    if not exif:
+        return None
+    if ORIENTATION_TAG in exif:
+        exif[ORIENTATION_TAG] = 1
+    return exif.tobytes()
+
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    """Luminance plane of RGB image as float32 in 0..255."""
+    return image.astype(np.float32) @ LUMA_WEIGHTS
+
+
+def save_jpeg(path: str, image: np.ndarray, exif: Optional[bytes] = None) -> None:
+    """
+    Save RGB array as progressive JPEG of top quality, atomically: the file is written
+    under a '.part' name and renamed, so an interrupted save leaves no truncated result.
+    Args:
+        path: target file
+        image: uint8 array of shape (height, width, 3)
+        exif: raw EXIF block to embed
+    """
+    options = {'quality': JPEG_QUALITY, 'progressive': True, 'subsampling': 0}
+    if exif:
+        options['exif'] = exif
+    part_path = path + PART_SUFFIX
+    try:
+        Image.fromarray(image, 'RGB').save(part_path, 'JPEG', **options)
+        os.replace(part_path, path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+
+def output_name(last_file: str) -> str:
+    """Result file name for stack, same as stacker.js: '<last layer>_fs.jpg'."""
+    return os.path.splitext(os.path.basename(last_file))[0] + '_fs.jpg'
@@ -0,0 +1,292 @@
+"""
+Incremental re-stacking: frames added to a stacked stack are merged into its stored blend.
+
+Frames forgotten at first or split off from the neighbouring stack land in a stack
+folder after it was stacked; stacking it again from scratch decodes and aligns every
+frame once more. With incremental stacking the running state of every finished
+stack is kept on disk:
+    - maps and sums of its StackAccumulator (focus-score map, composite and source
+      index map for 'max', weighted sums for 'weighted', fused pyramid for
+      'pyramid') and the mask of pixels covered by every frame
+    - members (path, size, modification time) and their transforms
+    - luminance planes of its first and last frames, the ends new frames are
+      aligned to
+When the stored members are an unchanged run of the frames of the stack now, only
+the frames before and after them are decoded: frames after are aligned on from the
+stored last frame, frames before in reverse order from the stored first frame,
+and both are merged into the restored accumulator. The reference of transforms
+stays the frame the stack was first stacked from. Anything else (a member edited,
+removed or inserted in the middle, other blending settings) stacks the whole stack
+again. Stacks without new frames are cropped and saved from the state alone.
+
+States are folders in '.fs_stack_state' of the result folder, one per stack; the
+arrays are `.npy` files and 'state.json', written last and atomically, makes the
+folder a state. A saved state replaces every state sharing a member with it, and
+the result of the stack it grew from.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import aligner
+import blender
+from image_loader import load_image, output_name, read_exif, save_jpeg, to_gray
+from native_stacker import METHOD_MAX, StackAccumulator, StackResult
+
+#  Folder of stack states, in the result folder
+STATE_FOLDER_NAME = '.fs_stack_state'
+
+#  File of a state folder describing it, written after its arrays
+STATE_FILE_NAME = 'state.json'
+STATE_VERSION = 1
+
+#  Arrays of a state besides the accumulator ones: luminance of the ends of the stack
+FIRST_GRAY = 'first_gray'
+LAST_GRAY = 'last_gray'
+
+
+class Member(NamedTuple):
+    """Frame of a stored stack, as it was when stacked."""
+
+    path: str
+    size: int
+    mtime_ns: int
+
+
+class StackState(NamedTuple):
+    """Stored state of one stacked stack, its arrays left on disk."""
+
+    folder: str
+    method: str
+    preset: str
+    model: str
+    shape: Tuple[int, ...]
+    members: List[Member]
+    transforms: List[aligner.Transform]
+    output: str
+
+    def array(self, name: str) -> np.ndarray:
+        """Stored array as a read-only memmap."""
+        return np.load(os.path.join(self.folder, name + '.npy'), mmap_mode='r')
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Arrays of the accumulator, by state name; counts as plain numbers."""
+        arrays = {}
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.npy'):
+                array = np.load(entry.path, mmap_mode='r')
+                arrays[entry.name[: -len('.npy')]] = array if array.ndim else array[()]
+        return arrays
+
+
+def state_root(out_folder: str, state_dir: Optional[str] = None) -> str:
+    return state_dir or os.path.join(out_folder, STATE_FOLDER_NAME)
+
+
+def member(path: str) -> Member:
+    """
+    Member record of frame file as it is now.
+    Raises:
+        OSError: file can't be accessed
+    """
+    stat = os.stat(path)
+    return Member(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def read_states(root: str) -> List[StackState]:
+    """States in state folder; unreadable ones and ones being written are left out."""
+    states = []
+    try:
+        entries = sorted(entry.path for entry in os.scandir(root) if entry.is_dir())
+    except FileNotFoundError:
+        return states
+    for folder in entries:
+        try:
+            with open(os.path.join(folder, STATE_FILE_NAME), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != STATE_VERSION:
+                continue
+            states.append(
+                StackState(
+                    folder,
+                    data['method'],
+                    data['preset'],
+                    data['model'],
+                    tuple(data['shape']),
+                    [Member(*entry) for entry in data['members']],
+                    [aligner.Transform(*transform) for transform in data['transforms']],
+                    data['output'],
+                )
+            )
+        except (OSError, ValueError, TypeError, KeyError):
+            continue
+    return states
+
+
+def find_state(
+    states: List[StackState], members: List[Member], method: str, preset: str, model: str
+) -> Optional[Tuple[StackState, int]]:
+    """
+    State of the longest unchanged run of `members` stacked with the same settings.
+    Returns:
+        state and index of its first member in `members`, None if there is none
+    """
+    best = None
+    for state in states:
+        if (state.method, state.preset, state.model) != (method, preset, model) or not state.members:
+            continue
+        try:
+            start = members.index(state.members[0])
+        except ValueError:
+            continue
+        if members[start : start + len(state.members)] != state.members:
+            continue
+        if best is None or len(state.members) > len(best[0].members):
+            best = (state, start)
+    return best
+
+
+def save_state(
+    root: str,
+    accumulator: StackAccumulator,
+    preset: str,
+    model: str,
+    members: List[Member],
+    transforms: List[aligner.Transform],
+    output: str,
+    grays: Dict[str, np.ndarray],
+) -> str:
+    """
+    Write state of a stack into a new folder of `root`.
+    Returns:
+        state folder
+    Raises:
+        OSError: state can't be written
+    """
+    digest = hashlib.sha1(members[0].path.encode()).hexdigest()[:12]
+    folder = os.path.join(root, f'{digest}-{time.time_ns()}')
+    os.makedirs(folder)
+    arrays = dict(accumulator.state())
+    arrays.update(grays)
+    for name, array in arrays.items():
+        np.save(os.path.join(folder, name + '.npy'), array, allow_pickle=False)
+    data = {
+        'version': STATE_VERSION,
+        'method': accumulator.method,
+        'preset': preset,
+        'model': model,
+        'shape': list(accumulator.shape),
+        'members': [list(entry) for entry in members],
+        'transforms': [list(transform) for transform in transforms],
+        'output': os.path.abspath(output),
+    }
+    path = os.path.join(folder, STATE_FILE_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return folder
+
+
+def remove_superseded(states: List[StackState], members: List[Member], keep: str) -> None:
+    """Remove states sharing a member with `members`, except folder `keep`."""
+    paths = {entry.path for entry in members}
+    for state in states:
+        if state.folder != keep and paths.intersection(entry.path for entry in state.members):
+            shutil.rmtree(state.folder, ignore_errors=True)
+
+
+def stack_files(
+    paths: List[str],
+    out_folder: str,
+    method: str = METHOD_MAX,
+    model: str = aligner.MODEL_SIMILARITY,
+    preset: str = blender.PRESET_QUALITY,
+    state_dir: Optional[str] = None,
+    loader: Callable[[str], np.ndarray] = load_image,
+) -> StackResult:
+    """
+    Stack image files into '<last file>_fs.jpg' of `out_folder`, merging only the
+    frames added since a stored state of the stack, and store the new state.
+    Args:
+        paths: frame files in shooting order
+        out_folder: folder of the result
+        method: one of native_stacker.METHODS
+        model: alignment model, one of aligner.MODELS
+        preset: blender preset of METHOD_PYRAMID
+        state_dir: folder of stack states, STATE_FOLDER_NAME of `out_folder` if None
+        loader: decoder of frame files
+    Returns:
+        result; its transforms are from the frame the stored state was first stacked
+        from, the first frame unless frames were added before it
+    Raises:
+        OSError: file can't be read or written
+        ValueError: frames differ in size or there are none
+    """
+    start_time = time.perf_counter()
+    if not paths:
+        raise ValueError('No frames to stack')
+    root = state_root(out_folder, state_dir)
+    members = [member(path) for path in paths]
+    states = read_states(root)
+    found = find_state(states, members, method, preset, model)
+    accumulator = None
+    transforms: List[Optional[aligner.Transform]] = [None] * len(paths)
+    grays: Dict[str, np.ndarray] = {}
+    if found is not None:
+        state, first = found
+        accumulator = StackAccumulator(state.shape, method, preset)
+        try:
+            accumulator.restore(state.arrays())
+            grays = {FIRST_GRAY: state.array(FIRST_GRAY), LAST_GRAY: state.array(LAST_GRAY)}
+        except (OSError, ValueError):
+            #  Damaged state: the stack is stacked again
+            found, accumulator = None, None
+    if found is not None:
+        last = first + len(state.members)
+        transforms[first:last] = state.transforms
+        if method == METHOD_MAX and first:
+            #  Stored frames move up by the frames added before them
+            accumulator.index += first
+        #  Frames after the stored ones, then frames before them, nearest first
+        runs = [
+            (range(last, len(paths)), LAST_GRAY, state.transforms[-1]),
+            (range(first - 1, -1, -1), FIRST_GRAY, state.transforms[0]),
+        ]
+    else:
+        state = None
+        runs = [(range(len(paths)), None, None)]
+    for positions, end, transform in runs:
+        stream = aligner.StreamAligner.resume(grays[end], transform, model) if end else aligner.StreamAligner(model)
+        for position in positions:
+            image = loader(paths[position])
+            if accumulator is None:
+                accumulator = StackAccumulator(image.shape, method, preset)
+            elif image.shape != accumulator.shape:
+                raise ValueError('Frames of a stack differ in size')
+            gray = to_gray(image)
+            transforms[position] = stream.add(gray)
+            warped, valid = aligner.warp(image, transforms[position])
+            del image
+            accumulator.add(warped, valid, position)
+            if position == 0:
+                grays[FIRST_GRAY] = gray
+            if position == len(paths) - 1:
+                grays[LAST_GRAY] = gray
+    merged, crop = accumulator.result()
+    path = os.path.join(out_folder, output_name(paths[-1]))
+    save_jpeg(path, merged, read_exif(paths[-1]))
+    os.makedirs(root, exist_ok=True)
+    folder = save_state(root, accumulator, preset, model, members, transforms, path, grays)
+    remove_superseded(states, members, folder)
+    if state is not None and state.output != os.path.abspath(path) and os.path.isfile(state.output):
+        #  Result of the stack before it grew
+        os.remove(state.output)
+    return StackResult(path, len(paths), transforms, crop, time.perf_counter() - start_time)
@@ -0,0 +1,191 @@
+"""
+Write-ahead journal of file moves made by the grouper.
+
+Before any file of a stack is moved, the stack is recorded in
+`<jpg_folder>/.fs_journal.jsonl` as a 'plan' entry (stack folder name, file names
+and timestamps). Progress is recorded by 'commit' entries every `COMMIT_BATCH`
+moves, each flushed with fsync of the journal and of the touched folders, and the
+journal is removed once every planned stack has been moved. A journal left next to
+an 'fs' folder therefore means an interrupted run: it can be resumed from the last
+committed move or rolled back, using only the file names stored in the journal.
+
+Entries are JSON objects, one per line:
+    {"op": "plan", "dir": "IMG_0001_to_IMG_0005", "files": [...], "timestamps": [...]}
+    {"op": "commit", "moved": 128}
+    {"op": "planned"}     every stack of the run has been planned
+    {"op": "complete"}    every planned file has been moved
+A torn last line (crash while appending) is ignored when the journal is read.
+"""
+import json
+import os
+from typing import IO, Dict, List, NamedTuple, Optional, Set
+
+#  Journal file inside the processed folder
+JOURNAL_FILE_NAME = '.fs_journal.jsonl'
+
+#  Moves between two durable commit entries
+COMMIT_BATCH = 64
+
+
+class PlannedStack(NamedTuple):
+    """Stack recorded in journal: folder name, file names and their timestamps."""
+
+    dirname: str
+    names: List[str]
+    timestamps: List[int]
+
+
+class JournalState(NamedTuple):
+    """
+    Contents of journal left by a previous run.
+    Attributes:
+        stacks: planned stacks in order of moving
+        committed: number of files (counted over `stacks` in order) surely moved
+        planned: the run planned all its stacks before it stopped
+        complete: the run moved all planned files before it stopped
+    """
+
+    stacks: List[PlannedStack]
+    committed: int
+    planned: bool
+    complete: bool
+
+
+def journal_path(jpg_folder: str) -> str:
+    return os.path.join(jpg_folder, JOURNAL_FILE_NAME)
+
+
+def fsync_dir(folder_path: str) -> None:
+    """Make renames inside folder durable. Not supported on every platform."""
+    try:
+        fd = os.open(folder_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def read_journal(jpg_folder: str) -> Optional[JournalState]:
+    """
+    Read journal of an interrupted run.
+    Args:
+        jpg_folder: processed folder
+    Returns:
+        journal contents, None if there is no journal
+    """
+    path = journal_path(jpg_folder)
+    if not os.path.exists(path):
+        return None
+    stacks: List[PlannedStack] = []
+    committed, planned, complete = 0, False, False
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                #  Torn write of the last entry
+                break
+            op = entry.get('op')
+            if op == 'plan':
+                stacks.append(PlannedStack(entry['dir'], entry['files'], entry['timestamps']))
+            elif op == 'commit':
+                committed = entry['moved']
+            elif op == 'planned':
+                planned = True
+            elif op == 'complete':
+                complete = True
+    return JournalState(stacks, committed, planned, complete)
+
+
+class MoveJournal:
+    """Journal being written by the current run."""
+
+    def __init__(
+        self,
+        jpg_folder: str,
+        fs_folder_path: str,
+        state: Optional[JournalState] = None,
+        batch_size: Optional[int] = None,
+    ) -> None:
+        """
+        Args:
+            jpg_folder: processed folder, journal is created in it
+            fs_folder_path: 'fs' folder stacks are moved into
+            state: journal of interrupted run to continue, None to start a new one
+            batch_size: moves between two commit entries, COMMIT_BATCH by default
+        """
+        self.jpg_folder = jpg_folder
+        self.fs_folder_path = fs_folder_path
+        self.path = journal_path(jpg_folder)
+        self.batch_size = batch_size or COMMIT_BATCH
+        #  Files moved since the start of the journal, including interrupted runs
+        self.moved = 0
+        self._committed = 0
+        self._dirty: Set[str] = set()
+        if state is not None:
+            self.moved = self._committed = state.committed
+        self._file: IO[str] = open(self.path, 'a', encoding='utf-8')
+
+    def __enter__(self) -> 'MoveJournal':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _append(self, entry: Dict, sync: bool = True) -> None:
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def plan(self, dirname: str, names: List[str], timestamps: List[int], sync: bool = True) -> None:
+        """
+        Record stack before its files are moved.
+        Args:
+            dirname: name of stack folder inside 'fs'
+            names: files of stack
+            timestamps: timestamps of files, seconds since epoch
+            sync: fsync journal right away, False when several stacks are planned at once
+                and followed by `all_planned`
+        """
+        self._append(
+            {'op': 'plan', 'dir': dirname, 'files': list(names), 'timestamps': list(timestamps)},
+            sync,
+        )
+
+    def all_planned(self) -> None:
+        """Record that every stack of the run has been planned."""
+        self._append({'op': 'planned'})
+
+    def record_move(self, stack_path: str) -> None:
+        """Count one moved file of stack folder, commit every `batch_size` moves."""
+        self.moved += 1
+        self._dirty.add(stack_path)
+        if self.moved - self._committed >= self.batch_size:
+            self.commit()
+
+    def commit(self) -> None:
+        """Make moves so far durable and record their count."""
+        if self.moved == self._committed:
+            return
+        for folder_path in sorted(self._dirty) + [self.jpg_folder]:
+            fsync_dir(folder_path)
+        self._dirty.clear()
+        self._append({'op': 'commit', 'moved': self.moved})
+        self._committed = self.moved
+
+    def complete(self) -> None:
+        """Record that every planned file was moved and remove the journal."""
+        self.commit()
+        self._append({'op': 'complete'})
+        self.close()
+        os.remove(self.path)
+        fsync_dir(self.jpg_folder)
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
@@ -0,0 +1,197 @@
+"""
+Results ledger: which stacks are already stacked, so re-runs skip them.
+
+stacker.js `loopFolders` stacks every subfolder of 'fs' on every run, so a crash at
+stack 70 of 80 means redoing all 80. The ledger, a JSON file saved next to the
+results (where the run report goes), records for every stacked stack:
+    - fingerprint of its members: names, sizes and modification times
+    - backend and its settings that shape the result (blending method, script
+      digest...)
+    - result file, relative to the ledger folder
+A stack is done when its record matches all of these and the result file is still
+there; only the others are dispatched on re-run. Stacks are identified by the name
+of their last frame, like their results.
+
+For Photoshop, stacks are passed as an explicit job list of pending stacks only,
+and a stack counts as stacked once its result file is newer than the start of the
+script run, so stacks finished before a crash are recorded too.
+"""
+import hashlib
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from manifest import JOB_LIST_FILE_NAME, write_jobs
+
+#  Ledger file, next to the run report
+LEDGER_NAME = 'fs_ledger.json'
+LEDGER_VERSION = 1
+
+#  Suffix of result name, after the name of the last frame (stacker.js `SaveJPG`)
+RESULT_SUFFIX = '_fs.jpg'
+
+#  Seconds a result may look older than the run that wrote it (coarse timestamps of
+#  FAT and exFAT volumes)
+MTIME_SLACK = 2.0
+
+#  Backends recorded with stacks
+BACKEND_PHOTOSHOP = 'photoshop'
+BACKEND_NATIVE = 'native'
+
+
+class LedgerEntry(NamedTuple):
+    """Record of one stacked stack."""
+
+    fingerprint: str
+    backend: str
+    settings: Dict[str, str]
+    output: str
+
+
+def stack_id(files: List[str]) -> str:
+    """Name of last frame without extension, as in the result name."""
+    return os.path.splitext(os.path.basename(files[-1]))[0]
+
+
+def result_path(out_folder: str, files: List[str]) -> str:
+    return os.path.join(out_folder, stack_id(files) + RESULT_SUFFIX)
+
+
+def fingerprint(files: List[str]) -> str:
+    """
+    Digest of member names, sizes and modification times, in stack order.
+    Raises:
+        OSError: a member can't be accessed
+    """
+    digest = hashlib.sha1()
+    for path in files:
+        stat = os.stat(path)
+        digest.update(f'{os.path.basename(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def ledger_path(path: str) -> str:
+    """Ledger of grouped folder or job list: in the grouped folder, next to the job list in manifest mode."""
+    folder = os.path.dirname(os.path.abspath(path)) if os.path.isfile(path) else path
+    return os.path.join(folder, LEDGER_NAME)
+
+
+class Ledger:
+    """Records of stacked stacks of one grouped folder, by stack id."""
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path: ledger file; missing or unreadable is an empty ledger
+        """
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.entries: Dict[str, LedgerEntry] = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == LEDGER_VERSION:
+                self.entries = {key: LedgerEntry(**entry) for key, entry in data['stacks'].items()}
+        except (OSError, ValueError, TypeError, KeyError):
+            #  Stacks are stacked again, nothing else is lost
+            pass
+
+    def is_done(self, job: Tuple[str, List[str]], backend: str, settings: Dict[str, str]) -> bool:
+        """Whether stack was stacked from the same members by the same backend and settings."""
+        out_folder, files = job
+        entry = self.entries.get(stack_id(files))
+        if entry is None or entry.backend != backend or entry.settings != settings:
+            return False
+        output = os.path.join(self.root, entry.output)
+        if os.path.abspath(output) != os.path.abspath(result_path(out_folder, files)) or not os.path.isfile(output):
+            return False
+        try:
+            return entry.fingerprint == fingerprint(files)
+        except OSError:
+            return False
+
+    def pending(
+        self, jobs: List[Tuple[str, List[str]]], backend: str, settings: Dict[str, str]
+    ) -> List[Tuple[str, List[str]]]:
+        """Jobs not done, in their order."""
+        return [job for job in jobs if not self.is_done(job, backend, settings)]
+
+    def unstacked(self, jobs: List[Tuple[str, List[str]]]) -> List[Tuple[str, List[str]]]:
+        """Jobs not done by any backend and settings, in their order."""
+        unstacked = []
+        for job in jobs:
+            entry = self.entries.get(stack_id(job[1]))
+            if entry is None or not self.is_done(job, entry.backend, entry.settings):
+                unstacked.append(job)
+        return unstacked
+
+    def record(self, job: Tuple[str, List[str]], backend: str, settings: Dict[str, str]) -> None:
+        """
+        Record stack as stacked into its result file.
+        Raises:
+            OSError: a member can't be accessed
+        """
+        out_folder, files = job
+        output = os.path.relpath(os.path.abspath(result_path(out_folder, files)), self.root)
+        self.entries[stack_id(files)] = LedgerEntry(fingerprint(files), backend, dict(settings), output)
+
+    def record_finished(
+        self,
+        jobs: List[Tuple[str, List[str]]],
+        backend: str,
+        settings: Dict[str, str],
+        since: float,
+    ) -> int:
+        """
+        Record stacks whose result file was written at or after `since` (a time.time()).
+        Returns:
+            number of stacks recorded
+        """
+        recorded = 0
+        for job in jobs:
+            try:
+                if os.path.getmtime(result_path(*job)) >= since - MTIME_SLACK:
+                    self.record(job, backend, settings)
+                    recorded += 1
+            except OSError:
+                continue
+        return recorded
+
+    def save(self) -> None:
+        """Write ledger atomically."""
+        data = {
+            'version': LEDGER_VERSION,
+            'stacks': {key: entry._asdict() for key, entry in sorted(self.entries.items())},
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def script_settings(script: str) -> Dict[str, str]:
+    """Settings of Photoshop backend: digest of the script, so an edited script restacks."""
+    try:
+        with open(script, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        digest = ''
+    return {'script': os.path.basename(script), 'digest': digest}
+
+
+def pending_job_list(path: str, jobs: List[Tuple[str, List[str]]], job_list: Optional[str] = None) -> str:
+    """
+    Write job list of `jobs` for stacker.js.
+    Args:
+        path: grouped folder or job list the jobs are of
+        jobs: stacks to stack
+        job_list: job list file, by default JOB_LIST_FILE_NAME next to `path`
+    Returns:
+        path of job list
+    """
+    folder = os.path.dirname(os.path.abspath(path.rstrip(os.sep)))
+    job_list = job_list or os.path.join(folder, JOB_LIST_FILE_NAME)
+    write_jobs(job_list, jobs)
+    return job_list
@@ -0,0 +1,128 @@
+"""
+Stack index of folders grouped without moving files.
+
+In manifest mode the grouper leaves photos where they are and writes one JSON file,
+`<jpg_folder>/fs.json` (named after the grouped folder), listing every stack: its id
+(the would-be stack folder name), member files relative to the processed folder and
+time span. The manifest is written atomically, so its presence marks a completed
+folder. Photoshop gets the stacks as a job list, one stack per line:
+    <output folder>\t<file>\t<file>...
+"""
+import json
+import os
+from typing import List, NamedTuple, Tuple
+
+from scanner import is_image_name, scan_directory
+
+MANIFEST_VERSION = 1
+
+#  Job list for stacker.js, written next to the manifest
+JOB_LIST_FILE_NAME = '.fs_jobs.txt'
+
+
+class ManifestStack(NamedTuple):
+    """One stack: id, member file names and time span (ISO 8601)."""
+
+    id: str
+    files: List[str]
+    start: str
+    end: str
+
+
+def manifest_name(folder_grouped: str) -> str:
+    """Manifest file name for grouped folder name, e.g. 'fs' -> 'fs.json'."""
+    return f'{folder_grouped}.json'
+
+
+def manifest_path(jpg_folder: str, folder_grouped: str) -> str:
+    return os.path.join(jpg_folder, manifest_name(folder_grouped))
+
+
+def write_manifest(path: str, mode: str, stacks: List[ManifestStack]) -> None:
+    """
+    Write manifest atomically: to a temporary file, fsynced, then renamed.
+    Args:
+        path: manifest file
+        mode: grouping mode the manifest was written by
+        stacks: stacks in time order
+    """
+    data = {
+        'version': MANIFEST_VERSION,
+        'mode': mode,
+        'stacks': [stack._asdict() for stack in stacks],
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_manifest(path: str) -> Tuple[str, List[ManifestStack]]:
+    """
+    Read manifest.
+    Returns:
+        grouping mode & stacks
+    Raises:
+        OSError, ValueError: manifest can't be read
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data['mode'], [ManifestStack(**stack) for stack in data['stacks']]
+
+
+def manifest_jobs(
+    jpg_folder: str, stacks: List[ManifestStack], output_folder: str
+) -> List[Tuple[str, List[str]]]:
+    """(output folder, files) stacks of manifest, as in its job list."""
+    return [(output_folder, [os.path.join(jpg_folder, name) for name in stack.files]) for stack in stacks]
+
+
+def write_job_list(jpg_folder: str, stacks: List[ManifestStack], output_folder: str) -> str:
+    """
+    Write stacker.js job list for stacks of manifest.
+    Args:
+        jpg_folder: folder the manifest file names are relative to
+        stacks: stacks of manifest
+        output_folder: folder for stacked images
+    Returns:
+        path of job list
+    """
+    path = os.path.join(jpg_folder, JOB_LIST_FILE_NAME)
+    write_jobs(path, manifest_jobs(jpg_folder, stacks, output_folder))
+    return path
+
+
+def write_jobs(path: str, jobs: List[Tuple[str, List[str]]]) -> None:
+    """Write job list of (output folder, files) stacks."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for output_folder, files in jobs:
+            f.write('\t'.join([output_folder] + files) + '\n')
+
+
+def read_jobs(job_list: str) -> List[Tuple[str, List[str]]]:
+    """Stacks of job list: (output folder, files) per line."""
+    jobs = []
+    with open(job_list, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) > 1:
+                jobs.append((fields[0], fields[1:]))
+    return jobs
+
+
+def find_jobs(path: str) -> List[Tuple[str, List[str]]]:
+    """
+    Stacks to process: subfolders of grouped folder (results saved into it), or lines
+    of job list file.
+    """
+    if os.path.isfile(path):
+        return read_jobs(path)
+    jobs = []
+    for entry in scan_directory(path):
+        if entry.is_dir:
+            files = [e.path for e in scan_directory(entry.path) if is_image_name(e.name)]
+            if files:
+                jobs.append((path, files))
+    return jobs
@@ -0,0 +1,199 @@
+"""
+Persistent cache of EXIF header fields.
+
+One SQLite file per storage root maps (path, size, mtime_ns) of an image to the
+header fields the grouper extracted from it, so re-runs over unchanged folders
+don't parse any EXIF. Paths are stored relative to the cache file's folder, so the
+cache stays valid when an external disk is mounted at a different place. Least
+recently used entries are evicted once the cache grows beyond `max_entries`.
+"""
+import os
+import sqlite3
+import time
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from exif_reader import ExifHeader
+
+#  Default upper bound of cached files, roughly 100 bytes per entry on disk
+DEFAULT_MAX_ENTRIES = 200_000
+
+#  SQLite host parameter limit is 999 on older builds
+_QUERY_CHUNK = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    datetime TEXT,
+    datetime_original TEXT,
+    subsec_original TEXT,
+    make TEXT,
+    model TEXT,
+    width INTEGER,
+    height INTEGER,
+    last_used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS metadata_last_used ON metadata (last_used);
+"""
+
+
+class CacheKey(NamedTuple):
+    """Identity of a file version: absolute path, size and modification time."""
+
+    path: str
+    size: int
+    mtime_ns: int
+
+
+class MetadataCache:
+    """SQLite-backed map from file identity to ExifHeader."""
+
+    def __init__(
+        self,
+        db_path: str,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        rebuild: bool = False,
+    ) -> None:
+        """
+        Args:
+            db_path: path to SQLite file, created if missing
+            max_entries: number of entries kept after LRU eviction on close
+            rebuild: ignore stored entries, every looked up file is read again and
+                its entry overwritten
+        """
+        self.root = os.path.dirname(os.path.abspath(db_path))
+        self.max_entries = max_entries
+        self.rebuild = rebuild
+        self.now = int(time.time())
+        self.hits = 0
+        self.misses = 0
+        self._touched: List[Tuple[int, str]] = []
+        self._stored: List[tuple] = []
+        self._conn = sqlite3.connect(db_path)
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self) -> 'MetadataCache':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _relpath(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def lookup(self, keys: Sequence[CacheKey]) -> List[Optional[ExifHeader]]:
+        """
+        Find cached headers of unchanged files.
+        Args:
+            keys: file identities (size & mtime from the folder scan)
+        Returns:
+            cached header or None (missing or changed file) for each key
+        """
+        if self.rebuild:
+            self.misses += len(keys)
+            return [None] * len(keys)
+        relpaths = [self._relpath(key.path) for key in keys]
+        rows = {}
+        for i in range(0, len(relpaths), _QUERY_CHUNK):
+            chunk = relpaths[i : i + _QUERY_CHUNK]
+            rows.update(
+                (row[0], row[1:])
+                for row in self._conn.execute(
+                    'SELECT path, size, mtime_ns, datetime, datetime_original, '
+                    'subsec_original, make, model, width, height FROM metadata '
+                    f'WHERE path IN ({",".join("?" * len(chunk))})',
+                    chunk,
+                )
+            )
+        headers: List[Optional[ExifHeader]] = []
+        for key, relpath in zip(keys, relpaths):
+            row = rows.get(relpath)
+            if row is None or row[0] != key.size or row[1] != key.mtime_ns:
+                headers.append(None)
+                self.misses += 1
+                continue
+            headers.append(ExifHeader(*row[2:], bytes_read=0))
+            self._touched.append((self.now, relpath))
+            self.hits += 1
+        return headers
+
+    def store(self, key: CacheKey, header: ExifHeader) -> None:
+        """
+        Remember header of file. Written to disk on `flush`/`close`.
+        Args:
+            key: file identity the header was read from
+            header: header fields
+        """
+        self._stored.append(
+            (self._relpath(key.path), key.size, key.mtime_ns) + tuple(header[:-1]) + (self.now,)
+        )
+
+    def flush(self) -> None:
+        """Write stored entries and LRU timestamps of hits in one transaction."""
+        with self._conn:
+            self._conn.executemany(
+                'UPDATE metadata SET last_used = ? WHERE path = ?', self._touched
+            )
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                self._stored,
+            )
+        self._touched, self._stored = [], []
+
+    def evict(self) -> int:
+        """
+        Drop least recently used entries above `max_entries`.
+        Returns:
+            number of evicted entries
+        """
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM metadata').fetchone()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        with self._conn:
+            self._conn.execute(
+                'DELETE FROM metadata WHERE path IN '
+                '(SELECT path FROM metadata ORDER BY last_used LIMIT ?)',
+                (excess,),
+            )
+        return excess
+
+    def close(self) -> None:
+        """Flush pending writes, evict and close the database, closed even if writing fails."""
+        try:
+            self.flush()
+            self.evict()
+        finally:
+            self._conn.close()
+
+
+def open_cache(
+    db_path: str, max_entries: int = DEFAULT_MAX_ENTRIES, rebuild: bool = False
+) -> Optional[MetadataCache]:
+    """
+    Open metadata cache, warning instead of failing if it can't be used (read-only
+    volume, corrupted file).
+    Args:
+        db_path: path to SQLite file
+        max_entries: number of entries kept after LRU eviction
+        rebuild: ignore stored entries
+    Returns:
+        opened cache or None
+    """
+    try:
+        return MetadataCache(db_path, max_entries, rebuild)
+    except sqlite3.Error as e:
+        print(f'\n⚠️  WARNING: Metadata cache {db_path} is not available ({e}), reading all files')
+        return None
+
+
+def close_cache(cache: MetadataCache) -> None:
+    """
+    Close metadata cache, warning instead of failing if it can't be written (disk
+    full, volume gone): headers it missed are read from the files again next time.
+    """
+    try:
+        cache.close()
+    except (sqlite3.Error, OSError) as e:
+        print(f'\n⚠️  WARNING: Metadata cache could not be saved ({e}), headers will be read again')
@@ -0,0 +1,626 @@
+"""
+Native focus stacking backend: NumPy replacement of the Photoshop step.
+
+Does what stacker.js asks Photoshop for, without macOS or a GUI app:
+    autoAlign         frames are aligned to the first one by aligner.py (similarity
+                      transforms by default, found with pyramid phase correlation)
+    autoBlendLayers   per-pixel focus measure (squared Laplacian of luminance,
+                      box-filtered), every pixel taken from the sharpest frame
+                      ('max'), averaged with focus weights ('weighted') or fused
+                      per band of Laplacian pyramids by blender.py ('pyramid')
+    autoCrop          result is cropped to the region covered by every frame
+    SaveJPG           '<last layer>_fs.jpg' is saved to the output folder
+Input is the grouped 'fs' folder (one stack per subfolder, results saved into
+'fs' itself) or a job list of manifest mode, as for stacker.js.
+
+With --streaming frames are decoded, aligned and blended one at a time into a
+StackAccumulator: peak memory is a few frames whatever the stack length, for
+stacks too long to hold decoded at once. With --decoders N the same is done while
+N worker processes decode the next frames into shared memory (pipeline.py). With
+--prefetch N frames are decoded ahead on background threads (prefetcher.py), across
+stacks when stacks are stacked one after another. With --cache-mb N decoded frames
+are kept in a disk cache (frame_cache.py) and memory-mapped on re-runs. With
+--incremental the state of every stacked stack is kept, and frames added to a stack
+later are merged into it without stacking the others again (incremental.py).
+
+Usage:
+    python native_stacker.py <fs folder | job list> [--method max|weighted|pyramid]
+                             [--preset fast|quality] [--model translation|similarity|affine]
+                             [--streaming] [--decoders N] [--prefetch N] [--prefetch-mb N]
+                             [--cache-mb N] [--cache-dir DIR] [--incremental]
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import aligner
+import blender
+from frame_cache import FrameCache
+from image_loader import decode_counts, describe_decodes, load_image, output_name, read_exif, save_jpeg, to_gray
+from manifest import find_jobs
+from prefetcher import Prefetcher, StageTimings
+
+#  Blending methods
+METHOD_MAX = 'max'
+METHOD_WEIGHTED = 'weighted'
+METHOD_PYRAMID = 'pyramid'
+METHODS = (METHOD_MAX, METHOD_WEIGHTED, METHOD_PYRAMID)
+
+#  Radius of box filter smoothing the focus measure, pixels
+FOCUS_RADIUS = 2
+
+#  Exponent of focus measure in weighted blending, higher is closer to 'max'
+WEIGHT_POWER = 2.0
+
+
+class StackResult(NamedTuple):
+    """
+    One stacked image.
+    Attributes:
+        path: saved result
+        frames: number of stacked frames
+        transforms: transform from the first frame to every frame
+        crop: (top, bottom, left, right) of the region covered by every frame
+        seconds: time spent on the stack
+        stages: prefetch stage timings while the stack was stacked, None without prefetching
+    """
+
+    path: str
+    frames: int
+    transforms: List[aligner.Transform]
+    crop: Tuple[int, int, int, int]
+    seconds: float
+    stages: Optional[StageTimings] = None
+
+
+def box_filter(plane: np.ndarray, radius: int) -> np.ndarray:
+    """Mean over (2*radius+1)^2 window, edges extended, with summed-area table."""
+    if radius <= 0:
+        return plane
+    size = 2 * radius + 1
+    padded = np.pad(plane, radius, mode='edge').astype(np.float64)
+    sat = np.pad(padded.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    window = sat[size:, size:] - sat[:-size, size:] - sat[size:, :-size] + sat[:-size, :-size]
+    return (window / (size * size)).astype(np.float32)
+
+
+def laplacian(gray: np.ndarray) -> np.ndarray:
+    """4-neighbour Laplacian, edges extended."""
+    padded = np.pad(gray, 1, mode='edge')
+    return (
+        padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]
+        - 4 * gray
+    )
+
+
+def focus_measure(gray: np.ndarray, radius: int = FOCUS_RADIUS) -> np.ndarray:
+    """Local sharpness of every pixel: box-filtered squared Laplacian."""
+    return box_filter(np.square(laplacian(gray)), radius)
+
+
+def blend(
+    images: List[np.ndarray], method: str = METHOD_MAX, preset: str = blender.PRESET_QUALITY
+) -> np.ndarray:
+    """
+    Merge aligned frames by their per-pixel focus measure.
+    Args:
+        images: aligned uint8 RGB frames of one shape
+        method: METHOD_MAX takes every pixel from the sharpest frame, METHOD_WEIGHTED
+            averages frames weighted by sharpness, METHOD_PYRAMID fuses Laplacian pyramids
+        preset: blender preset of METHOD_PYRAMID
+    Returns:
+        uint8 RGB image
+    """
+    if method == METHOD_PYRAMID:
+        return blender.fuse(images, preset)
+    focus = np.stack([focus_measure(to_gray(image)) for image in images])
+    if method == METHOD_MAX:
+        sharpest = np.argmax(focus, axis=0)
+        frames = np.stack(images)
+        return np.take_along_axis(frames, sharpest[None, :, :, None], axis=0)[0]
+    weights = np.power(focus, WEIGHT_POWER, dtype=np.float32) + 1e-6
+    weights /= weights.sum(axis=0)
+    merged = np.zeros(images[0].shape, dtype=np.float32)
+    for weight, image in zip(weights, images):
+        merged += weight[:, :, None] * image
+    return np.clip(np.rint(merged), 0, 255).astype(np.uint8)
+
+
+class StackAccumulator:
+    """
+    Blend of aligned frames added one at a time, same as `blend` of all of them.
+    Keeps per method:
+        max       best focus measure so far, composite of the sharpest pixels so far
+                  and index of the frame every composite pixel comes from
+        weighted  running sums of focus-weighted pixels and of weights
+        pyramid   fused pyramid of blender.py and the first frame, filling pixels
+                  other frames don't cover
+    and the mask of pixels covered by every frame, for the crop.
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, ...],
+        method: str = METHOD_MAX,
+        preset: str = blender.PRESET_QUALITY,
+        max_levels: Optional[int] = None,
+    ) -> None:
+        """
+        Args:
+            shape: (height, width, 3) of frames
+            method: one of METHODS
+            preset: blender preset of METHOD_PYRAMID
+            max_levels: limit of pyramid depth of METHOD_PYRAMID below the preset one
+        """
+        plane = tuple(shape[:2])
+        self.shape = tuple(shape)
+        self.method = method
+        self.frames = 0
+        self.covered = np.ones(plane, dtype=bool)
+        if method == METHOD_MAX:
+            self.score = np.full(plane, -1.0, dtype=np.float32)
+            self.composite = np.zeros(shape, dtype=np.uint8)
+            self.index = np.zeros(plane, dtype=np.uint16)
+        elif method == METHOD_WEIGHTED:
+            self._weighted = np.zeros(shape, dtype=np.float32)
+            self._weights = np.zeros(plane, dtype=np.float32)
+        else:
+            self._blender = blender.PyramidBlender(shape, preset, max_levels)
+            self._reference: Optional[np.ndarray] = None
+
+    def _focus(self, image: np.ndarray, valid: Optional[np.ndarray]) -> np.ndarray:
+        """Focus measure of frame, -1 where its box filter reaches uncovered pixels."""
+        focus = focus_measure(to_gray(image))
+        if valid is not None and not valid.all():
+            #  Edges of uncovered area look sharp: pixels near them are left to other frames
+            inner = box_filter(valid.astype(np.float32), FOCUS_RADIUS + 1) > 0.999
+            focus[~inner] = -1.0
+        return focus
+
+    def add(self, image: np.ndarray, valid: Optional[np.ndarray] = None, index: Optional[int] = None) -> None:
+        """
+        Blend in next aligned frame.
+        Args:
+            image: uint8 RGB frame of accumulator shape
+            valid: mask of pixels the frame covers, all of them by default
+            index: position of the frame in the stack for the source index map, the
+                number of frames added before by default
+        Raises:
+            ValueError: frame differs in size
+        """
+        if image.shape != self.shape:
+            raise ValueError('Frames of a stack differ in size')
+        if valid is not None:
+            self.covered &= valid
+        if self.method == METHOD_MAX:
+            focus = self._focus(image, valid)
+            sharper = focus > self.score
+            np.copyto(self.score, focus, where=sharper)
+            np.copyto(self.composite, image, where=sharper[:, :, None])
+            self.index[sharper] = self.frames if index is None else index
+        elif self.method == METHOD_WEIGHTED:
+            weight = np.power(np.maximum(self._focus(image, valid), 0), WEIGHT_POWER, dtype=np.float32)
+            weight += 1e-6
+            if valid is not None:
+                weight[~valid] = 0
+            self._weights += weight
+            self._weighted += weight[:, :, None] * image
+        else:
+            if self._reference is None:
+                self._reference = image.copy()
+            elif valid is not None:
+                image = np.where(valid[:, :, None], image, self._reference)
+            self._blender.add(image)
+        self.frames += 1
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """Running maps and sums of the blend, to resume it later with `restore`."""
+        state = {'frames': np.array(self.frames), 'covered': self.covered}
+        if self.method == METHOD_MAX:
+            state.update(score=self.score, composite=self.composite, index=self.index)
+        elif self.method == METHOD_WEIGHTED:
+            state.update(weighted=self._weighted, weights=self._weights)
+        else:
+            state.update(self._blender.state())
+            if self._reference is not None:
+                state['reference'] = self._reference
+        return state
+
+    def restore(self, state: Dict[str, np.ndarray]) -> None:
+        """
+        Resume blending from `state` of an accumulator of the same shape, method and
+        preset.
+        Raises:
+            ValueError: state is of another accumulator
+        """
+        if self.method == METHOD_MAX:
+            arrays = {'score': self.score, 'composite': self.composite, 'index': self.index}
+        elif self.method == METHOD_WEIGHTED:
+            arrays = {'weighted': self._weighted, 'weights': self._weights}
+        else:
+            self._blender.restore(state)
+            self._reference = np.array(state['reference']) if 'reference' in state else None
+            arrays = {}
+        arrays['covered'] = self.covered
+        try:
+            for name, array in arrays.items():
+                np.copyto(array, state[name], casting='no')
+        except (KeyError, ValueError, TypeError) as e:
+            raise ValueError(f'Stack state does not match the accumulator: {e}') from e
+        self.frames = int(state['frames'])
+
+    def blended(self) -> np.ndarray:
+        """
+        Blended uint8 image of the whole frame, uncovered pixels included.
+        Raises:
+            ValueError: no frames added
+        """
+        if not self.frames:
+            raise ValueError('No frames to stack')
+        if self.method == METHOD_MAX:
+            return self.composite
+        if self.method == METHOD_WEIGHTED:
+            merged = self._weighted / self._weights[:, :, None]
+            return np.clip(np.rint(merged), 0, 255).astype(np.uint8)
+        return self._blender.result()
+
+    def result(self) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+        """
+        Blended image cropped to pixels covered by every frame, and the crop region.
+        Raises:
+            ValueError: no frames added
+        """
+        merged = self.blended()
+        top, bottom, left, right = aligner.valid_region(self.covered)
+        return np.ascontiguousarray(merged[top:bottom, left:right]), (top, bottom, left, right)
+
+
+def stack_images(
+    images: List[np.ndarray],
+    method: str = METHOD_MAX,
+    model: str = aligner.MODEL_SIMILARITY,
+    preset: str = blender.PRESET_QUALITY,
+) -> Tuple[np.ndarray, List[aligner.Transform], Tuple[int, int, int, int]]:
+    """
+    Align, blend and crop frames of one stack.
+    Args:
+        images: uint8 RGB frames of one shape, in shooting order
+        method: one of METHODS
+        model: alignment model, one of aligner.MODELS
+        preset: blender preset of METHOD_PYRAMID
+    Returns:
+        stacked image, transform of every frame, crop region
+    Raises:
+        ValueError: frames differ in size or there are none
+    """
+    if not images:
+        raise ValueError('No frames to stack')
+    if any(image.shape != images[0].shape for image in images):
+        raise ValueError('Frames of a stack differ in size')
+    transforms = aligner.align_frames((to_gray(image) for image in images), model).transforms
+    aligned = []
+    covered = np.ones(images[0].shape[:2], dtype=bool)
+    for image, transform in zip(images, transforms):
+        warped, valid = aligner.warp(image, transform)
+        aligned.append(warped)
+        covered &= valid
+    top, bottom, left, right = aligner.valid_region(covered)
+    merged = blend([image[top:bottom, left:right] for image in aligned], method, preset)
+    return np.ascontiguousarray(merged), transforms, (top, bottom, left, right)
+
+
+def stack_stream(
+    images: Iterable[np.ndarray],
+    method: str = METHOD_MAX,
+    model: str = aligner.MODEL_SIMILARITY,
+    preset: str = blender.PRESET_QUALITY,
+) -> Tuple[np.ndarray, List[aligner.Transform], Tuple[int, int, int, int]]:
+    """
+    Align, blend and crop frames of one stack, one frame at a time: `stack_images`
+    in memory of a few frames.
+    Args:
+        images: uint8 RGB frames of one shape in shooting order, consumed one at a time
+        method: one of METHODS
+        model: alignment model, one of aligner.MODELS
+        preset: blender preset of METHOD_PYRAMID
+    Returns:
+        stacked image, transform of every frame, crop region
+    Raises:
+        ValueError: frames differ in size or there are none
+    """
+    accumulator = None
+    stream = aligner.StreamAligner(model)
+    transforms = []
+    for image in images:
+        if accumulator is None:
+            accumulator = StackAccumulator(image.shape, method, preset)
+        transform = stream.add(to_gray(image))
+        warped, valid = aligner.warp(image, transform)
+        #  Decoded frame is released before the next one is decoded
+        del image
+        accumulator.add(warped, valid)
+        transforms.append(transform)
+    if accumulator is None:
+        raise ValueError('No frames to stack')
+    merged, crop = accumulator.result()
+    return merged, transforms, crop
+
+
+def stack_files(
+    paths: List[str],
+    out_folder: str,
+    method: str = METHOD_MAX,
+    model: str = aligner.MODEL_SIMILARITY,
+    preset: str = blender.PRESET_QUALITY,
+    streaming: bool = False,
+    decoders: int = 0,
+    loader: Callable[[str], np.ndarray] = load_image,
+) -> StackResult:
+    """
+    Stack image files and save '<last file>_fs.jpg' into `out_folder`.
+    Files are decoded by `loader` all at once, or one at a time with `streaming`, or
+    by `decoders` worker processes ahead of stacking.
+    Raises:
+        OSError: file can't be read or written
+        ValueError: see `stack_images`
+    """
+    start = time.perf_counter()
+    if decoders:
+        #  Imported here: pipeline builds on this module
+        import pipeline
+
+        merged, transforms, crop = pipeline.stack_pipelined(paths, method, model, preset, decoders)
+    elif streaming:
+        frames = (loader(path) for path in paths)
+        merged, transforms, crop = stack_stream(frames, method, model, preset)
+    else:
+        images = [loader(path) for path in paths]
+        merged, transforms, crop = stack_images(images, method, model, preset)
+    path = os.path.join(out_folder, output_name(paths[-1]))
+    save_jpeg(path, merged, read_exif(paths[-1]))
+    return StackResult(path, len(paths), transforms, crop, time.perf_counter() - start)
+
+
+class StackOptions(NamedTuple):
+    """How every stack of a run is stacked, see `stack_all` for the fields."""
+
+    method: str = METHOD_MAX
+    model: str = aligner.MODEL_SIMILARITY
+    preset: str = blender.PRESET_QUALITY
+    streaming: bool = False
+    memory_mb: int = 0
+    scratch_dir: Optional[str] = None
+    decoders: int = 0
+    prefetch: int = 0
+    prefetch_mb: int = 0
+    cache_mb: int = 0
+    cache_dir: Optional[str] = None
+    incremental: bool = False
+
+
+def frame_loader(options: StackOptions) -> Callable[[str], np.ndarray]:
+    """Loader of frames: through the frame cache with options.cache_mb, `load_image` otherwise."""
+    if not options.cache_mb:
+        return load_image
+    return FrameCache(options.cache_dir, options.cache_mb << 20).load
+
+
+def stack_job(
+    out_folder: str,
+    files: List[str],
+    options: StackOptions = StackOptions(),
+    prefetcher: Optional[Prefetcher] = None,
+    loader: Optional[Callable[[str], np.ndarray]] = None,
+) -> StackResult:
+    """
+    Stack one stack of `find_jobs`, in memory or out of core as `options` say.
+    Args:
+        out_folder: folder of the result
+        files: frame files in shooting order
+        options: how the stack is stacked
+        prefetcher: prefetcher of a run whose order has `files`; with options.prefetch
+            and none given, one for `files` only
+        loader: decoder of frames kept across stacks, `frame_loader(options)` if None
+    Raises:
+        OSError, ValueError: stack can't be processed
+    """
+    os.makedirs(out_folder, exist_ok=True)
+    if options.memory_mb:
+        #  Imported here: tiled_stacker builds on this module
+        import tiled_stacker
+
+        return tiled_stacker.stack_files(
+            files,
+            out_folder,
+            options.method,
+            options.model,
+            options.preset,
+            options.memory_mb << 20,
+            options.scratch_dir,
+        )
+    if options.decoders:
+        return stack_files(files, out_folder, options.method, options.model, options.preset, decoders=options.decoders)
+    if loader is None:
+        loader = frame_loader(options)
+    if options.incremental:
+        #  Imported here: incremental builds on this module
+        import incremental
+
+        return incremental.stack_files(files, out_folder, options.method, options.model, options.preset, loader=loader)
+    own = prefetcher is None and options.prefetch > 0
+    if own:
+        prefetcher = Prefetcher(files, options.prefetch, options.prefetch_mb << 20, loader=loader)
+    try:
+        if prefetcher is None:
+            return stack_files(
+                files,
+                out_folder,
+                options.method,
+                options.model,
+                options.preset,
+                options.streaming,
+                loader=loader,
+            )
+        before = prefetcher.timings()
+        result = stack_files(
+            files,
+            out_folder,
+            options.method,
+            options.model,
+            options.preset,
+            options.streaming,
+            loader=prefetcher.take,
+        )
+        return result._replace(stages=prefetcher.timings() - before)
+    finally:
+        if own:
+            prefetcher.close()
+
+
+def run_prefetcher(jobs: List[Tuple[str, List[str]]], options: StackOptions) -> Optional[Prefetcher]:
+    """
+    Prefetcher of all frames of `jobs` stacked one after another in this order, None
+    if `options` don't prefetch (or stack out of core, decode in processes or stack
+    incrementally, decoding only some frames).
+    """
+    if not options.prefetch or options.memory_mb or options.decoders or options.incremental:
+        return None
+    return Prefetcher(
+        [file for _, files in jobs for file in files],
+        options.prefetch,
+        options.prefetch_mb << 20,
+        loader=frame_loader(options),
+    )
+
+
+def stack_all(
+    path: str,
+    method: str = METHOD_MAX,
+    model: str = aligner.MODEL_SIMILARITY,
+    preset: str = blender.PRESET_QUALITY,
+    streaming: bool = False,
+    memory_mb: int = 0,
+    scratch_dir: Optional[str] = None,
+    decoders: int = 0,
+    prefetch: int = 0,
+    prefetch_mb: int = 0,
+    cache_mb: int = 0,
+    cache_dir: Optional[str] = None,
+    incremental: bool = False,
+) -> List[StackResult]:
+    """
+    Stack every stack of grouped folder or job list one after another, printing progress.
+    Args:
+        path: grouped 'fs' folder or job list of manifest mode
+        method: one of METHODS
+        model: alignment model, one of aligner.MODELS
+        preset: blender preset of METHOD_PYRAMID
+        streaming: decode and blend frames one at a time, see `stack_stream`
+        memory_mb: if set, stack out of core in tiles with this memory budget, see
+            tiled_stacker.py
+        scratch_dir: scratch directory of tiled stacking
+        decoders: decode frames in this many worker processes ahead of stacking, see
+            pipeline.py
+        prefetch: decode up to this many frames ahead on background threads, into the
+            next stacks too, see prefetcher.py
+        prefetch_mb: memory budget of frames decoded ahead, 0 for no limit
+        cache_mb: keep decoded frames in a disk cache of this budget, shared by runs
+            and processes, see frame_cache.py; 0 for no cache
+        cache_dir: cache directory, `frame_cache.default_cache_dir()` if None
+        incremental: keep the state of every stack and merge only frames added since
+            into it, see incremental.py; out-of-core and pipelined stacking go first
+    Returns:
+        results in order of stacks
+    Raises:
+        OSError, ValueError: stack can't be processed
+    """
+    options = StackOptions(
+        method,
+        model,
+        preset,
+        streaming,
+        memory_mb,
+        scratch_dir,
+        decoders,
+        prefetch,
+        prefetch_mb,
+        cache_mb,
+        cache_dir,
+        incremental,
+    )
+    jobs = find_jobs(path)
+    prefetcher = run_prefetcher(jobs, options)
+    results = []
+    try:
+        for out_folder, files in jobs:
+            result = stack_job(out_folder, files, options, prefetcher)
+            print(
+                f'Stacked {result.frames} frames -> {os.path.basename(result.path)} '
+                f'in {result.seconds:.2f}s'
+            )
+            if result.stages:
+                print(f'  Stages: {result.stages.describe()}')
+            results.append(result)
+    finally:
+        if prefetcher:
+            prefetcher.close()
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Focus stacking without Photoshop')
+    parser.add_argument('path', help='grouped "fs" folder or job list of manifest mode')
+    parser.add_argument('--method', choices=METHODS, default=METHOD_MAX, help='blending method')
+    parser.add_argument(
+        '--preset',
+        choices=tuple(blender.PRESETS),
+        default=blender.PRESET_QUALITY,
+        help='pyramid blending preset',
+    )
+    parser.add_argument(
+        '--model', choices=aligner.MODELS, default=aligner.MODEL_SIMILARITY, help='alignment model'
+    )
+    parser.add_argument(
+        '--streaming', action='store_true', help='decode and blend one frame at a time (long stacks)'
+    )
+    parser.add_argument(
+        '--decoders', type=int, default=0, help='decode frames ahead in this many worker processes'
+    )
+    parser.add_argument('--prefetch', type=int, default=0, help='frames decoded ahead on background threads')
+    parser.add_argument('--prefetch-mb', type=int, default=0, help='memory budget of frames decoded ahead')
+    parser.add_argument('--cache-mb', type=int, default=0, help='disk cache of decoded frames with this budget')
+    parser.add_argument('--cache-dir', default=None, help='directory of the decoded frame cache')
+    parser.add_argument(
+        '--incremental', action='store_true', help='merge only frames added to stacks stacked before'
+    )
+    args = parser.parse_args()
+    try:
+        results = stack_all(
+            args.path,
+            args.method,
+            args.model,
+            args.preset,
+            args.streaming,
+            decoders=args.decoders,
+            prefetch=args.prefetch,
+            prefetch_mb=args.prefetch_mb,
+            cache_mb=args.cache_mb,
+            cache_dir=args.cache_dir,
+            incremental=args.incremental,
+        )
+    except (OSError, ValueError) as e:
+        print(f'❌ Stacking failed: {e}')
+        return 1
+    print(f'Focus stacking completed: {len(results)} stack(s)')
+    #  Frames decoded in this process (decoder processes count their own): one full
+    #  decode per frame
+    print(f'Decodes: {describe_decodes(decode_counts())}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
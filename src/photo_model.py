@@ -0,0 +1,204 @@
+"""
+Compact data model of photos passed between grouper stages.
+
+`PhotoTable` stores photos of one folder as a struct of arrays: one list of names
+and typed `array` columns for sizes, timestamps (int64 seconds since epoch),
+sub-second parts and camera ids. `PhotoRecord` is a `__slots__` row used where photos
+are handled one at a time, and `Stack` is a view of a row range of a table that
+references the table instead of copying names.
+"""
+import os
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Union, overload
+
+#  Proleptic ordinal of 1970-01-01
+_EPOCH_ORDINAL = 719163
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_seconds(moment: datetime) -> int:
+    """
+    Naive datetime to seconds since epoch, by plain integer arithmetic so that the
+    value is not shifted by local DST transitions like `datetime.timestamp` would be.
+    """
+    return (
+        (moment.toordinal() - _EPOCH_ORDINAL) * 86400
+        + moment.hour * 3600
+        + moment.minute * 60
+        + moment.second
+    )
+
+
+def from_seconds(seconds: int) -> datetime:
+    """Seconds since epoch back to naive datetime."""
+    return _EPOCH + timedelta(seconds=seconds)
+
+
+def parse_subsec(value: Optional[str]) -> int:
+    """EXIF SubSecTime digits ('628' is .628 s) to microseconds, 0 if absent."""
+    if not value or not value.isdigit():
+        return 0
+    return int(value[:6].ljust(6, '0'))
+
+
+class PhotoRecord:
+    """One photo: file name, path, size, timestamp, sub-second part and camera."""
+
+    __slots__ = ('name', 'path', 'size', 'timestamp', 'subsec', 'camera')
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        size: int,
+        timestamp: int,
+        subsec: int = 0,
+        camera: str = '',
+    ) -> None:
+        self.name = name
+        self.path = path
+        self.size = size
+        self.timestamp = timestamp
+        self.subsec = subsec
+        self.camera = camera
+
+    @property
+    def datetime(self) -> datetime:
+        return from_seconds(self.timestamp)
+
+    def __repr__(self) -> str:
+        return f'PhotoRecord({self.name!r}, {self.datetime})'
+
+
+class PhotoTable:
+    """Photos of one folder stored column-wise."""
+
+    __slots__ = ('folder', 'names', 'sizes', 'timestamps', 'subsecs', 'camera_ids', 'cameras', '_camera_index')
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self.names: List[str] = []
+        self.sizes = array('q')
+        #  Seconds since epoch, int64: `np.frombuffer(table.timestamps, np.int64)` is
+        #  a zero-copy NumPy view of this column
+        self.timestamps = array('q')
+        self.subsecs = array('l')
+        self.camera_ids = array('H')
+        self.cameras: List[str] = []
+        self._camera_index: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _camera_id(self, camera: str) -> int:
+        camera_id = self._camera_index.get(camera)
+        if camera_id is None:
+            camera_id = self._camera_index[camera] = len(self.cameras)
+            self.cameras.append(camera)
+        return camera_id
+
+    def append(self, record: PhotoRecord) -> int:
+        """
+        Add photo as the last row.
+        Returns:
+            row index
+        """
+        self.names.append(record.name)
+        self.sizes.append(record.size)
+        self.timestamps.append(record.timestamp)
+        self.subsecs.append(record.subsec)
+        self.camera_ids.append(self._camera_id(record.camera))
+        return len(self.names) - 1
+
+    def path(self, row: int) -> str:
+        return os.path.join(self.folder, self.names[row])
+
+    def datetime(self, row: int) -> datetime:
+        return from_seconds(self.timestamps[row])
+
+    def record(self, row: int) -> PhotoRecord:
+        """Row as a standalone record."""
+        return PhotoRecord(
+            self.names[row],
+            self.path(row),
+            self.sizes[row],
+            self.timestamps[row],
+            self.subsecs[row],
+            self.cameras[self.camera_ids[row]],
+        )
+
+    def __iter__(self) -> Iterator[PhotoRecord]:
+        for row in range(len(self)):
+            yield self.record(row)
+
+    def sorted_by_time(self) -> 'PhotoTable':
+        """
+        New table with rows in time order. Sorting is stable: photos taken in the same
+        second keep their current (name) order.
+        """
+        order = sorted(range(len(self)), key=self.timestamps.__getitem__)
+        table = PhotoTable(self.folder)
+        table.names = [self.names[i] for i in order]
+        table.sizes = array('q', (self.sizes[i] for i in order))
+        table.timestamps = array('q', (self.timestamps[i] for i in order))
+        table.subsecs = array('l', (self.subsecs[i] for i in order))
+        table.camera_ids = array('H', (self.camera_ids[i] for i in order))
+        table.cameras = self.cameras
+        table._camera_index = self._camera_index
+        return table
+
+
+class Stack(Sequence[str]):
+    """
+    Stack of photos as a view of rows [start, end) of a time-sorted table. Behaves as
+    a sequence of file names, nothing is copied.
+    """
+
+    __slots__ = ('table', 'start', 'end')
+
+    def __init__(self, table: PhotoTable, start: int, end: int) -> None:
+        self.table = table
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    @overload
+    def __getitem__(self, index: int) -> str:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[str]:
+        ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('stack index out of range')
+        return self.table.names[self.start + index]
+
+    def __iter__(self) -> Iterator[str]:
+        names = self.table.names
+        for row in range(self.start, self.end):
+            yield names[row]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (Stack, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    @property
+    def timestamps(self) -> List[int]:
+        return self.table.timestamps[self.start : self.end].tolist()
+
+    def records(self) -> Iterator[PhotoRecord]:
+        for row in range(self.start, self.end):
+            yield self.table.record(row)
+
+    def __repr__(self) -> str:
+        return f'Stack({self[0]!r}..{self[-1]!r}, {len(self)} photos)'
@@ -0,0 +1,94 @@
+"""
+Stacking pipeline with frames decoded in worker processes.
+
+Stages:
+    decode   worker processes decode frame files (most of the time of a stack on a
+             fast aligner) into slots of a FramePool
+    stack    this process aligns every frame and blends it into a StackAccumulator
+             straight from its slot, then returns the slot to the pool
+Stages exchange frames only through the pool: decoders get and return a
+FrameHandle, never pixels. Frames are stacked in shooting order, up to `decoders`
+frames being decoded ahead of the one being stacked, so the pool has one slot per
+decoder plus one.
+
+A decoder that fails or dies fails the stack; its slot is released, and all slots
+are unlinked when the stack ends whatever happened.
+"""
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, List, Tuple
+
+import numpy as np
+
+import aligner
+import blender
+from frame_pool import FrameHandle, FramePool, write_frame
+from image_loader import image_shape, load_image, to_gray
+from native_stacker import METHOD_MAX, StackAccumulator
+
+
+def decode_frame(path: str, handle: FrameHandle) -> None:
+    """Decoder stage: decode image file into pool slot of `handle`."""
+    image = load_image(path)
+    if image.shape != handle.shape:
+        raise ValueError('Frames of a stack differ in size')
+    write_frame(handle, image)
+
+
+def stack_pipelined(
+    paths: List[str],
+    method: str = METHOD_MAX,
+    model: str = aligner.MODEL_SIMILARITY,
+    preset: str = blender.PRESET_QUALITY,
+    decoders: int = 2,
+) -> Tuple[np.ndarray, List[aligner.Transform], Tuple[int, int, int, int]]:
+    """
+    Align, blend and crop frame files of one stack, decoding them in worker processes.
+    Args:
+        paths: frame files in shooting order
+        method: one of native_stacker.METHODS
+        model: alignment model, one of aligner.MODELS
+        preset: blender preset of METHOD_PYRAMID
+        decoders: decoder processes
+    Returns:
+        stacked image, transform of every frame, crop region
+    Raises:
+        OSError: file can't be read
+        ValueError: frames differ in size or there are none
+        BrokenProcessPool: decoder process died
+    """
+    if not paths:
+        raise ValueError('No frames to stack')
+    shape = image_shape(paths[0])
+    accumulator = StackAccumulator(shape, method, preset)
+    stream = aligner.StreamAligner(model)
+    transforms = []
+    with FramePool(decoders + 1, int(np.prod(shape))) as pool:
+        #  Decoders are shut down before the pool unlinks the slots they write to
+        with ProcessPoolExecutor(max_workers=decoders) as executor:
+            queued = iter(paths)
+            decoding: Deque[Tuple[Future, FrameHandle]] = deque()
+
+            def decode_ahead() -> None:
+                while pool.free:
+                    path = next(queued, None)
+                    if path is None:
+                        return
+                    handle = pool.acquire(shape)
+                    decoding.append((executor.submit(decode_frame, path, handle), handle))
+
+            decode_ahead()
+            while decoding:
+                future, handle = decoding.popleft()
+                try:
+                    future.result()
+                    frame = pool.view(handle)
+                    transform = stream.add(to_gray(frame))
+                    accumulator.add(*aligner.warp(frame, transform))
+                    del frame
+                finally:
+                    pool.release(handle)
+                transforms.append(transform)
+                decode_ahead()
+    merged, crop = accumulator.result()
+    return merged, transforms, crop
@@ -0,0 +1,183 @@
+"""
+Read-ahead decoding of frames on a background thread pool.
+
+Stacking one frame after another leaves the disk idle while a frame is aligned and
+blended, and the CPU idle while the next one is read and decoded. The prefetcher
+gets the whole order of frames of a run (all frames of a stack, then the next
+stack) and keeps decoding ahead of the frame being stacked: up to `depth` frames
+decoded or being decoded, and no more than the memory budget of decoded pixels
+(frame size is read from the header before decoding). Crossing into the next stack
+is nothing special, so its first frames are decoded while the last frames of the
+current stack are stacked. Reading and JPEG decoding release the GIL, so threads
+overlap them with stacking.
+
+Stage timings tell how much of it overlapped: decoding time of the decoder threads
+against the time stacking actually waited for a frame.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from image_loader import image_shape, load_image
+
+#  Frames decoded ahead by default
+DEFAULT_DEPTH = 4
+
+#  Decoder threads
+DEFAULT_THREADS = 2
+
+
+class StageTimings(NamedTuple):
+    """
+    Cumulative timings of the prefetch stage.
+    Attributes:
+        decode: seconds spent decoding, all decoder threads together
+        wait: seconds the consumer waited for frames (not yet decoded, or decoded
+            in-line when not prefetched)
+        frames: frames handed to the consumer
+        prefetched: frames of them decoded ahead
+    """
+
+    decode: float = 0.0
+    wait: float = 0.0
+    frames: int = 0
+    prefetched: int = 0
+
+    @property
+    def overlapped(self) -> float:
+        """Decoding seconds hidden behind stacking."""
+        return max(self.decode - self.wait, 0.0)
+
+    def __sub__(self, other: 'StageTimings') -> 'StageTimings':  # type: ignore[override]
+        return StageTimings(*(a - b for a, b in zip(self, other)))
+
+    def describe(self) -> str:
+        return (
+            f'decode {self.decode:.2f}s ({self.overlapped:.2f}s overlapped), '
+            f'waited {self.wait:.2f}s, {self.prefetched}/{self.frames} frames prefetched'
+        )
+
+
+class Prefetcher:
+    """Decodes frames of a known order ahead of the consumer taking them one by one."""
+
+    def __init__(
+        self,
+        paths: List[str],
+        depth: int = DEFAULT_DEPTH,
+        memory_budget: int = 0,
+        threads: int = DEFAULT_THREADS,
+        loader: Callable[[str], np.ndarray] = load_image,
+    ) -> None:
+        """
+        Args:
+            paths: frame files in the order they will be taken
+            depth: most frames decoded or being decoded ahead
+            memory_budget: most bytes of frames decoded ahead, 0 for no limit
+            threads: decoder threads
+            loader: decoding function
+        """
+        self.depth = depth
+        self.memory_budget = memory_budget
+        self._loader = loader
+        self._paths = list(paths)
+        self._next = 0
+        self._queued: Dict[int, Tuple[Future, int]] = {}
+        self._queued_bytes = 0
+        self._positions: Dict[str, List[int]] = {}
+        for position, path in enumerate(self._paths):
+            self._positions.setdefault(path, []).append(position)
+        self._taken = 0
+        self._lock = threading.Lock()
+        self._decode = 0.0
+        self._wait = 0.0
+        self._frames = 0
+        self._prefetched = 0
+        self._executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(max_workers=max(threads, 1))
+        self._fill()
+
+    def _frame_bytes(self, path: str) -> int:
+        try:
+            height, width, channels = image_shape(path)
+        except OSError:
+            #  Unreadable header: decoding will fail anyway, in the consumer
+            return 0
+        return height * width * channels
+
+    def _decode_timed(self, path: str) -> np.ndarray:
+        start = time.perf_counter()
+        try:
+            return self._loader(path)
+        finally:
+            with self._lock:
+                self._decode += time.perf_counter() - start
+
+    def _fill(self) -> None:
+        """Queue decoding of next frames while depth and memory budget allow."""
+        while self._executor and self._next < len(self._paths) and len(self._queued) < self.depth:
+            path = self._paths[self._next]
+            size = self._frame_bytes(path)
+            if self.memory_budget and self._queued_bytes + size > self.memory_budget:
+                return
+            self._queued[self._next] = (self._executor.submit(self._decode_timed, path), size)
+            self._queued_bytes += size
+            self._next += 1
+
+    def take(self, path: str) -> np.ndarray:
+        """
+        Decoded frame, prefetched or decoded now. Frames queued before it in the order
+        and not taken are dropped: their stack was given up.
+        Raises:
+            OSError: file can't be read or decoded
+        """
+        start = time.perf_counter()
+        position = next((p for p in self._positions.get(path, ()) if p >= self._taken), None)
+        try:
+            if position is None:
+                #  Not in the order: decoded in-line
+                image = self._decode_timed(path)
+                prefetched = False
+            else:
+                for skipped in [p for p in self._queued if p < position]:
+                    future, size = self._queued.pop(skipped)
+                    future.cancel()
+                    self._queued_bytes -= size
+                self._taken = position + 1
+                self._next = max(self._next, self._taken)
+                queued = self._queued.pop(position, None)
+                if queued is None:
+                    image = self._decode_timed(path)
+                    prefetched = False
+                else:
+                    self._queued_bytes -= queued[1]
+                    image = queued[0].result()
+                    prefetched = True
+        finally:
+            self._fill()
+            self._wait += time.perf_counter() - start
+        self._frames += 1
+        self._prefetched += prefetched
+        return image
+
+    def timings(self) -> StageTimings:
+        with self._lock:
+            return StageTimings(self._decode, self._wait, self._frames, self._prefetched)
+
+    def close(self) -> None:
+        """Drop frames decoded ahead and stop the decoder threads."""
+        executor, self._executor = self._executor, None
+        for future, _ in self._queued.values():
+            future.cancel()
+        self._queued.clear()
+        self._queued_bytes = 0
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def __enter__(self) -> 'Prefetcher':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
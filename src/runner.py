@@ -2,12 +2,26 @@ import subprocess
 import os
 import json
 import sys
+import time
 
 # Add the current directory to Python path to import folder_manager
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
+import grouper
 from folder_manager import determine_workflow_action, create_folder_if_needed
+from ledger import BACKEND_PHOTOSHOP, Ledger, ledger_path, pending_job_list, script_settings
+from manifest import find_jobs, manifest_path, read_manifest, write_job_list
+from scanner import DirectoryScans
+from stack_daemon import STATE_DONE, print_record, submit_stacks
+from transfer import TransferEngine
+
+# Step 3 backends and what runs them, as printed in the Step 3 header
+STACKING_BACKENDS = {
+    "photoshop": "Photoshop script",
+    "native": "native stacker",
+    "daemon": "stacking daemon",
+}
 
 def load_settings(settings_file="settings.txt"):
     """Load settings from JSON file"""
@@ -74,8 +88,13 @@ def run_fetcher(path_current, hours_icloud):
         return False
 
 
-def run_grouper(path_current):
-    """Run grouper.py with the specified path"""
+def run_grouper(path_current, workers=1, use_processes=False, cache_mode="on", stream=False, engine="python",
+                scans=None, transfer_workers=4, transfer_verify=False, mode="move"):
+    """Run grouper in-process with the specified path, number of EXIF readers, metadata cache mode,
+    streaming mode (move every stack as soon as it is closed), grouping engine, parallel copies
+    (with optional hash verification) for an 'fs' folder on another volume and grouping mode
+    ("move", or "manifest", "hardlink", "symlink" to leave files in place).
+    Grouper progress is printed live; folder listings in `scans` are reused"""
     # Normalize the path to handle special characters
     path_current = os.path.abspath(os.path.expanduser(path_current))
     
@@ -88,45 +107,55 @@ def run_grouper(path_current):
         print(f"Error: Path is not a directory: {path_current}")
         return "error"
     
-    print(f"Running grouper.py with path: {path_current}")
+    print(f"Running grouper with path: {path_current}")
     
     try:
-        # Get the path to grouper.py in the same directory as this script
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        grouper_path = os.path.join(script_dir, "grouper.py")
-        
-        # Run grouper.py with the specified path
-        result = subprocess.run([
-            sys.executable, 
-            grouper_path, 
-            path_current
-        ], capture_output=True, text=True, check=False)
-        
-        # Print output regardless of exit code
-        if result.stdout:
-            print("Grouper.py output:")
-            print(result.stdout)
-        if result.stderr:
-            print("Grouper.py errors:")
-            print(result.stderr)
-        
-        # Check exit code and return appropriate status
-        if result.returncode == 0:
-            print("Grouper.py completed successfully with return code 0")
-            return "success"
-        elif result.returncode == 1:
-            print("No image files found in folder.")
-            return "no_files"
-        elif result.returncode == 2:
-            print("No focus stacking groups were created.")
-            return "no_groups"
-        else:
-            print(f"Grouper.py failed with exit code: {result.returncode}")
-            return "error"
-        
-    except FileNotFoundError:
-        print("Error: grouper.py not found in current directory")
+        result = grouper.run_grouping(
+            path_current,
+            workers,
+            use_processes,
+            cache_mode,
+            stream=stream,
+            engine=engine,
+            scans=scans,
+            transfer=TransferEngine(transfer_workers, transfer_verify),
+            mode=mode,
+        )
+    except (grouper.NoImageFilesError, grouper.NoValidTimestampsError) as e:
+        e.report()
+        print("No image files found in folder.")
+        return "no_files"
+    except grouper.NoStacksError as e:
+        e.report()
+        print("No focus stacking groups were created.")
+        return "no_groups"
+    except grouper.GroupingError as e:
+        e.report()
+        print("Grouper failed with critical error.")
+        return "error"
+    except Exception as e:
+        print(f"Error running grouper: {e}")
         return "error"
+    
+    print(
+        f"Grouper completed successfully: {len(result.stacks)} stacks, "
+        f"{result.file_count} files in {result.timings['total']:.2f}s"
+    )
+    return "success"
+
+def prepare_stacking_input(path_current, folder_grouped):
+    """Path to pass to the Photoshop script or native stacker: the grouped folder, or a job list
+    of stacks when the folder was grouped in manifest mode (results are saved to the grouped folder then)"""
+    path_grouped = os.path.join(path_current, folder_grouped)
+    path_manifest = manifest_path(path_current, folder_grouped)
+    if not os.path.exists(path_manifest):
+        return path_grouped
+    _, stacks = read_manifest(path_manifest)
+    if not create_folder_if_needed(path_grouped):
+        return None
+    path_jobs = write_job_list(path_current, stacks, path_grouped)
+    print(f"Job list of {len(stacks)} stacks written from manifest: {path_jobs}")
+    return path_jobs
 
 def run_photoshop_script(stacker, path_grouped, photoshop_app):
     # Check if the script file exists
@@ -161,6 +190,95 @@ def run_photoshop_script(stacker, path_grouped, photoshop_app):
         print(f"AppleScript command was: {applescript_command}")
         return False
 
+def run_photoshop_stacks(stacker, path_grouped, photoshop_app):
+    """Run the Photoshop script on stacks the results ledger doesn't have as stacked with
+    this script: they are passed as an explicit job list, so finished stacks are not stacked
+    again after a crash. Stacks whose results the run wrote are recorded, even if it failed"""
+    jobs = find_jobs(path_grouped)
+    results = Ledger(ledger_path(path_grouped))
+    settings = script_settings(stacker)
+    pending = results.pending(jobs, BACKEND_PHOTOSHOP, settings)
+    if not pending:
+        print(f"✅ All {len(jobs)} stack(s) are already stacked, Photoshop is not needed")
+        return True
+    if len(pending) < len(jobs):
+        print(f"⏭️ Skipping {len(jobs) - len(pending)} stack(s) already stacked")
+    path_jobs = pending_job_list(path_grouped, pending)
+    start = time.time()
+    succeeded = run_photoshop_script(stacker, path_jobs, photoshop_app)
+    recorded = results.record_finished(pending, BACKEND_PHOTOSHOP, settings, start)
+    results.save()
+    print(f"📒 Results ledger: {recorded} of {len(pending)} stack(s) recorded as stacked")
+    return succeeded
+
+def run_daemon_stacks(path_grouped, daemon_folder=None):
+    """Submit stacks to the stacking daemon (stack_daemon.py) and wait for them: the daemon
+    keeps its backend (Photoshop or the native stacker) warm between runs. Stacks the results
+    ledger has as stacked by the daemon's backend are not submitted"""
+    try:
+        records = submit_stacks(path_grouped, daemon_folder, on_finished=print_record)
+    except OSError as e:
+        print(f"Error: Stacking daemon is not available: {e}")
+        print("Start it with: python src/stack_daemon.py serve [--backend native|photoshop] [native stacker options]")
+        return False
+    failed = [record for record in records if record.state != STATE_DONE]
+    print(f"📸 Stacking daemon completed: {len(records) - len(failed)} of {len(records)} stack(s)")
+    return not failed
+
+def run_native_stacker(
+    path_grouped,
+    method="max",
+    streaming=False,
+    memory_mb=0,
+    workers=1,
+    budget_mb=0,
+    decoders=0,
+    prefetch=0,
+    prefetch_mb=0,
+    cache_mb=0,
+    incremental=False,
+):
+    """Run the NumPy stacking backend on the grouped folder or manifest job list,
+    results are saved the same way the Photoshop script saves them.
+    Stacks run in a pool of `workers` processes (in-process for 1), largest first, starting
+    while their estimated memory in flight stays within budget_mb (0 for no limit); estimates
+    are calibrated from the run history in the storage folder. A failed stack doesn't
+    stop the others and is listed in the run report saved next to the results.
+    With streaming, frames are decoded and blended one at a time (long stacks);
+    with memory_mb, frames are spilled to scratch files and blended in tiles (huge frames);
+    with decoders, frames of every stack are decoded ahead in that many processes;
+    with prefetch, that many frames are decoded ahead on threads (into the next stack
+    with one worker), holding at most prefetch_mb of decoded frames (0 for no limit);
+    with cache_mb, decoded frames are kept in a disk cache of that budget for re-runs;
+    with incremental, the state of every stack is kept and frames added later are merged into it"""
+    try:
+        # NumPy and Pillow are needed only by this backend
+        import cost_model
+        import native_stacker
+        import scheduler
+        options = native_stacker.StackOptions(
+            method,
+            streaming=streaming,
+            memory_mb=memory_mb,
+            decoders=decoders,
+            prefetch=prefetch,
+            prefetch_mb=prefetch_mb,
+            cache_mb=cache_mb,
+            incremental=incremental,
+        )
+        history = cost_model.history_path(path_grouped)
+        report = scheduler.schedule(path_grouped, options, workers, budget_mb << 20, history)
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Error running native stacker: {e}")
+        return False
+    
+    print(f"📸 Native stacker completed: {len(report.outcomes) - len(report.failed)} of {len(report.outcomes)} stack(s)")
+    print(f"📁 Processed folder: {os.path.basename(path_grouped)}")
+    if report.failed:
+        print(f"❌ Failed stacks: {', '.join(outcome.name for outcome in report.failed)}")
+        return False
+    return True
+
 def main():
     """Main workflow execution function"""
     # Load settings from file
@@ -176,11 +294,54 @@ def main():
     folder_current_storing = settings.get("folder_current_storing")
     photoshop_app = settings.get("photoshop_app")
     hours_icloud = settings.get("hours_icloud")
+    # Optional grouper settings: concurrent EXIF readers, "thread" or "process" pool
+    grouper_workers = int(settings.get("grouper_workers", 1))
+    grouper_processes = settings.get("grouper_pool", "thread") == "process"
+    # Optional metadata cache mode: "on", "off" or "rebuild"
+    metadata_cache = settings.get("metadata_cache", "on")
+    # Optional streaming grouper: "on" moves every stack as soon as a time gap closes it
+    grouper_stream = settings.get("grouper_stream", "off") == "on"
+    # Optional grouping engine: "python" or "numpy" (archives of 100k+ photos)
+    grouper_engine = settings.get("grouper_engine", "python")
+    # Optional file transfer: parallel copies and hash verification when "fs" is on another volume
+    transfer_workers = int(settings.get("transfer_workers", 4))
+    transfer_verify = settings.get("transfer_verify", "off") == "on"
+    # Optional grouping mode: "move", or "manifest", "hardlink", "symlink" to keep files in place
+    grouping_mode = settings.get("grouping_mode", "move")
+    # Optional Step 3 backend: "photoshop" (macOS), "native" (NumPy, any platform) or "daemon"
+    stacking_backend = settings.get("stacking_backend", "photoshop")
+    # Optional: folder of the stacking daemon socket and queue, the system temp folder by default
+    daemon_folder = settings.get("daemon_folder", "") or None
+    # Optional: native stacker keeps one decoded frame at a time instead of the whole stack
+    native_streaming = settings.get("native_streaming", "off") == "on"
+    # Optional: memory budget (MB) of tiled out-of-core native stacking, 0 stacks whole frames
+    native_memory_mb = int(settings.get("native_memory_mb", 0))
+    # Optional: native stacker processes stacking that many stacks at once
+    native_workers = int(settings.get("native_workers", 1))
+    # Optional: estimated memory (MB) of stacks stacked at once, 0 for no limit
+    native_budget_mb = int(settings.get("native_budget_mb", 0))
+    # Optional: processes decoding frames of a stack ahead of stacking, 0 decodes in-line
+    native_decoders = int(settings.get("native_decoders", 0))
+    # Optional: frames decoded ahead on background threads, 0 for no read-ahead
+    native_prefetch = int(settings.get("native_prefetch", 0))
+    # Optional: memory (MB) of frames decoded ahead, 0 for no limit
+    native_prefetch_mb = int(settings.get("native_prefetch_mb", 0))
+    # Optional: disk cache (MB) of decoded frames reused by re-runs, 0 for no cache
+    native_cache_mb = int(settings.get("native_cache_mb", 0))
+    # Optional: keep stack states and merge only frames added to stacked stacks ("on"/"off")
+    native_incremental = settings.get("native_incremental", "off") == "on"
     
     # Validate required settings
     if not all([stacker, folder_grouped, path_all_storing, folder_current_storing, photoshop_app, hours_icloud]):
         print("Error: Missing required settings (stacker, folder_grouped, path_all_storing, folder_current_storing, photoshop_app, hours_icloud)")
         exit(1)
+    if grouping_mode not in grouper.GROUPING_MODES:
+        print(f"Error: Unknown grouping_mode \"{grouping_mode}\", expected one of: {', '.join(grouper.GROUPING_MODES)}")
+        exit(1)
+    if stacking_backend not in STACKING_BACKENDS:
+        print(f"Error: Unknown stacking_backend \"{stacking_backend}\", "
+              f"expected one of: {', '.join(STACKING_BACKENDS)}")
+        exit(1)
     
     # Normalize paths - update stacker path to account for new structure
     if not os.path.isabs(stacker):
@@ -193,7 +354,7 @@ def main():
     path_all_storing = os.path.abspath(os.path.expanduser(path_all_storing))
     
     # Check if stacker script exists
-    if not os.path.exists(stacker):
+    if stacking_backend == "photoshop" and not os.path.exists(stacker):
         print(f"Error: Script file does not exist: {stacker}")
         exit(1)
     
@@ -201,13 +362,32 @@ def main():
     print("⚙️ Using settings:")
     print("=" * 55)
     print(f"  Photo Fetcher: fetcher.py")
-    print(f"  Grouper Script: grouper.py")
+    print(f"  Grouper: grouper.py (in-process)")
     print(f"  All Storage Path: {path_all_storing}")
     print(f"  Current Folder Pattern: {folder_current_storing}")
     print(f"  Grouped Folder Name: {folder_grouped}")
     print(f"  Stacker Script: {stacker}")
     print(f"  Photoshop: {photoshop_app}")
     print(f"  Hours to fetch: {hours_icloud}")
+    print(f"  Grouper EXIF readers: {grouper_workers} ({'process' if grouper_processes else 'thread'} pool)")
+    print(f"  Metadata cache: {metadata_cache}")
+    print(f"  Streaming grouper: {'on' if grouper_stream else 'off'}")
+    print(f"  Grouping engine: {grouper_engine}")
+    print(f"  Transfer: {transfer_workers} parallel copies, verify {'on' if transfer_verify else 'off'}")
+    print(f"  Grouping mode: {grouping_mode}")
+    print(f"  Stacking backend: {stacking_backend}")
+    if stacking_backend == "daemon":
+        print(f"  Stacking daemon folder: {daemon_folder or 'system temp folder'}")
+    if stacking_backend == "native":
+        print(f"  Native streaming: {'on' if native_streaming else 'off'}")
+        print(f"  Native tiled memory budget: {f'{native_memory_mb} MB' if native_memory_mb else 'off'}")
+        print(f"  Native stacking workers: {native_workers}")
+        print(f"  Native stacking memory budget: {f'{native_budget_mb} MB' if native_budget_mb else 'no limit'}")
+        print(f"  Native frame decoders: {native_decoders or 'in-line'}")
+        print(f"  Native prefetch: {f'{native_prefetch} frame(s)' if native_prefetch else 'off'}"
+              f"{f', up to {native_prefetch_mb} MB' if native_prefetch and native_prefetch_mb else ''}")
+        print(f"  Native frame cache: {f'{native_cache_mb} MB' if native_cache_mb else 'off'}")
+        print(f"  Native incremental stacking: {'on' if native_incremental else 'off'}")
     print()
     
     # Determine what action to take based on existing folders
@@ -215,10 +395,13 @@ def main():
     print("🔍 WORKFLOW ANALYSIS: Checking existing folders")
     print("=" * 55)
     
+    # Folder listings are shared by all steps of this run, so each folder is listed once
+    scans = DirectoryScans()
     action, current_folder_path = determine_workflow_action(
         path_all_storing, 
         folder_current_storing, 
-        folder_grouped
+        folder_grouped,
+        scans
     )
     
     if action == "error":
@@ -228,9 +411,6 @@ def main():
     print(f"Determined action: {action}")
     print(f"Working with folder: {current_folder_path}")
     
-    # Calculate path_grouped for Photoshop script
-    path_grouped = os.path.join(current_folder_path, folder_grouped)
-    
     if action == "run_fetcher":
         # Create the folder if needed
         if not create_folder_if_needed(current_folder_path):
@@ -245,13 +425,16 @@ def main():
         if not run_fetcher(current_folder_path, hours_icloud):
             print("Error: Photo fetcher failed. Cannot proceed to next steps.")
             exit(1)
+        scans.invalidate(current_folder_path)
         
         # Step 2: Run grouper.py to organize photos
         print("\n" + "=" * 55)
         print("📁 STEP 2: Running grouper.py to organize photos")
         print("=" * 55)
         
-        grouper_result = run_grouper(current_folder_path)
+        grouper_result = run_grouper(current_folder_path, grouper_workers, grouper_processes, metadata_cache,
+                                     grouper_stream, grouper_engine, scans, transfer_workers, transfer_verify,
+                                     grouping_mode)
         
         if grouper_result == "error":
             print("Error: Grouper.py failed with critical error. Cannot proceed.")
@@ -262,13 +445,13 @@ def main():
         elif grouper_result == "no_groups":
             print("\nNo focus stacking groups were created.")
             print("This means no photos were taken close enough in time to be considered for focus stacking.")
-            print("Skipping Step 3 (Photoshop processing) - workflow completed.")
+            print("Skipping Step 3 (focus stacking) - workflow completed.")
             print("\n" + "=" * 55)
             print("WORKFLOW COMPLETED: Photos fetched but no focus stacking needed")
             print("=" * 55)
             exit(0)
         elif grouper_result == "success":
-            print("Photo grouping completed successfully! Proceeding to Photoshop step.")
+            print("Photo grouping completed successfully! Proceeding to focus stacking step.")
         else:
             print(f"Unexpected result from grouper: {grouper_result}")
             exit(1)
@@ -279,7 +462,9 @@ def main():
         print("📁 STEP 2: Running grouper.py to organize existing photos")
         print("=" * 55)
         
-        grouper_result = run_grouper(current_folder_path)
+        grouper_result = run_grouper(current_folder_path, grouper_workers, grouper_processes, metadata_cache,
+                                     grouper_stream, grouper_engine, scans, transfer_workers, transfer_verify,
+                                     grouping_mode)
         
         if grouper_result == "error":
             print("Error: Grouper.py failed with critical error. Cannot proceed.")
@@ -290,23 +475,49 @@ def main():
         elif grouper_result == "no_groups":
             print("\nNo focus stacking groups were created.")
             print("This means no photos were taken close enough in time to be considered for focus stacking.")
-            print("Skipping Step 3 (Photoshop processing) - workflow completed.")
+            print("Skipping Step 3 (focus stacking) - workflow completed.")
             print("\n" + "=" * 55)
             print("WORKFLOW COMPLETED: Photos analyzed but no focus stacking needed")
             print("=" * 55)
             exit(0)
         elif grouper_result == "success":
-            print("Photo grouping completed successfully! Proceeding to Photoshop step.")
+            print("Photo grouping completed successfully! Proceeding to focus stacking step.")
         else:
             print(f"Unexpected result from grouper: {grouper_result}")
             exit(1)
     
-    # Step 3: Run Photoshop script for focus stacking (only if groups were created)
+    elif action == "run_stacker":
+        print("Folder is grouped but not all stacks are stacked: resuming Step 3")
+    
+    # Step 3: Run focus stacking (only if groups were created)
     print("\n" + "=" * 55)
-    print("🎨 STEP 3: Running Photoshop script for focus stacking")
+    print(f"🎨 STEP 3: Running {STACKING_BACKENDS[stacking_backend]} for focus stacking")
     print("=" * 55)
     
-    if not run_photoshop_script(stacker, path_grouped, photoshop_app):
+    path_grouped = prepare_stacking_input(current_folder_path, folder_grouped)
+    if path_grouped is None:
+        print("Error: Cannot prepare stacks for focus stacking.")
+        exit(1)
+    if stacking_backend == "native":
+        if not run_native_stacker(
+            path_grouped,
+            streaming=native_streaming,
+            memory_mb=native_memory_mb,
+            workers=native_workers,
+            budget_mb=native_budget_mb,
+            decoders=native_decoders,
+            prefetch=native_prefetch,
+            prefetch_mb=native_prefetch_mb,
+            cache_mb=native_cache_mb,
+            incremental=native_incremental,
+        ):
+            print("Error: Native stacker failed.")
+            exit(1)
+    elif stacking_backend == "daemon":
+        if not run_daemon_stacks(path_grouped, daemon_folder):
+            print("Error: Stacking daemon failed.")
+            exit(1)
+    elif not run_photoshop_stacks(stacker, path_grouped, photoshop_app):
         print("Error: Photoshop script failed.")
         exit(1)
     
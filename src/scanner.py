@@ -0,0 +1,100 @@
+"""
+Single-pass directory scanning shared by grouper and folder manager.
+
+Folders are listed with `os.scandir`, so file/folder type comes from the directory
+listing itself instead of a separate `isfile`/`isdir` stat per entry, and size and
+modification time of image files are taken from one `DirEntry.stat()` each.
+`DirectoryScans` remembers listings for the duration of one run, so every folder
+is listed exactly once unless it is explicitly invalidated after a change.
+"""
+import os
+from typing import Dict, List, NamedTuple, Optional
+
+#  Supported image file extensions (compared lowercase)
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.tiff', '.tif', '.bmp', '.png', '.heic'}
+
+
+class ScanEntry(NamedTuple):
+    """
+    One directory entry. Size and mtime are filled for image files only, other
+    entries have 0 there so that no extra stat is spent on them.
+    """
+
+    name: str
+    path: str
+    is_dir: bool
+    is_image: bool
+    size: int
+    mtime_ns: int
+
+
+def is_image_name(name: str) -> bool:
+    """Check if file name has one of supported image extensions."""
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def scan_directory(folder_path: str) -> List[ScanEntry]:
+    """
+    List folder in a single `os.scandir` pass.
+    Args:
+        folder_path: folder to list
+    Returns:
+        entries sorted by name
+    Raises:
+        OSError: folder doesn't exist or can't be listed
+    """
+    entries = []
+    with os.scandir(folder_path) as it:
+        for entry in it:
+            is_dir = entry.is_dir()
+            is_image = not is_dir and entry.is_file() and is_image_name(entry.name)
+            size, mtime_ns = 0, 0
+            if is_image:
+                st = entry.stat()
+                size, mtime_ns = st.st_size, st.st_mtime_ns
+            entries.append(
+                ScanEntry(entry.name, entry.path, is_dir, is_image, size, mtime_ns)
+            )
+    entries.sort(key=lambda e: e.name)
+    return entries
+
+
+def image_entries(entries: List[ScanEntry]) -> List[ScanEntry]:
+    """Image files among listed entries, in name order."""
+    return [entry for entry in entries if entry.is_image]
+
+
+class DirectoryScans:
+    """Listings of folders made during one run, each folder listed at most once."""
+
+    def __init__(self) -> None:
+        self._listings: Dict[str, List[ScanEntry]] = {}
+
+    def scan(self, folder_path: str) -> List[ScanEntry]:
+        """
+        Listing of folder, made on first request and reused afterwards.
+        Raises:
+            OSError: folder doesn't exist or can't be listed
+        """
+        key = os.path.abspath(folder_path)
+        if key not in self._listings:
+            self._listings[key] = scan_directory(key)
+        return self._listings[key]
+
+    def invalidate(self, folder_path: Optional[str] = None) -> None:
+        """Forget listing of a folder whose contents changed, or all listings."""
+        if folder_path is None:
+            self._listings.clear()
+        else:
+            self._listings.pop(os.path.abspath(folder_path), None)
+
+
+def list_directory(folder_path: str, scans: Optional[DirectoryScans] = None) -> List[ScanEntry]:
+    """
+    List folder, through run-wide `scans` if given.
+    Raises:
+        OSError: folder doesn't exist or can't be listed
+    """
+    if scans is None:
+        return scan_directory(folder_path)
+    return scans.scan(folder_path)
@@ -0,0 +1,454 @@
+"""
+Concurrent stacking of many stacks in a process pool.
+
+stacker.js `loopFolders` stacks the subfolders of 'fs' strictly one after another.
+The scheduler discovers the same stacks (subfolders of the grouped folder, or lines
+of a manifest job list), hands them to a pool of worker processes running the native
+stacker, and collects the outcome and time of every stack into a run report saved
+next to the results. Results are written atomically (`image_loader.save_jpeg`), so
+an interrupted run never leaves a truncated '_fs.jpg' behind.
+
+Stacks are ordered by estimated cost, largest first (cost_model.py: frame count
+times frame pixels from headers, calibrated from the run history), so a huge stack
+found last doesn't start when the others are done and run alone. A new stack is
+started only while the estimated memory of stacks in flight stays within the
+memory budget; smaller stacks further down the order fill the room a big one
+doesn't fit in, and a stack over the whole budget runs alone. Time of every stack,
+and with --trace-memory its peak memory traced by tracemalloc (slower, opt-in), are
+appended to the run history for later estimates.
+
+Stacks already stacked from the same frames with the same settings, by the results
+ledger (ledger.py), are skipped; stacks are recorded there as they finish, so a run
+that crashes goes on from where it stopped.
+
+A stack that fails is reported and the others go on. A worker process that dies
+(killed for memory, crashed decoder) breaks the whole pool, without telling which
+stack killed it: stacks the pool still held are rerun each in a pool of its own
+(as many at a time as there are workers), where a dead worker fails its stack only.
+
+With one worker, stacks are stacked in this process and frames are prefetched
+(prefetcher.py) in the order of the run, into the next stack; with more, every
+worker prefetches frames of its own stack only.
+
+Usage:
+    python scheduler.py <fs folder | job list> [--workers N] [--method max|weighted|pyramid]
+                        [--preset fast|quality] [--model translation|similarity|affine]
+                        [--streaming] [--decoders N] [--memory-mb N] [--budget-mb N]
+                        [--prefetch N] [--prefetch-mb N] [--cache-mb N] [--cache-dir DIR]
+                        [--incremental] [--history FILE] [--force] [--trace-memory]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import aligner
+import blender
+import cost_model
+import ledger
+import native_stacker
+from manifest import find_jobs
+from prefetcher import Prefetcher, StageTimings
+
+#  Worker processes by default: one per CPU
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+#  Run report, saved into the grouped folder (next to the job list in manifest mode)
+REPORT_NAME = 'fs_report.json'
+
+
+class StackOutcome(NamedTuple):
+    """
+    Outcome of one stack.
+    Attributes:
+        name: stack name, last file of the stack as in the result name
+        files: number of frames
+        output: saved result, empty if the stack failed
+        error: reason of failure, empty if the stack succeeded
+        seconds: time spent on the stack, in its worker
+        memory: peak memory traced while stacking, bytes (0 if not measured)
+        stages: prefetch stage timings of the stack, None without prefetching
+    """
+
+    name: str
+    files: int
+    output: str
+    error: str
+    seconds: float
+    memory: int = 0
+    stages: Optional[StageTimings] = None
+
+    @property
+    def ok(self) -> bool:
+        return not self.error
+
+
+class RunReport(NamedTuple):
+    """Outcomes and estimates of all stacks of a run, in order of stacks."""
+
+    outcomes: List[StackOutcome]
+    workers: int
+    seconds: float
+    estimates: Tuple[cost_model.JobEstimate, ...] = ()
+
+    @property
+    def failed(self) -> List[StackOutcome]:
+        return [outcome for outcome in self.outcomes if not outcome.ok]
+
+
+def run_job(
+    job: Tuple[str, List[str]],
+    options: native_stacker.StackOptions,
+    prefetcher: Optional[Prefetcher] = None,
+    trace_memory: bool = False,
+) -> StackOutcome:
+    """
+    Stack one job in a worker, every error turned into a failed outcome.
+    With `trace_memory` the peak of Python and NumPy allocations is traced while
+    stacking, which slows stacking down; allocations of prefetch threads decoding
+    the next stack meanwhile are counted too.
+    """
+    out_folder, files = job
+    #  Not measured when something else traces already
+    measure = trace_memory and not tracemalloc.is_tracing()
+    if measure:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = native_stacker.stack_job(out_folder, files, options, prefetcher)
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+        return StackOutcome(ledger.stack_id(files), len(files), '', error, time.perf_counter() - start)
+    finally:
+        memory = tracemalloc.get_traced_memory()[1] if measure else 0
+        if measure:
+            tracemalloc.stop()
+    return StackOutcome(ledger.stack_id(files), len(files), result.path, '', result.seconds, memory, result.stages)
+
+
+def largest_first(estimates: List[cost_model.JobEstimate]) -> List[int]:
+    """Job indices by estimated cost, largest first (ties in job order)."""
+    return sorted(range(len(estimates)), key=lambda index: -estimates[index].seconds)
+
+
+def admit(
+    queue: List[int],
+    estimates: List[cost_model.JobEstimate],
+    in_flight: int,
+    running: int,
+    memory_budget: int,
+) -> Optional[int]:
+    """
+    Next job to start: the first queued one whose estimated memory fits the budget
+    next to `in_flight` bytes of `running` jobs. With nothing running, the first
+    queued job starts whatever its estimate, so a stack over the budget runs alone.
+    Returns:
+        job index, or None if no queued job fits now
+    """
+    if not queue:
+        return None
+    if not running or not memory_budget:
+        return queue[0]
+    for index in queue:
+        if in_flight + estimates[index].memory <= memory_budget:
+            return index
+    return None
+
+
+def dispatch(
+    jobs: List[Tuple[str, List[str]]],
+    queue: List[int],
+    options: native_stacker.StackOptions,
+    workers: int,
+    estimates: List[cost_model.JobEstimate],
+    memory_budget: int,
+    isolated: bool,
+    trace_memory: bool = False,
+) -> Iterator[Tuple[int, Optional[StackOutcome]]]:
+    """
+    Run queued jobs in order of `queue` under admission control, up to `workers` at a time.
+    In one shared pool, or with `isolated` each in a single-process pool of its own,
+    where a dying worker fails its own stack only. With `trace_memory` every stack
+    traces its peak memory, see `run_job`.
+    Returns:
+        iterator over (index, outcome) as stacks finish; outcome is None for jobs
+        the shared pool broke under or never started once broken
+    """
+    queue = list(queue)
+    shared = None if isolated else ProcessPoolExecutor(max_workers=workers)
+    running: Dict[Future, Tuple[int, ProcessPoolExecutor]] = {}
+    in_flight = 0
+    broken = False
+    try:
+        while running or (queue and not broken):
+            while not broken and len(running) < workers:
+                index = admit(queue, estimates, in_flight, len(running), memory_budget)
+                if index is None:
+                    break
+                pool = shared or ProcessPoolExecutor(max_workers=1)
+                try:
+                    future = pool.submit(run_job, jobs[index], options, None, trace_memory)
+                except BrokenProcessPool:
+                    broken = True
+                    break
+                queue.remove(index)
+                running[future] = (index, pool)
+                in_flight += estimates[index].memory
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, pool = running.pop(future)
+                in_flight -= estimates[index].memory
+                if isolated:
+                    pool.shutdown()
+                outcome: Optional[StackOutcome] = None
+                try:
+                    outcome = future.result()
+                except BrokenProcessPool:
+                    if isolated:
+                        files = jobs[index][1]
+                        outcome = StackOutcome(ledger.stack_id(files), len(files), '', 'worker process died', 0.0)
+                    else:
+                        broken = True
+                yield index, outcome
+    finally:
+        if shared is not None:
+            shared.shutdown()
+    for index in queue:
+        yield index, None
+
+
+def print_outcome(outcome: StackOutcome) -> None:
+    if outcome.ok:
+        print(
+            f'Stacked {outcome.files} frames -> {os.path.basename(outcome.output)} '
+            f'in {outcome.seconds:.2f}s'
+        )
+        if outcome.stages:
+            print(f'  Stages: {outcome.stages.describe()}')
+    else:
+        print(f'❌ Stack {outcome.name} failed: {outcome.error}')
+
+
+def run_jobs(
+    jobs: List[Tuple[str, List[str]]],
+    options: native_stacker.StackOptions = native_stacker.StackOptions(),
+    workers: int = DEFAULT_WORKERS,
+    on_outcome: Optional[Callable[[StackOutcome], None]] = print_outcome,
+    memory_budget: int = 0,
+    costs: Optional[cost_model.CostModel] = None,
+    trace_memory: bool = False,
+) -> RunReport:
+    """
+    Stack jobs concurrently, largest first, one stack per worker process at a time.
+    Args:
+        jobs: (output folder, files) of stacks, see `manifest.find_jobs`
+        options: how stacks are stacked
+        workers: worker processes, 1 stacks in this process one after another (and
+            prefetches frames of the next stack, with options.prefetch)
+        on_outcome: called with every outcome as the stack finishes
+        memory_budget: bytes of estimated memory of stacks in flight, 0 for no limit
+        costs: estimator of stacks, default coefficients if None
+        trace_memory: trace peak memory of every stack, slower (see `run_job`)
+    Returns:
+        report with outcomes and estimates in order of `jobs`
+    """
+    start = time.perf_counter()
+    costs = costs or cost_model.CostModel()
+    estimates = [costs.estimate(files, options) for _, files in jobs]
+    order = largest_first(estimates)
+    outcomes: List[Optional[StackOutcome]] = [None] * len(jobs)
+    if workers <= 1:
+        prefetcher = native_stacker.run_prefetcher([jobs[index] for index in order], options)
+        try:
+            for index in order:
+                outcomes[index] = run_job(jobs[index], options, prefetcher, trace_memory)
+                if on_outcome:
+                    on_outcome(outcomes[index])
+        finally:
+            if prefetcher:
+                prefetcher.close()
+        return RunReport(outcomes, 1, time.perf_counter() - start, tuple(estimates))
+    for isolated in (False, True):
+        for index, outcome in dispatch(
+            jobs, order, options, workers, estimates, memory_budget, isolated, trace_memory
+        ):
+            outcomes[index] = outcome
+            if outcome and on_outcome:
+                on_outcome(outcome)
+        #  Stacks the shared pool broke under are rerun isolated
+        order = [index for index in order if outcomes[index] is None]
+    return RunReport(outcomes, workers, time.perf_counter() - start, tuple(estimates))
+
+
+def history_records(report: RunReport, options: native_stacker.StackOptions) -> List[cost_model.HistoryRecord]:
+    """Run history records of succeeded stacks of the run."""
+    name = cost_model.profile(options)
+    return [
+        cost_model.HistoryRecord(name, outcome.files, estimate.pixels, round(outcome.seconds, 3), outcome.memory)
+        for outcome, estimate in zip(report.outcomes, report.estimates)
+        if outcome.ok and estimate.pixels
+    ]
+
+
+def report_path(path: str) -> str:
+    """Run report of grouped folder or job list."""
+    folder = os.path.dirname(os.path.abspath(path)) if os.path.isfile(path) else path
+    return os.path.join(folder, REPORT_NAME)
+
+
+def write_report(path: str, report: RunReport) -> None:
+    """Write run report as JSON, atomically."""
+    data = {
+        'workers': report.workers,
+        'seconds': round(report.seconds, 3),
+        'succeeded': len(report.outcomes) - len(report.failed),
+        'failed': len(report.failed),
+        'stacks': [
+            dict(
+                outcome._asdict(),
+                seconds=round(outcome.seconds, 3),
+                estimated_seconds=round(estimate.seconds, 3),
+                estimated_memory=estimate.memory,
+                stages=outcome.stages and dict(outcome.stages._asdict(), overlapped=outcome.stages.overlapped),
+            )
+            for outcome, estimate in zip(report.outcomes, report.estimates)
+        ],
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def ledger_settings(options: native_stacker.StackOptions) -> Dict[str, str]:
+    """Stacking options recorded in the results ledger: those the result depends on."""
+    return {'profile': cost_model.profile(options), 'model': options.model, 'preset': options.preset}
+
+
+def schedule(
+    path: str,
+    options: native_stacker.StackOptions = native_stacker.StackOptions(),
+    workers: int = DEFAULT_WORKERS,
+    memory_budget: int = 0,
+    history: Optional[str] = None,
+    skip_done: bool = True,
+    trace_memory: bool = False,
+) -> RunReport:
+    """
+    Stack every stack of grouped folder or job list concurrently, printing progress,
+    and save the run report.
+    Args:
+        path: grouped 'fs' folder or job list of manifest mode
+        options: how stacks are stacked
+        workers: worker processes
+        memory_budget: bytes of estimated memory of stacks in flight, 0 for no limit
+        history: run history file calibrating estimates and extended by the run,
+            None to use default coefficients and record nothing
+        skip_done: skip stacks the results ledger has as stacked, False to stack all
+        trace_memory: trace peak memory of every stack for the run history, slower;
+            without it only times are recorded and memory estimates keep defaults
+    Returns:
+        run report of stacks stacked in this run
+    Raises:
+        OSError: stacks can't be listed or report can't be written
+    """
+    jobs = find_jobs(path)
+    results = ledger.Ledger(ledger.ledger_path(path))
+    settings = ledger_settings(options)
+    pending = results.pending(jobs, ledger.BACKEND_NATIVE, settings) if skip_done else jobs
+    if len(pending) < len(jobs):
+        print(f'Skipping {len(jobs) - len(pending)} stack(s) already stacked with these settings')
+    by_name = {ledger.stack_id(files): (out_folder, files) for out_folder, files in pending}
+
+    def finished(outcome: StackOutcome) -> None:
+        print_outcome(outcome)
+        if outcome.ok:
+            #  Saved at once, so stacks done before a crash are not stacked again
+            results.record(by_name[outcome.name], ledger.BACKEND_NATIVE, settings)
+            results.save()
+
+    costs = cost_model.CostModel(cost_model.read_history(history) if history else ())
+    report = run_jobs(pending, options, workers, finished, memory_budget, costs, trace_memory)
+    write_report(report_path(path), report)
+    if history:
+        cost_model.append_history(history, history_records(report, options))
+    print(
+        f'Stacked {len(pending) - len(report.failed)} of {len(pending)} stack(s) '
+        f'with {report.workers} worker(s) in {report.seconds:.1f}s'
+    )
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Stack many stacks concurrently')
+    parser.add_argument('path', help='grouped "fs" folder or job list of manifest mode')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='worker processes')
+    parser.add_argument(
+        '--method', choices=native_stacker.METHODS, default=native_stacker.METHOD_MAX, help='blending method'
+    )
+    parser.add_argument(
+        '--preset', choices=tuple(blender.PRESETS), default=blender.PRESET_QUALITY, help='pyramid blending preset'
+    )
+    parser.add_argument(
+        '--model', choices=aligner.MODELS, default=aligner.MODEL_SIMILARITY, help='alignment model'
+    )
+    parser.add_argument('--streaming', action='store_true', help='decode and blend one frame at a time')
+    parser.add_argument(
+        '--decoders', type=int, default=0, help='decoder processes of every stack, frames passed in shared memory'
+    )
+    parser.add_argument('--memory-mb', type=int, default=0, help='stack out of core in tiles with this budget')
+    parser.add_argument('--prefetch', type=int, default=0, help='frames decoded ahead on background threads')
+    parser.add_argument('--prefetch-mb', type=int, default=0, help='memory budget of frames decoded ahead')
+    parser.add_argument(
+        '--cache-mb', type=int, default=0, help='disk cache of decoded frames shared by workers, with this budget'
+    )
+    parser.add_argument('--cache-dir', default=None, help='directory of the decoded frame cache')
+    parser.add_argument(
+        '--incremental', action='store_true', help='merge only frames added to stacks stacked before'
+    )
+    parser.add_argument(
+        '--budget-mb', type=int, default=0, help='estimated memory of stacks in flight (default: no limit)'
+    )
+    parser.add_argument('--force', action='store_true', help='stack again stacks the results ledger has as stacked')
+    parser.add_argument(
+        '--trace-memory', action='store_true', help='trace peak memory of stacks for the run history (slower)'
+    )
+    parser.add_argument(
+        '--history', default=None, help=f'run history (default: {cost_model.HISTORY_FILE_NAME} in the storage folder)'
+    )
+    args = parser.parse_args()
+    options = native_stacker.StackOptions(
+        args.method,
+        args.model,
+        args.preset,
+        args.streaming,
+        args.memory_mb,
+        decoders=args.decoders,
+        prefetch=args.prefetch,
+        prefetch_mb=args.prefetch_mb,
+        cache_mb=args.cache_mb,
+        cache_dir=args.cache_dir,
+        incremental=args.incremental,
+    )
+    history = args.history or cost_model.history_path(args.path)
+    try:
+        report = schedule(
+            args.path, options, args.workers, args.budget_mb << 20, history, not args.force, args.trace_memory
+        )
+    except OSError as e:
+        print(f'❌ Stacking failed: {e}')
+        return 1
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,9 @@
 app.bringToFront();
 
-// Check if folder path is provided as argument
+// Check if folder path (or job list file of manifest mode) is provided as argument
 if (arguments.length > 0) {
     var folderPath = arguments[0];
-    var result = loopFolders(folderPath);
+    var result = (Folder(folderPath) instanceof Folder) ? loopFolders(folderPath) : loopJobs(folderPath);
     "Focus stacking completed: " + result; // Return formatted result
 } else {
     var result = loopFolders();
@@ -44,29 +44,38 @@ return "Success: Processed " + processedFolders + " folder(s) for focus stacking
         
 };
 	
-function main(selectedFolder, outFolder){
-
-//var selectedFolder = Folder.selectDialog("Please select the folder to process");    
+// Job list: one stack per line, output folder and stack files separated by tabs
+function loopJobs(jobListPath){
 
-if(selectedFolder == null ) return;
-
-//var outFolder = Folder(selectedFolder);
+var jobList = new File(jobListPath);
+var processedStacks = 0;
 
-// if(!outFolder.exists) outFolder.create();
-
-var threeFiles = new Array();
-
-var PictureFiles = selectedFolder.getFiles(/\.(jpg|jpe|jpeg|dng|bmp|tif|tiff|psd|crw|cr2|exr|pcx|nef|dcr|dc2|erf|raf|orf|tga|mos|pef|png)$/i);
+if (!jobList.open("r")) {
+    return "Error: Cannot open job list: " + jobListPath;
+}
+jobList.encoding = "UTF-8";
+
+while (!jobList.eof) {
+    var line = jobList.readln();
+    if (line == "") continue;
+    var fields = line.split("\t");
+    var outFolder = new Folder(fields.shift());
+    if (!outFolder.exists) outFolder.create();
+    var jobFiles = new Array();
+    for (var i = 0; i < fields.length; i++) {jobFiles.push(new File(fields[i]));}
+    stackAndSave(jobFiles, outFolder);
+    processedStacks++;
+}
 
-var filescount = PictureFiles.length
+jobList.close();
 
-var filescountminusone = filescount - 1
+return "Success: Processed " + processedStacks + " stack(s) for focus stacking";
 
-while(PictureFiles.length>filescountminusone){
+};
 
-for(var a = 0;a<filescount;a++){threeFiles.push(PictureFiles.shift());}
+function stackAndSave(files, outFolder){
 
-stackFiles(threeFiles);
+stackFiles(files);
 
 selectAllLayers();
 
@@ -85,6 +94,32 @@ SaveJPG(saveFile);
 
 app.activeDocument.close(SaveOptions.DONOTSAVECHANGES);
 
+};
+
+function main(selectedFolder, outFolder){
+
+//var selectedFolder = Folder.selectDialog("Please select the folder to process");    
+
+if(selectedFolder == null ) return;
+
+//var outFolder = Folder(selectedFolder);
+
+// if(!outFolder.exists) outFolder.create();
+
+var threeFiles = new Array();
+
+var PictureFiles = selectedFolder.getFiles(/\.(jpg|jpe|jpeg|dng|bmp|tif|tiff|psd|crw|cr2|exr|pcx|nef|dcr|dc2|erf|raf|orf|tga|mos|pef|png)$/i);
+
+var filescount = PictureFiles.length
+
+var filescountminusone = filescount - 1
+
+while(PictureFiles.length>filescountminusone){
+
+for(var a = 0;a<filescount;a++){threeFiles.push(PictureFiles.shift());}
+
+stackAndSave(threeFiles, outFolder);
+
 threeFiles=[];
 
     }
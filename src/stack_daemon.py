@@ -0,0 +1,697 @@
+"""
+Stacking daemon: a long-lived stacking backend fed from a job queue on disk.
+
+`runner.run_photoshop_script` starts Photoshop for one run and quits it after, and
+the native backend imports NumPy and warms its caches again on every run. The
+daemon keeps one backend warm between runs:
+    native      native_stacker.stack_job in the daemon process (modules imported;
+                with --cache-mb one frame cache, and the digests it computed, kept)
+    photoshop   stacker.js run on one stack at a time through `osascript`, without
+                quitting Photoshop (macOS only)
+    fake        stand-in writing a placeholder result, to exercise the queue and
+                the protocol anywhere
+Stacks submitted are rows of a SQLite queue next to the socket (queued, running,
+done, failed); one worker thread takes them in order of submission. The queue
+outlives the daemon: stacks left running by a daemon that died are queued again
+when it starts, and a stack submitted again while queued or running is not added
+twice.
+
+Clients talk to a Unix socket, one JSON object per line each way:
+    {"op": "info"}                     backend name and the settings it stacks with
+    {"op": "submit", "jobs": [...]}    queue (output folder, files) stacks -> job ids
+    {"op": "status", "ids": [...]}     job records
+    {"op": "wait", "ids": [...]}       a line per job as it finishes, then
+                                       {"ok": true, "done": true}
+    {"op": "stop"}                     stop once the running stack is finished
+Replies carry "ok"; failed requests carry "error" instead.
+
+Usage:
+    python stack_daemon.py serve [--folder DIR] [--backend native|photoshop|fake]
+                                 [--method max|weighted|pyramid] [--preset fast|quality]
+                                 [--model translation|similarity|affine] [--streaming]
+                                 [--memory-mb N] [--decoders N] [--prefetch N] [--prefetch-mb N]
+                                 [--cache-mb N] [--cache-dir DIR] [--incremental]
+                                 [--stacker FILE] [--photoshop-app NAME]
+    python stack_daemon.py submit <fs folder | job list> [--folder DIR] [--no-wait]
+    python stack_daemon.py stop [--folder DIR]
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import ledger
+from manifest import find_jobs, write_jobs
+from user_dirs import make_private_dir, user_temp_dir
+
+#  Default folder of the socket and the queue, per user in the system temporary folder
+DAEMON_FOLDER_NAME = 'pyfocusstack-stackd'
+SOCKET_NAME = 'stackd.sock'
+QUEUE_NAME = 'stack_queue.sqlite'
+
+#  Finished jobs kept in the queue, seconds
+KEEP_FINISHED = 7 * 24 * 3600
+
+#  Seconds between checks of jobs waited for, besides wake-ups on finished jobs
+WAIT_POLL = 1.0
+
+#  Job states
+STATE_QUEUED = 'queued'
+STATE_RUNNING = 'running'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+FINISHED_STATES = (STATE_DONE, STATE_FAILED)
+
+#  Error of submitted stacks the daemon stopped before finishing
+STOPPED_ERROR = 'stacking daemon stopped before the stack was stacked'
+
+#  Backend of tests: writes placeholder results
+BACKEND_FAKE = 'fake'
+BACKENDS = (ledger.BACKEND_NATIVE, ledger.BACKEND_PHOTOSHOP, BACKEND_FAKE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    out_folder TEXT NOT NULL,
+    files TEXT NOT NULL,
+    state TEXT NOT NULL,
+    output TEXT NOT NULL DEFAULT '',
+    error TEXT NOT NULL DEFAULT '',
+    seconds REAL NOT NULL DEFAULT 0,
+    submitted REAL NOT NULL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+
+class JobRecord(NamedTuple):
+    """
+    One stack of the queue.
+    Attributes:
+        id: job id, in order of submission
+        out_folder: folder of the result
+        files: frame files in shooting order
+        state: one of STATE_*
+        output: saved result, empty unless done
+        error: reason of failure, empty unless failed
+        seconds: time the backend spent on the stack
+    """
+
+    id: int
+    out_folder: str
+    files: List[str]
+    state: str
+    output: str = ''
+    error: str = ''
+    seconds: float = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+
+def default_daemon_dir() -> str:
+    return user_temp_dir(DAEMON_FOLDER_NAME)
+
+
+def _record(row: tuple) -> JobRecord:
+    job_id, out_folder, files, state, output, error, seconds = row
+    return JobRecord(job_id, out_folder, json.loads(files), state, output, error, seconds)
+
+
+class JobQueue:
+    """SQLite queue of stacks, shared by the threads of the daemon."""
+
+    _COLUMNS = 'id, out_folder, files, state, output, error, seconds'
+
+    def __init__(self, db_path: str) -> None:
+        """
+        Open queue, created if missing. Jobs left running are queued again and jobs
+        finished more than KEEP_FINISHED ago are removed.
+        Args:
+            db_path: path to SQLite file
+        """
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        with self._lock:
+            self._conn.execute('UPDATE jobs SET state = ? WHERE state = ?', (STATE_QUEUED, STATE_RUNNING))
+            self._conn.execute(
+                'DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?', (time.time() - KEEP_FINISHED,)
+            )
+
+    def __enter__(self) -> 'JobQueue':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def submit(self, jobs: List[Tuple[str, List[str]]]) -> List[int]:
+        """
+        Queue stacks; a stack queued or running already keeps its job.
+        Returns:
+            job id of every stack, in order of `jobs`
+        """
+        ids = []
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for out_folder, files in jobs:
+                    encoded = json.dumps(list(files), ensure_ascii=False)
+                    row = self._conn.execute(
+                        'SELECT id FROM jobs WHERE out_folder = ? AND files = ? AND state IN (?, ?)',
+                        (out_folder, encoded, STATE_QUEUED, STATE_RUNNING),
+                    ).fetchone()
+                    if row is None:
+                        cursor = self._conn.execute(
+                            'INSERT INTO jobs (out_folder, files, state, submitted) VALUES (?, ?, ?, ?)',
+                            (out_folder, encoded, STATE_QUEUED, time.time()),
+                        )
+                        row = (cursor.lastrowid,)
+                    ids.append(row[0])
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return ids
+
+    def claim(self) -> Optional[JobRecord]:
+        """Oldest queued job, marked running; None if nothing is queued."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    f'SELECT {self._COLUMNS} FROM jobs WHERE state = ? ORDER BY id LIMIT 1', (STATE_QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute('UPDATE jobs SET state = ? WHERE id = ?', (STATE_RUNNING, row[0]))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return None if row is None else _record(row)._replace(state=STATE_RUNNING)
+
+    def finish(self, job_id: int, output: str = '', error: str = '', seconds: float = 0.0) -> None:
+        """Record job as done into `output`, or as failed with `error`."""
+        state = STATE_FAILED if error else STATE_DONE
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, output = ?, error = ?, seconds = ?, finished = ? WHERE id = ?',
+                (state, output, error, seconds, time.time(), job_id),
+            )
+
+    def records(self, ids: List[int]) -> List[JobRecord]:
+        """Records of jobs, in order of `ids`; unknown ids are left out."""
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT {self._COLUMNS} FROM jobs WHERE id IN ({",".join("?" * len(ids))})', list(ids)
+            ).fetchall()
+        by_id = {row[0]: _record(row) for row in rows}
+        return [by_id[job_id] for job_id in ids if job_id in by_id]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class FakeBackend:
+    """Backend writing the names of the frames as the result, for tests of the queue."""
+
+    name = BACKEND_FAKE
+
+    def __init__(self, delay: float = 0.0, fail: Callable[[List[str]], bool] = lambda files: False) -> None:
+        """
+        Args:
+            delay: seconds every stack takes
+            fail: whether a stack fails, by its files
+        """
+        self.delay = delay
+        self.fail = fail
+        self.stacked: List[List[str]] = []
+
+    def settings(self) -> Dict[str, str]:
+        return {'backend': BACKEND_FAKE}
+
+    def stack(self, out_folder: str, files: List[str]) -> str:
+        time.sleep(self.delay)
+        if self.fail(files):
+            raise OSError(f'Fake failure of {ledger.stack_id(files)}')
+        os.makedirs(out_folder, exist_ok=True)
+        path = ledger.result_path(out_folder, files)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(files) + '\n')
+        self.stacked.append(list(files))
+        return path
+
+
+class NativeBackend:
+    """Native stacker in the daemon process."""
+
+    name = ledger.BACKEND_NATIVE
+
+    def __init__(self, options=None) -> None:
+        """
+        Args:
+            options: native_stacker.StackOptions of every stack, the defaults if None
+        """
+        #  Imported here: NumPy and Pillow are needed only by this backend
+        import native_stacker
+        import scheduler
+
+        self._stack_job = native_stacker.stack_job
+        self._ledger_settings = scheduler.ledger_settings
+        self.options = options or native_stacker.StackOptions()
+        #  Frame cache of every stack, digests of frames seen stay in memory
+        self._loader = native_stacker.frame_loader(self.options)
+
+    def settings(self) -> Dict[str, str]:
+        return self._ledger_settings(self.options)
+
+    def stack(self, out_folder: str, files: List[str]) -> str:
+        return self._stack_job(out_folder, files, self.options, loader=self._loader).path
+
+
+class PhotoshopBackend:
+    """stacker.js in Photoshop, one stack per script call; Photoshop is left running."""
+
+    name = ledger.BACKEND_PHOTOSHOP
+
+    def __init__(self, stacker: str, photoshop_app: str, folder: str) -> None:
+        """
+        Args:
+            stacker: path of stacker.js
+            photoshop_app: application name, as in settings
+            folder: folder of the job lists passed to the script
+        """
+        self.stacker = stacker
+        self.photoshop_app = photoshop_app
+        self.job_list = os.path.join(folder, 'stackd_job.txt')
+
+    def settings(self) -> Dict[str, str]:
+        return ledger.script_settings(self.stacker)
+
+    def stack(self, out_folder: str, files: List[str]) -> str:
+        write_jobs(self.job_list, [(out_folder, files)])
+        command = (
+            f'tell application "{self.photoshop_app}" to do javascript of file "{self.stacker}" '
+            f'with arguments {{"{self.job_list}"}}'
+        )
+        try:
+            subprocess.run(['osascript', '-e', command], check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            raise OSError(f'Photoshop script failed: {e.stderr.strip() or e}') from e
+        path = ledger.result_path(out_folder, files)
+        if not os.path.isfile(path):
+            raise OSError(f'Photoshop saved no result {os.path.basename(path)}')
+        return path
+
+
+class StackDaemon:
+    """Socket server and worker thread over a job queue and a warm backend."""
+
+    def __init__(self, backend, folder: Optional[str] = None) -> None:
+        """
+        Args:
+            backend: object with `name`, `settings()` and `stack(out_folder, files)`
+                returning the result path
+            folder: folder of socket and queue, created if missing;
+                `default_daemon_dir()` if None
+        Raises:
+            OSError: folder isn't private to the user, or a daemon runs on it
+        """
+        self.backend = backend
+        self.folder = make_private_dir(folder or default_daemon_dir())
+        self.socket_path = os.path.join(self.folder, SOCKET_NAME)
+        self.queue = JobQueue(os.path.join(self.folder, QUEUE_NAME))
+        self._changed = threading.Condition()
+        self._stopping = threading.Event()
+        self._idle = threading.Event()
+        self._threads: List[threading.Thread] = []
+        if os.path.exists(self.socket_path):
+            #  Left by a daemon that died; a live one still answers
+            if ping(self.folder):
+                raise OSError(f'Stacking daemon already running on {self.socket_path}')
+            os.remove(self.socket_path)
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, self._handler())
+        self._server.daemon_threads = True
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                for line in self.rfile:
+                    try:
+                        daemon.handle(json.loads(line), self._reply)
+                    except (ValueError, KeyError, TypeError, sqlite3.Error) as e:
+                        self._reply({'ok': False, 'error': f'{type(e).__name__}: {e}'})
+                    except OSError:
+                        #  Client went away
+                        return
+
+            def _reply(self, message: Dict) -> None:
+                self.wfile.write((json.dumps(message, ensure_ascii=False) + '\n').encode())
+                self.wfile.flush()
+
+        return Handler
+
+    def handle(self, request: Dict, reply: Callable[[Dict], None]) -> None:
+        """Answer one request through `reply`, see the module docstring."""
+        op = request['op']
+        if op == 'info':
+            reply({'ok': True, 'backend': self.backend.name, 'settings': self.backend.settings()})
+        elif op == 'submit':
+            ids = self.queue.submit([(out_folder, list(files)) for out_folder, files in request['jobs']])
+            self._notify()
+            reply({'ok': True, 'ids': ids})
+        elif op == 'status':
+            reply({'ok': True, 'jobs': [record._asdict() for record in self.queue.records(request['ids'])]})
+        elif op == 'wait':
+            for record in self.wait(request['ids']):
+                reply({'ok': True, 'job': record._asdict()})
+            reply({'ok': True, 'done': True})
+        elif op == 'stop':
+            reply({'ok': True})
+            self.stop()
+        else:
+            raise ValueError(f'Unknown request {op!r}')
+
+    def wait(self, ids: List[int]) -> Iterator[JobRecord]:
+        """
+        Records of jobs as they finish, until all of them are, or the daemon stopped
+        and its worker finished the running stack.
+        """
+        pending = set(ids)
+        while pending:
+            stopped = self._idle.is_set()
+            records = self.queue.records(sorted(pending))
+            #  Ids the queue doesn't have never finish
+            pending = {record.id for record in records}
+            for record in records:
+                if record.finished:
+                    pending.discard(record.id)
+                    yield record
+            if pending and stopped:
+                return
+            if pending:
+                with self._changed:
+                    self._changed.wait(WAIT_POLL)
+
+    def _notify(self) -> None:
+        with self._changed:
+            self._changed.notify_all()
+
+    def work(self) -> None:
+        """Stack queued jobs one at a time until stopped."""
+        try:
+            while not self._stopping.is_set():
+                record = self.queue.claim()
+                if record is None:
+                    with self._changed:
+                        self._changed.wait(WAIT_POLL)
+                    continue
+                start = time.perf_counter()
+                try:
+                    output = self.backend.stack(record.out_folder, record.files)
+                    self.queue.finish(record.id, output, seconds=time.perf_counter() - start)
+                except Exception as e:
+                    #  A failed stack must not stop the daemon
+                    error = f'{type(e).__name__}: {e}'
+                    self.queue.finish(record.id, error=error, seconds=time.perf_counter() - start)
+                self._notify()
+        finally:
+            #  Waiting clients get the last stack, then the end of their wait
+            self._idle.set()
+            self._notify()
+
+    def start(self) -> None:
+        """Serve and work on background threads."""
+        for target in (self._server.serve_forever, self.work):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def serve_forever(self) -> None:
+        """Serve and work until stopped."""
+        self.start()
+        try:
+            while not self._stopping.wait(WAIT_POLL):
+                pass
+        finally:
+            self.close()
+
+    def stop(self) -> None:
+        """Stop serving and working; the running stack is finished first."""
+        self._stopping.set()
+        self._notify()
+
+    def close(self) -> None:
+        """Stop, wait for the worker and release socket and queue."""
+        self.stop()
+        if self._threads:
+            self._server.shutdown()
+        for thread in self._threads:
+            thread.join()
+        self._server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.queue.close()
+
+
+class DaemonClient:
+    """Connection to a stacking daemon."""
+
+    def __init__(self, folder: Optional[str] = None, timeout: Optional[float] = None) -> None:
+        """
+        Args:
+            folder: folder of the daemon socket, `default_daemon_dir()` if None
+            timeout: seconds a reply may take, None to wait for ever
+        Raises:
+            OSError: no daemon listens on the socket
+        """
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        try:
+            self._socket.connect(os.path.join(folder or default_daemon_dir(), SOCKET_NAME))
+        except OSError:
+            self._socket.close()
+            raise
+        self._file = self._socket.makefile('rwb')
+
+    def __enter__(self) -> 'DaemonClient':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _send(self, request: Dict) -> None:
+        self._file.write((json.dumps(request, ensure_ascii=False) + '\n').encode())
+        self._file.flush()
+
+    def _receive(self) -> Dict:
+        line = self._file.readline()
+        if not line:
+            raise OSError('Stacking daemon closed the connection')
+        reply = json.loads(line)
+        if not reply.get('ok'):
+            raise OSError(f'Stacking daemon: {reply.get("error", "request failed")}')
+        return reply
+
+    def request(self, request: Dict) -> Dict:
+        """
+        Send request and read its reply.
+        Raises:
+            OSError: connection lost or request failed
+        """
+        self._send(request)
+        return self._receive()
+
+    def info(self) -> Tuple[str, Dict[str, str]]:
+        """Backend name and settings of the daemon."""
+        reply = self.request({'op': 'info'})
+        return reply['backend'], reply['settings']
+
+    def submit(self, jobs: List[Tuple[str, List[str]]]) -> List[int]:
+        return self.request({'op': 'submit', 'jobs': [[out_folder, files] for out_folder, files in jobs]})['ids']
+
+    def status(self, ids: List[int]) -> List[JobRecord]:
+        return [JobRecord(**job) for job in self.request({'op': 'status', 'ids': ids})['jobs']]
+
+    def wait(self, ids: List[int]) -> Iterator[JobRecord]:
+        """Records of jobs as they finish."""
+        self._send({'op': 'wait', 'ids': ids})
+        while True:
+            reply = self._receive()
+            if reply.get('done'):
+                return
+            yield JobRecord(**reply['job'])
+
+    def stop(self) -> None:
+        self.request({'op': 'stop'})
+
+    def close(self) -> None:
+        self._file.close()
+        self._socket.close()
+
+
+def ping(folder: Optional[str] = None) -> bool:
+    """Whether a daemon answers on the socket of `folder`."""
+    try:
+        with DaemonClient(folder, timeout=2.0) as client:
+            client.info()
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def submit_stacks(
+    path: str,
+    folder: Optional[str] = None,
+    skip_done: bool = True,
+    on_finished: Optional[Callable[[JobRecord], None]] = None,
+) -> List[JobRecord]:
+    """
+    Submit stacks of grouped folder or job list to the daemon and wait for them.
+    Stacks the results ledger has as stacked by the daemon backend are skipped;
+    finished stacks are recorded there as they finish.
+    Args:
+        path: grouped 'fs' folder or job list of manifest mode
+        folder: folder of the daemon socket, `default_daemon_dir()` if None
+        skip_done: skip stacks the results ledger has as stacked
+        on_finished: called with every finished job
+    Returns:
+        records of all submitted stacks, in order of finishing; stacks the daemon
+        stopped before finishing come last, as failed
+    Raises:
+        OSError: no daemon is running or the connection is lost
+    """
+    jobs = find_jobs(path)
+    results = ledger.Ledger(ledger.ledger_path(path))
+    with DaemonClient(folder) as client:
+        backend, settings = client.info()
+        pending = results.pending(jobs, backend, settings) if skip_done else jobs
+        if len(pending) < len(jobs):
+            print(f'Skipping {len(jobs) - len(pending)} stack(s) already stacked with these settings')
+        if not pending:
+            return []
+        by_id = dict(zip(client.submit(pending), pending))
+        finished = []
+        for record in client.wait(list(by_id)):
+            if record.state == STATE_DONE:
+                results.record(by_id[record.id], backend, settings)
+                results.save()
+            if on_finished:
+                on_finished(record)
+            finished.append(record)
+    #  Daemon stopped while they were queued or running: not stacked by this run
+    seen = {record.id for record in finished}
+    for job_id, (out_folder, files) in by_id.items():
+        if job_id not in seen:
+            record = JobRecord(job_id, out_folder, files, STATE_FAILED, error=STOPPED_ERROR)
+            if on_finished:
+                on_finished(record)
+            finished.append(record)
+    return finished
+
+
+def print_record(record: JobRecord) -> None:
+    name = ledger.stack_id(record.files)
+    if record.state == STATE_DONE:
+        print(
+            f'Stacked {name}: {len(record.files)} frames -> {os.path.basename(record.output)} '
+            f'in {record.seconds:.2f}s'
+        )
+    else:
+        print(f'❌ {name} failed: {record.error}')
+
+
+def make_backend(args: argparse.Namespace, folder: str):
+    if args.backend == BACKEND_FAKE:
+        return FakeBackend()
+    if args.backend == ledger.BACKEND_PHOTOSHOP:
+        return PhotoshopBackend(os.path.abspath(args.stacker), args.photoshop_app, folder)
+    #  Imported here: NumPy is needed only by this backend
+    import native_stacker
+
+    return NativeBackend(
+        native_stacker.StackOptions(
+            args.method,
+            args.model,
+            args.preset,
+            args.streaming,
+            args.memory_mb,
+            decoders=args.decoders,
+            prefetch=args.prefetch,
+            prefetch_mb=args.prefetch_mb,
+            cache_mb=args.cache_mb,
+            cache_dir=args.cache_dir,
+            incremental=args.incremental,
+        )
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Stacking daemon with a job queue')
+    parser.add_argument('command', choices=('serve', 'submit', 'stop'), help='run the daemon or talk to it')
+    parser.add_argument('path', nargs='?', help='grouped "fs" folder or job list to submit')
+    parser.add_argument('--folder', default=None, help='folder of socket and queue')
+    parser.add_argument('--backend', choices=BACKENDS, default=ledger.BACKEND_NATIVE, help='backend kept warm')
+    parser.add_argument(
+        '--method', choices=('max', 'weighted', 'pyramid'), default='max', help='blending method of native backend'
+    )
+    parser.add_argument('--preset', choices=('fast', 'quality'), default='quality', help='pyramid blending preset')
+    parser.add_argument(
+        '--model', choices=('translation', 'similarity', 'affine'), default='similarity', help='alignment model'
+    )
+    parser.add_argument('--streaming', action='store_true', help='decode and blend one frame at a time')
+    parser.add_argument('--memory-mb', type=int, default=0, help='stack out of core in tiles with this budget')
+    parser.add_argument('--decoders', type=int, default=0, help='decoder processes of every stack')
+    parser.add_argument('--prefetch', type=int, default=0, help='frames decoded ahead on background threads')
+    parser.add_argument('--prefetch-mb', type=int, default=0, help='memory budget of frames decoded ahead')
+    parser.add_argument(
+        '--cache-mb', type=int, default=0, help='disk cache of decoded frames kept by the daemon, with this budget'
+    )
+    parser.add_argument('--cache-dir', default=None, help='directory of the decoded frame cache')
+    parser.add_argument(
+        '--incremental', action='store_true', help='merge only frames added to stacks stacked before'
+    )
+    parser.add_argument('--stacker', default='stacker.js', help='Photoshop script of the photoshop backend')
+    parser.add_argument('--photoshop-app', default='Adobe Photoshop 2025', help='Photoshop application name')
+    parser.add_argument('--no-wait', action='store_true', help='submit without waiting for the stacks')
+    args = parser.parse_args()
+    folder = args.folder or default_daemon_dir()
+    try:
+        if args.command == 'serve':
+            daemon = StackDaemon(make_backend(args, folder), folder)
+            print(f'Stacking daemon ({daemon.backend.name}) listening on {daemon.socket_path}')
+            daemon.serve_forever()
+            return 0
+        if args.command == 'stop':
+            with DaemonClient(folder) as client:
+                client.stop()
+            return 0
+        if not args.path:
+            parser.error('submit needs a grouped folder or job list')
+        if args.no_wait:
+            with DaemonClient(folder) as client:
+                ids = client.submit(find_jobs(args.path))
+            print(f'Submitted {len(ids)} stack(s)')
+            return 0
+        records = submit_stacks(args.path, folder, on_finished=print_record)
+    except OSError as e:
+        print(f'❌ Stacking daemon: {e}')
+        return 1
+    failed = [record for record in records if record.state != STATE_DONE]
+    print(f'Stacked {len(records) - len(failed)} of {len(records)} stack(s)')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""
+Tiled out-of-core stacking for frames too large to blend in RAM.
+
+Frames are decoded and aligned one at a time, and their aligned pixels and coverage
+masks are spilled once to np.memmap files in a scratch directory. The stack is then
+blended tile by tile: every tile reads its window of all frames from the memmaps
+through a StackAccumulator, with a halo wide enough that focus measures and pyramid
+levels near the tile border see the pixels they would see in the whole image, and
+only the tile interior is written to the result memmap. Tile side follows from the
+memory budget and the bytes per pixel the blending method needs.
+
+Scratch files of a stack live in '<scratch dir>/<key>', the key hashing the frame
+paths, sizes, modification times and alignment model. They are removed once the
+result is saved; if stacking fails or is interrupted, a re-run reuses the spilled
+frames instead of decoding and aligning them again.
+
+Pyramid blending in tiles is limited to TILED_LEVELS levels, so that the halo covers
+the footprint of the coarsest level; tiles start on multiples of its decimation
+step, so every tile samples the same pyramid grid as the whole image would.
+
+Usage:
+    python tiled_stacker.py <fs folder | job list> [--memory-mb N] [--scratch DIR]
+                            [--method max|weighted|pyramid] [--preset fast|quality]
+                            [--model translation|similarity|affine]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import aligner
+import blender
+import native_stacker
+from image_loader import load_image, output_name, read_exif, save_jpeg, to_gray
+from user_dirs import make_private_dir, user_temp_dir
+
+#  Default memory budget of blending, megabytes
+DEFAULT_MEMORY_MB = 1024
+
+#  Default scratch directory, per user in the system temporary folder
+SCRATCH_FOLDER_NAME = 'pyfocusstack-scratch'
+
+#  Written last when all frames of a stack are spilled
+SPILL_INFO_NAME = 'spill.json'
+SPILL_VERSION = 1
+
+#  Approximate working memory per tile pixel, bytes: frame window, luminance, focus
+#  measure (float64 summed-area table), accumulator state
+BYTES_PER_PIXEL = {
+    native_stacker.METHOD_MAX: 64,
+    native_stacker.METHOD_WEIGHTED: 96,
+    native_stacker.METHOD_PYRAMID: 160,
+}
+
+#  Pyramid depth of tiled blending, and halo covering the footprint of its levels
+TILED_LEVELS = 6
+PYRAMID_HALO = 4 * 2**TILED_LEVELS
+
+#  Tile sides are multiples of this (the pyramid decimation step), and not less
+TILE_ALIGN = 2**TILED_LEVELS
+MIN_TILE = 4 * TILE_ALIGN
+
+
+class Spill(NamedTuple):
+    """
+    Aligned frames of one stack spilled to scratch.
+    Attributes:
+        folder: scratch folder of the stack
+        shape: (height, width, 3) of frames
+        transforms: transform from the first frame to every frame
+    """
+
+    folder: str
+    shape: Tuple[int, int, int]
+    transforms: List[aligner.Transform]
+
+    def frame(self, index: int) -> np.ndarray:
+        """Aligned frame, read-only memmap."""
+        return np.memmap(frame_path(self.folder, index), np.uint8, 'r', shape=self.shape)
+
+    def valid(self, index: int) -> np.ndarray:
+        """Mask of pixels covered by aligned frame, read-only memmap."""
+        return np.memmap(valid_path(self.folder, index), np.bool_, 'r', shape=self.shape[:2])
+
+
+def default_scratch() -> str:
+    return user_temp_dir(SCRATCH_FOLDER_NAME)
+
+
+def stack_key(paths: List[str], model: str) -> str:
+    """Scratch folder name of stack: hash of frame identities and alignment model."""
+    digest = hashlib.sha1(model.encode())
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f'{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0'.encode())
+    return digest.hexdigest()[:16]
+
+
+def frame_path(folder: str, index: int) -> str:
+    return os.path.join(folder, f'frame_{index:04d}.u8')
+
+
+def valid_path(folder: str, index: int) -> str:
+    return os.path.join(folder, f'valid_{index:04d}.u8')
+
+
+def halo(method: str) -> int:
+    """Pixels around tile that blending of its interior depends on."""
+    if method == native_stacker.METHOD_PYRAMID:
+        return PYRAMID_HALO
+    #  Laplacian reaches one pixel, then box filter of focus FOCUS_RADIUS; box filter
+    #  of coverage reaches FOCUS_RADIUS + 1
+    return native_stacker.FOCUS_RADIUS + 1
+
+
+def tile_side(memory_budget: int, method: str) -> int:
+    """Largest tile side (multiple of TILE_ALIGN) whose window with halo fits the budget."""
+    window = int((memory_budget / BYTES_PER_PIXEL[method]) ** 0.5)
+    side = (window - 2 * halo(method)) // TILE_ALIGN * TILE_ALIGN
+    return max(side, MIN_TILE)
+
+
+def tiles(height: int, width: int, side: int) -> List[Tuple[int, int, int, int]]:
+    """(top, bottom, left, right) of tiles covering the image, row by row."""
+    return [
+        (top, min(top + side, height), left, min(left + side, width))
+        for top in range(0, height, side)
+        for left in range(0, width, side)
+    ]
+
+
+def read_spill(folder: str, frames: int) -> Optional[Spill]:
+    """Spill of previous run of the stack, None if it is missing or incomplete."""
+    try:
+        with open(os.path.join(folder, SPILL_INFO_NAME), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if info.get('version') != SPILL_VERSION or len(info['transforms']) != frames:
+        return None
+    return Spill(folder, tuple(info['shape']), [aligner.Transform(*t) for t in info['transforms']])
+
+
+def spill_frames(paths: List[str], folder: str, model: str, memory_budget: int) -> Spill:
+    """
+    Decode and align frames one at a time, writing aligned pixels and coverage masks
+    to memmaps in `folder`, or reuse the spill already there.
+    Args:
+        paths: frame files in shooting order
+        folder: scratch folder of the stack
+        model: alignment model, one of aligner.MODELS
+        memory_budget: bytes, sets the rows warped at once
+    Returns:
+        spill of the stack
+    Raises:
+        OSError: file can't be read or written
+        ValueError: frames differ in size
+    """
+    spill = read_spill(folder, len(paths))
+    if spill is not None:
+        return spill
+    os.makedirs(folder, exist_ok=True)
+    stream = aligner.StreamAligner(model)
+    shape = None
+    transforms = []
+    for index, path in enumerate(paths):
+        image = load_image(path)
+        if shape is None:
+            shape = image.shape
+        elif image.shape != shape:
+            raise ValueError('Frames of a stack differ in size')
+        transform = stream.add(to_gray(image))
+        height, width = shape[:2]
+        frame = np.memmap(frame_path(folder, index), np.uint8, 'w+', shape=shape)
+        valid = np.memmap(valid_path(folder, index), np.bool_, 'w+', shape=(height, width))
+        #  Warped in bands of rows, so only the decoded frame is held whole
+        rows = max(memory_budget // (width * 3 * 4 * 4), 1)
+        for top in range(0, height, rows):
+            band = min(rows, height - top)
+            frame[top : top + band], valid[top : top + band] = aligner.warp(
+                image, transform, (band, width), (0, top)
+            )
+        frame.flush()
+        valid.flush()
+        del frame, valid, image
+        transforms.append(transform)
+    info = {'version': SPILL_VERSION, 'shape': list(shape), 'transforms': [list(t) for t in transforms]}
+    info_path = os.path.join(folder, SPILL_INFO_NAME)
+    with open(info_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(info_path + '.tmp', info_path)
+    return Spill(folder, shape, transforms)
+
+
+def blend_tiles(
+    spill: Spill,
+    method: str = native_stacker.METHOD_MAX,
+    preset: str = blender.PRESET_QUALITY,
+    memory_budget: int = DEFAULT_MEMORY_MB << 20,
+) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+    """
+    Blend spilled frames tile by tile into a result memmap in the scratch folder.
+    Args:
+        spill: aligned frames of the stack
+        method: one of native_stacker.METHODS
+        preset: blender preset of METHOD_PYRAMID
+        memory_budget: bytes of working memory per tile
+    Returns:
+        whole-frame result (memmap), crop region covered by every frame
+    """
+    height, width = spill.shape[:2]
+    frames = range(len(spill.transforms))
+    margin = halo(method)
+    merged = np.memmap(os.path.join(spill.folder, 'result.u8'), np.uint8, 'w+', shape=spill.shape)
+    covered = np.ones((height, width), dtype=bool)
+    for top, bottom, left, right in tiles(height, width, tile_side(memory_budget, method)):
+        #  Window of tile with halo, clipped to the image
+        y0, y1 = max(top - margin, 0), min(bottom + margin, height)
+        x0, x1 = max(left - margin, 0), min(right + margin, width)
+        accumulator = native_stacker.StackAccumulator(
+            (y1 - y0, x1 - x0, 3), method, preset, TILED_LEVELS
+        )
+        for index in frames:
+            accumulator.add(
+                np.array(spill.frame(index)[y0:y1, x0:x1]), np.array(spill.valid(index)[y0:y1, x0:x1])
+            )
+        inner = (slice(top - y0, bottom - y0), slice(left - x0, right - x0))
+        merged[top:bottom, left:right] = accumulator.blended()[inner]
+        covered[top:bottom, left:right] = accumulator.covered[inner]
+    return merged, aligner.valid_region(covered)
+
+
+def stack_files(
+    paths: List[str],
+    out_folder: str,
+    method: str = native_stacker.METHOD_MAX,
+    model: str = aligner.MODEL_SIMILARITY,
+    preset: str = blender.PRESET_QUALITY,
+    memory_budget: int = DEFAULT_MEMORY_MB << 20,
+    scratch_dir: Optional[str] = None,
+) -> native_stacker.StackResult:
+    """
+    Stack image files out of core and save '<last file>_fs.jpg' into `out_folder`.
+    Scratch files are removed once the result is saved, and kept for a re-run if
+    stacking fails.
+    Args:
+        paths: frame files in shooting order
+        out_folder: folder of the result
+        method: one of native_stacker.METHODS
+        model: alignment model, one of aligner.MODELS
+        preset: blender preset of METHOD_PYRAMID
+        memory_budget: bytes of working memory per tile
+        scratch_dir: parent of scratch folders, `default_scratch()`, private to the user, if None
+    Raises:
+        OSError: file can't be read or written
+        ValueError: frames differ in size or there are none
+    """
+    if not paths:
+        raise ValueError('No frames to stack')
+    start = time.perf_counter()
+    folder = os.path.join(scratch_dir or make_private_dir(default_scratch()), stack_key(paths, model))
+    spill = spill_frames(paths, folder, model, memory_budget)
+    merged, (top, bottom, left, right) = blend_tiles(spill, method, preset, memory_budget)
+    path = os.path.join(out_folder, output_name(paths[-1]))
+    save_jpeg(path, np.ascontiguousarray(merged[top:bottom, left:right]), read_exif(paths[-1]))
+    del merged
+    shutil.rmtree(folder, ignore_errors=True)
+    return native_stacker.StackResult(
+        path, len(paths), spill.transforms, (top, bottom, left, right), time.perf_counter() - start
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Out-of-core focus stacking in tiles')
+    parser.add_argument('path', help='grouped "fs" folder or job list of manifest mode')
+    parser.add_argument('--memory-mb', type=int, default=DEFAULT_MEMORY_MB, help='blending memory budget')
+    parser.add_argument('--scratch', default=None, help=f'scratch directory (default {default_scratch()})')
+    parser.add_argument(
+        '--method', choices=native_stacker.METHODS, default=native_stacker.METHOD_MAX, help='blending method'
+    )
+    parser.add_argument(
+        '--preset', choices=tuple(blender.PRESETS), default=blender.PRESET_QUALITY, help='pyramid blending preset'
+    )
+    parser.add_argument(
+        '--model', choices=aligner.MODELS, default=aligner.MODEL_SIMILARITY, help='alignment model'
+    )
+    args = parser.parse_args()
+    try:
+        results = native_stacker.stack_all(
+            args.path, args.method, args.model, args.preset, memory_mb=args.memory_mb, scratch_dir=args.scratch
+        )
+    except (OSError, ValueError) as e:
+        print(f'❌ Stacking failed: {e}')
+        return 1
+    print(f'Focus stacking completed: {len(results)} stack(s)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""
+Bulk file moving that works across filesystems.
+
+`os.rename` is used whenever source and target folders are on the same device. Across
+devices (e.g. photos staged on the local SSD, 'fs' folder on an external volume
+through a symlink or mount point) a move becomes a copy: data is copied in-kernel
+with `os.copy_file_range` or `os.sendfile` where available (plain buffered copy
+otherwise) into a temporary '.part' file, which is fsynced, optionally verified
+with a streaming BLAKE2 hash, renamed to its final name and fsynced with its
+folder. Only then the source file is deleted, so a crash never leaves a file in
+neither place. Copies run in a bounded thread pool, renames inline.
+"""
+import errno
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from journal import fsync_dir
+
+#  Parallel cross-device copies
+DEFAULT_WORKERS = 4
+
+#  Bytes per copy_file_range/sendfile call and per hash read
+CHUNK_SIZE = 8 * 1024 * 1024
+
+#  Suffix of file being copied, renamed to the final name once durable
+PART_SUFFIX = '.part'
+
+
+class TransferReport(NamedTuple):
+    """Totals of one run of transfers."""
+
+    renamed: int
+    copied: int
+    bytes_copied: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """Copy throughput, MB/s."""
+        return self.bytes_copied / 1e6 / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        files = self.renamed + self.copied
+        text = f'Transfer: {files} files in {self.seconds:.2f}s ({self.renamed} renamed'
+        if self.copied:
+            text += (
+                f', {self.copied} copied across devices, {self.bytes_copied / 1e6:.1f} MB '
+                f'at {self.throughput:.1f} MB/s'
+            )
+        return text + ')'
+
+
+def device_of(path: str) -> int:
+    return os.stat(path).st_dev
+
+
+def _copy_stopped(offset: int, size: int) -> bool:
+    """
+    End of an in-kernel copy that copied nothing more: False if nothing was copied,
+    to fall back to another way of copying.
+    Raises:
+        OSError: copy stopped part way (EIO)
+    """
+    if offset == 0:
+        return False
+    raise OSError(errno.EIO, f'Copy stopped after {offset} of {size} bytes')
+
+
+def _copy_range(src_fd: int, dst_fd: int, size: int) -> bool:
+    """
+    In-kernel copy with copy_file_range, False if not supported here or nothing is copied.
+    Raises:
+        OSError: copy failed or stopped part way
+    """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is None:
+        return False
+    offset = 0
+    try:
+        while offset < size:
+            sent = copy_file_range(src_fd, dst_fd, min(CHUNK_SIZE, size - offset))
+            if sent == 0:
+                return _copy_stopped(offset, size)
+            offset += sent
+    except OSError as e:
+        #  Not supported between these filesystems (older kernels refuse
+        #  cross-device ranges), nothing has been written yet
+        if offset == 0 and e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+            return False
+        raise
+    return True
+
+
+def _send_file(src_fd: int, dst_fd: int, size: int) -> bool:
+    """
+    In-kernel copy with sendfile to a regular file (Linux), False if not supported or
+    nothing is copied.
+    Raises:
+        OSError: copy failed or stopped part way
+    """
+    if not hasattr(os, 'sendfile') or not sys.platform.startswith('linux'):
+        return False
+    offset = 0
+    try:
+        while offset < size:
+            sent = os.sendfile(dst_fd, src_fd, offset, min(CHUNK_SIZE, size - offset))
+            if sent == 0:
+                return _copy_stopped(offset, size)
+            offset += sent
+    except OSError as e:
+        if offset == 0 and e.errno in (errno.ENOSYS, errno.EINVAL):
+            return False
+        raise
+    return True
+
+
+def file_digest(path: str) -> bytes:
+    """BLAKE2b of file contents, read in chunks."""
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def copy_file(src: str, dst: str, verify: bool = False) -> int:
+    """
+    Copy file durably: data and timestamps go to `dst`.part, which is fsynced (and
+    verified) before it is renamed to `dst`.
+    Args:
+        src: source file
+        dst: target file, must not exist
+        verify: compare BLAKE2 hashes of source and copy
+    Returns:
+        number of bytes copied
+    Raises:
+        OSError: copy failed, is shorter than the source or differs from it (EIO);
+            the part file is removed
+    """
+    part = dst + PART_SUFFIX
+    try:
+        with open(src, 'rb') as fsrc, open(part, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+            if not (_copy_range(src_fd, dst_fd, size) or _send_file(src_fd, dst_fd, size)):
+                shutil.copyfileobj(fsrc, fdst, CHUNK_SIZE)
+            fdst.flush()
+            copied = os.fstat(dst_fd).st_size
+            if copied != size:
+                raise OSError(errno.EIO, f'Copied {copied} of {size} bytes', src)
+            os.fsync(dst_fd)
+        #  Keep modification time: metadata cache and photo apps rely on it
+        shutil.copystat(src, part)
+        if verify and file_digest(src) != file_digest(part):
+            raise OSError(errno.EIO, 'Copy differs from source', src)
+    except OSError:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        raise
+    os.rename(part, dst)
+    fsync_dir(os.path.dirname(dst))
+    return size
+
+
+def is_completed_copy(src: str, dst: str) -> bool:
+    """
+    Both files exist after an interrupted cross-device move: the copy was completed
+    (only durable copies get their final name), the source wasn't deleted yet.
+    """
+    try:
+        src_stat, dst_stat = os.stat(src), os.stat(dst)
+    except FileNotFoundError:
+        return False
+    return src_stat.st_dev != dst_stat.st_dev and src_stat.st_size == dst_stat.st_size
+
+
+class TransferEngine:
+    """Moves files, renaming on the same device and copying across devices."""
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, verify: bool = False) -> None:
+        """
+        Args:
+            workers: parallel cross-device copies
+            verify: verify every copy with a BLAKE2 hash before deleting its source
+        """
+        self.workers = max(1, workers)
+        self.verify = verify
+        self._devices: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._renamed = 0
+        self._copied = 0
+        self._bytes = 0
+        self._seconds = 0.0
+
+    def _device(self, folder_path: str) -> int:
+        device = self._devices.get(folder_path)
+        if device is None:
+            device = self._devices[folder_path] = device_of(folder_path)
+        return device
+
+    def same_device(self, src_folder: str, dst_folder: str) -> bool:
+        return self._device(src_folder) == self._device(dst_folder)
+
+    def _copy(self, src: str, dst: str) -> None:
+        size = copy_file(src, dst, self.verify)
+        os.remove(src)
+        with self._lock:
+            self._copied += 1
+            self._bytes += size
+
+    def move_many(self, src_folder: str, dst_folder: str, names: List[str]) -> Iterator[str]:
+        """
+        Move files between two folders: one rename each on the same device, parallel
+        durable copies across devices.
+        Args:
+            src_folder: folder files are in
+            dst_folder: folder to move files into
+            names: file names
+        Returns:
+            iterator over names of moved files, in order of `names`; across devices
+            files are copied ahead of iteration by the pool
+        Raises:
+            OSError: on iteration, move of the file failed
+        """
+        start = time.perf_counter()
+        pairs: List[Tuple[str, str]] = [
+            (os.path.join(src_folder, name), os.path.join(dst_folder, name)) for name in names
+        ]
+        try:
+            if self.same_device(src_folder, dst_folder):
+                for name, (src, dst) in zip(names, pairs):
+                    try:
+                        os.rename(src, dst)
+                    except OSError as e:
+                        if e.errno != errno.EXDEV:
+                            raise
+                        #  Folder is a mount point of another device after all
+                        self._copy(src, dst)
+                    else:
+                        with self._lock:
+                            self._renamed += 1
+                    yield name
+            else:
+                with ThreadPoolExecutor(self.workers) as pool:
+                    for name, _ in zip(names, pool.map(lambda pair: self._copy(*pair), pairs)):
+                        yield name
+        finally:
+            with self._lock:
+                self._seconds += time.perf_counter() - start
+
+    def report(self) -> TransferReport:
+        """Totals of all moves made by this engine."""
+        with self._lock:
+            return TransferReport(self._renamed, self._copied, self._bytes, self._seconds)
@@ -0,0 +1,39 @@
+"""
+Per-user folders in the system temporary folder.
+
+Default folders of the frame cache, the tiled stacker scratch and the stacking
+daemon are in the temporary folder every local user can write to. Their names
+carry the user id, they are created readable by their owner only, and a folder
+found there owned by someone else or open to others is refused: another user
+could have created it first to read frames, plant cache entries or take over the
+daemon's socket.
+"""
+import errno
+import getpass
+import os
+import stat
+import tempfile
+
+
+def user_temp_dir(name: str) -> str:
+    """Folder `name` of the current user in the system temporary folder, not created."""
+    user = str(os.getuid()) if hasattr(os, 'getuid') else getpass.getuser()
+    return os.path.join(tempfile.gettempdir(), f'{name}-{user}')
+
+
+def make_private_dir(path: str) -> str:
+    """
+    Create folder with mode 0o700, or check that the existing one is private.
+    Returns:
+        path
+    Raises:
+        OSError: folder can't be created, or it isn't a folder owned by the current
+            user and closed to others (EPERM)
+    """
+    os.makedirs(path, 0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise OSError(errno.ENOTDIR, 'Not a folder', path)
+    if hasattr(os, 'getuid') and (info.st_uid != os.getuid() or info.st_mode & 0o077):
+        raise OSError(errno.EPERM, 'Folder is not private to this user (owner or mode)', path)
+    return path
@@ -0,0 +1,88 @@
+"""
+NumPy-vectorized grouping engine for large archives.
+
+Timestamps are viewed as one int64 array of seconds straight from the photo table
+column, stack boundaries are found with `np.diff`/`np.flatnonzero` and stacks are
+(start, end) row ranges of the table, so no per-stack lists are built while
+grouping. Length limits are applied as array masks and the size statistics come
+from `np.bincount`.
+"""
+from typing import Dict, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+
+class StackRanges(NamedTuple):
+    """Stacks as half-open row ranges [start, end) of time-sorted photos."""
+
+    starts: np.ndarray
+    ends: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self.ends - self.starts
+
+
+def find_stacks(seconds: np.ndarray, max_delta: float, min_len: int) -> StackRanges:
+    """
+    Split time-sorted photos into stacks where neighbours are more than `max_delta`
+    seconds apart, keeping stacks of at least `min_len` photos.
+    Args:
+        seconds: int64 timestamps sorted ascending
+        max_delta: maximum gap between photos of one stack, seconds
+        min_len: minimum number of photos in a stack
+    Returns:
+        ranges of kept stacks
+    """
+    if len(seconds) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return StackRanges(empty, empty)
+    gaps = np.flatnonzero(np.diff(seconds) > max_delta) + 1
+    starts = np.concatenate(([0], gaps))
+    ends = np.concatenate((gaps, [len(seconds)]))
+    keep = (ends - starts) >= min_len
+    return StackRanges(starts[keep], ends[keep])
+
+
+def stack_stat(ranges: StackRanges) -> Dict[int, int]:
+    """Statistics on stack sizes {size: count} computed with np.bincount."""
+    counts = np.bincount(ranges.lengths)
+    sizes = np.flatnonzero(counts)
+    return dict(zip(sizes.tolist(), counts[sizes].tolist()))
+
+
+def long_stacks(ranges: StackRanges, warn_len: int) -> StackRanges:
+    """Stacks longer than `warn_len`, selected with an array mask."""
+    mask = ranges.lengths > warn_len
+    return StackRanges(ranges.starts[mask], ranges.ends[mask])
+
+
+def group(
+    names: Sequence[str],
+    seconds: Sequence[int],
+    max_delta: float,
+    min_len: int,
+    warn_len: int,
+) -> Tuple[StackRanges, Dict[int, int]]:
+    """
+    Vectorized equivalent of `grouper.get_stacks` for time-sorted photos.
+    Args:
+        names: photo names in time order
+        seconds: photo timestamps in time order; an int64 buffer such as
+            `PhotoTable.timestamps` is viewed, not copied
+        max_delta: maximum gap between photos of one stack, seconds
+        min_len: minimum number of photos in a stack
+        warn_len: stacks longer than this are reported
+    Returns:
+        stacks as ranges of rows & statistics on stack sizes
+    """
+    ranges = find_stacks(np.asarray(seconds, dtype=np.int64), max_delta, min_len)
+    for start, end in zip(*long_stacks(ranges, warn_len)):
+        print(
+            f'Strange long stack ({end - start}) elements. '
+            f'From {names[start]} to {names[end - 1]}'
+        )
+    return ranges, stack_stat(ranges)
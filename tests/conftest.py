@@ -0,0 +1,100 @@
+"""
+Synthetic focus brackets shared by the stacking tests.
+
+`frame_files` and `grouped` take their layout from indirect parametrization:
+
+    @pytest.mark.parametrize('frame_files', [{'copies': 2}], indirect=True)
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import aligner  # noqa: E402
+import native_stacker  # noqa: E402
+from image_loader import save_jpeg  # noqa: E402
+
+#  Camera shift (dy, dx) of every frame of a bracket
+SHIFTS = [(0, 0), (3, -2), (5, 1)]
+
+
+def make_scene(height: int = 240, width: int = 320) -> np.ndarray:
+    """Sharp random texture, uint8 RGB."""
+    rng = np.random.default_rng(1)
+    texture = rng.integers(0, 256, (height // 4, width // 4, 3), dtype=np.uint8)
+    return np.repeat(np.repeat(texture, 4, axis=0), 4, axis=1)
+
+
+def make_bracket(sharp: np.ndarray) -> list:
+    """Frames each in focus in one horizontal band only, moved by SHIFTS."""
+    blurred = np.stack(
+        [native_stacker.box_filter(sharp[:, :, c].astype(np.float32), 4) for c in range(3)], axis=2
+    ).astype(np.uint8)
+    bands = np.array_split(np.arange(sharp.shape[0]), len(SHIFTS))
+    frames = []
+    for band, (dy, dx) in zip(bands, SHIFTS):
+        frame = blurred.copy()
+        frame[band] = sharp[band]
+        #  Camera moved by (dy, dx): frame pixel p shows the scene at p + (dy, dx)
+        frames.append(aligner.warp(frame, aligner.Transform(tx=dx, ty=dy))[0])
+    return frames
+
+
+@pytest.fixture
+def shifts():
+    return SHIFTS
+
+
+@pytest.fixture
+def scene():
+    """`make_scene`, called as scene(height, width)."""
+    return make_scene
+
+
+@pytest.fixture
+def bracket():
+    """`make_bracket`, called as bracket(sharp)."""
+    return make_bracket
+
+
+@pytest.fixture
+def frame_files(request, tmp_path):
+    """
+    One bracket saved as 'IMG_0001.JPG'... of `tmp_path`.
+    Params:
+        copies: times the bracket is repeated, 1 by default
+        size: (height, width) of the scene, (240, 320) by default
+    """
+    params = getattr(request, 'param', {})
+    frames = make_bracket(make_scene(*params.get('size', (240, 320)))) * params.get('copies', 1)
+    paths = []
+    for i, frame in enumerate(frames, 1):
+        path = str(tmp_path / f'IMG_{i:04d}.JPG')
+        save_jpeg(path, frame)
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def grouped(request, tmp_path):
+    """
+    'fs' folder of three stacks of the three frames of a 120x160 bracket.
+    Params:
+        broken: index of the stack whose second frame is not a JPEG, None by default
+    """
+    params = getattr(request, 'param', {})
+    fs = tmp_path / 'fs'
+    frames = make_bracket(make_scene(120, 160))
+    for stack, first in enumerate((1, 4, 7)):
+        folder = fs / f'IMG_{first:04d}_to_IMG_{first + 2:04d}'
+        folder.mkdir(parents=True)
+        for i, frame in enumerate(frames):
+            save_jpeg(str(folder / f'IMG_{first + i:04d}.JPG'), frame)
+        if stack == params.get('broken'):
+            (folder / f'IMG_{first + 1:04d}.JPG').write_bytes(b'not a jpeg')
+    return fs
@@ -0,0 +1,70 @@
+"""
+Tests for the pyramid phase correlation alignment engine on synthetic frames.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import aligner  # noqa: E402
+
+
+def texture(height: int = 480, width: int = 640) -> np.ndarray:
+    """Random texture of 4x4 pixel blocks on a smooth background, float32."""
+    rng = np.random.default_rng(2)
+    blocks = rng.random((height // 4, width // 4), dtype=np.float32) * 128
+    background = np.add.outer(np.linspace(0, 64, height), np.linspace(0, 64, width))
+    return np.repeat(np.repeat(blocks, 4, axis=0), 4, axis=1) + background.astype(np.float32)
+
+
+@pytest.mark.parametrize(
+    'model, expected',
+    [
+        (aligner.MODEL_TRANSLATION, aligner.Transform(tx=-3.4, ty=7.25)),
+        (aligner.MODEL_SIMILARITY, aligner.Transform(1.0196, -0.0142, -2.1, 0.0142, 1.0196, 1.5)),
+        (aligner.MODEL_AFFINE, aligner.Transform(1.01, 0.005, 2.0, -0.003, 0.995, -4.0)),
+    ],
+)
+def test_transform_is_recovered(model, expected):
+    plane = texture()
+    frame, _ = aligner.warp(plane, expected)
+    report = aligner.align_frames([frame, plane], model)
+    assert report.transforms[0] == aligner.Transform()
+    assert report.transforms[1] == pytest.approx(expected, abs=0.02)
+    assert len(report.seconds) == 2
+
+
+def test_transforms_are_chained_to_first_frame():
+    plane = texture()
+    steps = [aligner.Transform(tx=1.5, ty=-2.0), aligner.Transform(tx=2.0, ty=1.0)]
+    frames = [plane]
+    for step in steps:
+        #  Previous frame pixel p is pixel p + step of the next one
+        frames.append(aligner.warp(frames[-1], aligner.Transform(tx=-step.tx, ty=-step.ty))[0])
+    transforms = aligner.align_frames(frames, aligner.MODEL_TRANSLATION).transforms
+    assert (transforms[2].tx, transforms[2].ty) == pytest.approx((3.5, -1.0), abs=0.05)
+
+
+def test_separable_warp_matches_general_remap():
+    image = (texture(60, 80)[:, :, None] * np.array([1.0, 0.5, 0.25])).astype(np.uint8)
+    transform = aligner.Transform(1.02, 0.0, -1.5, 0.0, 0.99, 2.25)
+    separable, valid = aligner.warp(image, transform)
+    general, general_valid = aligner.warp(image, transform._replace(b=1e-12))
+    assert np.abs(separable.astype(int) - general.astype(int)).max() <= 1
+    assert (valid == general_valid).all()
+    #  Source x = 1.02 x - 1.5 is inside for x in 2..78, source y = 0.99 y + 2.25 for y < 58
+    assert aligner.valid_region(valid) == (0, 58, 2, 79)
+
+
+def test_transform_of_reduced_frames_is_rescaled_to_full_ones():
+    expected = aligner.Transform(1.0196, -0.0142, -6.2, 0.0142, 1.0196, 9.5)
+    plane = texture(960, 1280)
+    frame, _ = aligner.warp(plane, expected)
+    report = aligner.align_frames([aligner.downsample(frame), aligner.downsample(plane)])
+    assert report.transforms[1].rescaled(2) == pytest.approx(expected, abs=0.05)
+    assert aligner.Transform(tx=1.5).rescaled(2) == pytest.approx(aligner.Transform(tx=3.0))
@@ -0,0 +1,73 @@
+"""
+Tests for Laplacian pyramid blending.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import blender  # noqa: E402
+
+
+def texture(height: int = 96, width: int = 128) -> np.ndarray:
+    """Random uint8 RGB texture of 2x2 blocks."""
+    rng = np.random.default_rng(3)
+    blocks = rng.integers(0, 256, (height // 2, width // 2, 3), dtype=np.uint8)
+    return np.repeat(np.repeat(blocks, 2, axis=0), 2, axis=1)
+
+
+def blurred(image: np.ndarray) -> np.ndarray:
+    """Image smoothed by 5x5 mean, uint8."""
+    padded = np.pad(image.astype(np.float32), ((2, 2), (2, 2), (0, 0)), mode='edge')
+    height, width = image.shape[:2]
+    total = sum(padded[i : i + height, j : j + width] for i in range(5) for j in range(5))
+    return np.rint(total / 25).astype(np.uint8)
+
+
+@pytest.mark.parametrize('preset', blender.PRESETS)
+@pytest.mark.parametrize('shape', [(96, 128, 3), (37, 53, 3), (101, 77)])
+def test_identical_frames_fuse_into_same_image(preset, shape):
+    image = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    assert np.array_equal(blender.fuse([image, image, image], preset), image)
+
+
+@pytest.mark.parametrize('preset', blender.PRESETS)
+def test_sharp_halves_are_fused(preset):
+    sharp = texture()
+    soft = blurred(sharp)
+    top, bottom = soft.copy(), soft.copy()
+    top[:48], bottom[48:] = sharp[:48], sharp[48:]
+    fused = blender.fuse([top, bottom], preset).astype(int)
+    error = np.abs(fused - sharp)
+    #  Away from the seam both halves come from their sharp frame
+    assert error[:40].mean() < 2 and error[56:].mean() < 2
+    assert error.mean() < np.abs(soft.astype(int) - sharp).mean() / 4
+
+
+def test_buffers_are_reused_between_frames():
+    image = texture()
+    fuser = blender.PyramidBlender(image.shape)
+    fuser.add(image)
+    buffers = [id(level) for level in fuser._gauss + fuser._band + fuser._fused]
+    fuser.add(blurred(image))
+    assert [id(level) for level in fuser._gauss + fuser._band + fuser._fused] == buffers
+    assert fuser.frames == 2
+
+
+def test_presets_limit_pyramid_depth():
+    assert len(blender.level_shapes(4000, 6000, blender.PRESETS[blender.PRESET_FAST].max_levels)) == 4
+    assert blender.level_shapes(100, 70, 16) == [(100, 70), (50, 35), (25, 18)]
+
+
+def test_no_frames_is_an_error():
+    with pytest.raises(ValueError):
+        blender.fuse([])
+
+
+def test_benchmark_reports_throughput():
+    assert blender.benchmark((160, 120), 2, blender.PRESET_FAST) > 0
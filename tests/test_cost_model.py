@@ -0,0 +1,82 @@
+"""
+Tests for stack cost and memory estimates and their calibration from run history.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import cost_model  # noqa: E402
+from image_loader import save_jpeg  # noqa: E402
+from native_stacker import METHOD_PYRAMID, StackOptions  # noqa: E402
+
+
+def record(frames, pixels, profile='batch/max'):
+    """History record of a stacker spending 1e-7 s per frame-pixel, 20 B per frame-pixel + 50 B per pixel."""
+    return cost_model.HistoryRecord(profile, frames, pixels, 1e-7 * frames * pixels, 20 * frames * pixels + 50 * pixels)
+
+
+def test_estimate_reads_pixels_from_header(tmp_path):
+    path = str(tmp_path / 'IMG_0001.JPG')
+    save_jpeg(path, np.zeros((30, 40, 3), dtype=np.uint8))
+    estimate = cost_model.CostModel().estimate([path] * 5, StackOptions())
+    seconds, memory = cost_model.DEFAULT_SECONDS['batch'], cost_model.DEFAULT_MEMORY['batch']
+    assert (estimate.frames, estimate.pixels) == (5, 1200)
+    assert estimate.seconds == pytest.approx(seconds[0] * 6000 + seconds[1] * 1200)
+    assert estimate.memory == int(memory[0] * 6000 + memory[1] * 1200)
+
+
+def test_unreadable_header_estimates_nothing(tmp_path):
+    path = tmp_path / 'IMG_0001.JPG'
+    path.write_bytes(b'not a jpeg')
+    assert cost_model.CostModel().estimate([str(path)], StackOptions()).pixels == 0
+
+
+def test_profiles_follow_options():
+    assert cost_model.profile(StackOptions()) == 'batch/max'
+    assert cost_model.profile(StackOptions(streaming=True)) == 'streaming/max'
+    assert cost_model.profile(StackOptions(method=METHOD_PYRAMID, memory_mb=64)) == 'tiled/pyramid'
+
+
+def test_calibration_recovers_coefficients():
+    history = [record(frames, pixels) for frames in (5, 12, 40) for pixels in (10**6, 24 * 10**6)]
+    coefficients = cost_model.calibrate(history)['batch/max']
+    assert coefficients.seconds == pytest.approx((1e-7, 0.0), abs=1e-12)
+    assert coefficients.memory == pytest.approx((20.0, 50.0))
+    assert coefficients.samples == 6
+
+
+def test_memory_is_fitted_from_measured_records_only():
+    history = [record(frames, 10**6) for frames in (5, 12, 40)]
+    history += [record(frames, 10**6)._replace(memory=0) for frames in (8, 20)]
+    coefficients = cost_model.calibrate(history)['batch/max']
+    assert coefficients.memory == pytest.approx((20.0, 50.0)) and coefficients.samples == 5
+    unmeasured = [entry._replace(memory=0) for entry in history]
+    assert cost_model.calibrate(unmeasured)['batch/max'].memory == cost_model.DEFAULT_MEMORY['batch']
+
+
+def test_few_samples_keep_defaults():
+    model = cost_model.CostModel([record(5, 10**6)] * (cost_model.MIN_SAMPLES - 1))
+    assert model.coefficients_of('batch/max') == cost_model.default_coefficients('batch/max')
+
+
+def test_history_round_trip(tmp_path):
+    path = str(tmp_path / cost_model.HISTORY_FILE_NAME)
+    assert cost_model.read_history(path) == []
+    cost_model.append_history(path, [record(5, 100)])
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"profile": "batch/m')
+    cost_model.append_history(path, [record(7, 100)])
+    assert [r.frames for r in cost_model.read_history(path)] == [5, 7]
+
+
+def test_history_lives_in_storage_folder():
+    storage = os.path.join(os.sep, 'photos')
+    expected = os.path.join(storage, cost_model.HISTORY_FILE_NAME)
+    assert cost_model.history_path(os.path.join(storage, '!newstack', 'fs')) == expected
+    assert cost_model.history_path(os.path.join(storage, '!newstack', '.fs_jobs.txt')) == expected
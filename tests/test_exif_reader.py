@@ -0,0 +1,60 @@
+"""
+Tests for the header-only EXIF reader and its use by grouper.read_timestamp.
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+from zipfile import ZipFile
+
+import piexif
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+from exif_reader import ExifFormatError, parse_exif_datetime, read_exif_header  # noqa: E402
+from grouper import read_timestamp  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def photos():
+    """Real camera JPEGs from the test data."""
+    with tempfile.TemporaryDirectory() as tmp:
+        with ZipFile(os.path.join(ROOT_DIR, 'test', 'test_st_in_begin.zip')) as myzip:
+            myzip.extractall(tmp)
+        yield sorted(
+            os.path.join(tmp, name) for name in os.listdir(tmp) if name.endswith('.JPG')
+        )
+
+
+def test_header_reader_matches_piexif(photos):
+    for path in photos:
+        exif = piexif.load(path)
+        header = read_exif_header(path)
+        assert header.datetime == exif['0th'][306].decode('ascii')
+        assert header.datetime_original == exif['Exif'][36867].decode('ascii')
+        assert header.subsec_original == exif['Exif'][37521].decode('ascii')
+        assert header.bytes_read < os.path.getsize(path)
+
+
+def test_parse_exif_datetime():
+    assert parse_exif_datetime('2023:12:02 13:30:39') == datetime(2023, 12, 2, 13, 30, 39)
+    with pytest.raises(ValueError):
+        parse_exif_datetime('2023-12-02 13:30:39')
+    with pytest.raises(ValueError):
+        parse_exif_datetime('0000:00:00 00:00:00')
+
+
+def test_unsupported_file_falls_back_to_piexif(tmp_path):
+    path = tmp_path / 'IMG_0001.png'
+    path.write_bytes(b'\x89PNG\r\n\x1a\n' + b'\x00' * 32)
+    with pytest.raises(ExifFormatError):
+        read_exif_header(str(path))
+    with pytest.raises(Exception):
+        read_timestamp(str(path))
+
+
+def test_read_timestamp(photos):
+    assert read_timestamp(photos[0]) == datetime(2023, 12, 2, 13, 30, 39)
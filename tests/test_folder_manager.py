@@ -0,0 +1,79 @@
+"""
+Tests for folder state detection on top of the single-pass directory scanner.
+"""
+
+import os
+import sys
+from unittest.mock import patch
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import ledger  # noqa: E402
+import scanner  # noqa: E402
+from folder_manager import determine_workflow_action, get_folder_state  # noqa: E402
+from manifest import find_jobs  # noqa: E402
+
+
+def test_folder_states(tmp_path):
+    folder = tmp_path / '!newstack'
+    assert get_folder_state(str(folder), 'fs') == 'not_exists'
+    folder.mkdir()
+    assert get_folder_state(str(folder), 'fs') == 'empty'
+    (folder / 'notes.txt').write_text('not an image')
+    (folder / 'IMG_0001.JPG').write_bytes(b'')
+    assert get_folder_state(str(folder), 'fs') == 'ready_for_grouper'
+    (folder / 'fs').mkdir()
+    assert get_folder_state(str(folder), 'fs') == 'completed'
+
+
+def test_grouped_folder_with_stacks_left_resumes_stacking(tmp_path):
+    folder = tmp_path / '!newstack'
+    for first in (1, 3):
+        stack = folder / 'fs' / f'IMG_{first:04d}_to_IMG_{first + 1:04d}'
+        stack.mkdir(parents=True)
+        for i in (first, first + 1):
+            (stack / f'IMG_{i:04d}.JPG').write_bytes(b'frame')
+    assert get_folder_state(str(folder), 'fs') == 'stacking_incomplete'
+    assert determine_workflow_action(str(tmp_path), '!newstack', 'fs') == ('run_stacker', str(folder))
+    #  Step 3 crashed after the first stack
+    results = ledger.Ledger(ledger.ledger_path(str(folder / 'fs')))
+    jobs = find_jobs(str(folder / 'fs'))
+    for out_folder, files in jobs[:1]:
+        with open(ledger.result_path(out_folder, files), 'wb') as f:
+            f.write(b'result')
+        results.record((out_folder, files), ledger.BACKEND_PHOTOSHOP, {'script': 'stacker.js'})
+    results.save()
+    assert get_folder_state(str(folder), 'fs') == 'stacking_incomplete'
+    for out_folder, files in jobs[1:]:
+        with open(ledger.result_path(out_folder, files), 'wb') as f:
+            f.write(b'result')
+        results.record((out_folder, files), ledger.BACKEND_NATIVE, {'profile': 'batch/max'})
+    results.save()
+    assert get_folder_state(str(folder), 'fs') == 'completed'
+
+
+def test_scan_entries(tmp_path):
+    (tmp_path / 'IMG_0002.jpeg').write_bytes(b'12345')
+    (tmp_path / 'IMG_0001.HEIC').write_bytes(b'1')
+    (tmp_path / 'fs.jpg').mkdir()
+    entries = scanner.scan_directory(str(tmp_path))
+    assert [(e.name, e.is_dir, e.is_image, e.size) for e in entries] == [
+        ('IMG_0001.HEIC', False, True, 1),
+        ('IMG_0002.jpeg', False, True, 5),
+        ('fs.jpg', True, False, 0),
+    ]
+
+
+def test_each_folder_listed_once_per_run(tmp_path):
+    (tmp_path / '!newstack').mkdir()
+    (tmp_path / '!newstack' / 'IMG_0001.JPG').write_bytes(b'')
+    scans = scanner.DirectoryScans()
+    with patch.object(scanner, 'scan_directory', wraps=scanner.scan_directory) as scan:
+        action, _ = determine_workflow_action(str(tmp_path), '!newstack', 'fs', scans)
+        get_folder_state(str(tmp_path / '!newstack'), 'fs', scans)
+    assert action == 'run_grouper'
+    assert sorted(call.args[0] for call in scan.call_args_list) == [
+        str(tmp_path),
+        str(tmp_path / '!newstack'),
+    ]
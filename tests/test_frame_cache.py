@@ -0,0 +1,103 @@
+"""
+Tests for the disk cache of decoded frames.
+"""
+
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import image_loader  # noqa: E402
+import native_stacker  # noqa: E402
+from frame_cache import FrameCache  # noqa: E402
+
+
+def frame_bytes(path):
+    return image_loader.load_image(path).nbytes
+
+
+def test_hit_is_read_only_memmap_of_decoded_frame(tmp_path, frame_files):
+    cache = FrameCache(str(tmp_path / 'cache'))
+    stored = cache.load(frame_files[0])
+    image_loader.reset_decode_counts()
+    hit = cache.load(frame_files[0])
+    assert isinstance(hit, np.memmap) and not hit.flags.writeable
+    assert np.array_equal(hit, image_loader.load_image(frame_files[0]))
+    assert np.array_equal(hit, stored)
+    assert image_loader.decode_counts() == {'full': 1}
+    assert tuple(cache.stats()) == (1, 1, 0)
+
+
+def test_entries_are_keyed_by_contents_and_decode_size(tmp_path, frame_files):
+    cache = FrameCache(str(tmp_path / 'cache'))
+    cache.load(frame_files[0])
+    copy = str(tmp_path / 'copy.jpg')
+    shutil.copy(frame_files[0], copy)
+    cache.load(copy)
+    assert cache.stats().hits == 1
+    assert cache.load(frame_files[0], 100).shape == (75, 100, 3)
+    assert cache.stats().misses == 2
+    shutil.copy(frame_files[1], copy)
+    assert np.array_equal(cache.load(copy), image_loader.load_image(frame_files[1]))
+    assert cache.stats().misses == 3
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, frame_files):
+    budget = 2 * frame_bytes(frame_files[0]) + 1024
+    cache = FrameCache(str(tmp_path / 'cache'), budget)
+    first, second, third = frame_files
+    cache.load(first)
+    time.sleep(0.01)
+    cache.load(second)
+    time.sleep(0.01)
+    cache.load(first)
+    time.sleep(0.01)
+    cache.load(third)
+    assert cache.stats() == (1, 3, 1)
+    assert cache.size() <= budget
+    assert cache.get(cache.content_key(second)) is None
+    assert cache.get(cache.content_key(first)) is not None
+
+
+def test_frame_over_budget_is_not_stored(tmp_path, frame_files):
+    cache = FrameCache(str(tmp_path / 'cache'), 1000)
+    image = cache.load(frame_files[0])
+    assert not isinstance(image, np.memmap)
+    assert cache.size() == 0
+
+
+def load_in_worker(folder, path):
+    cache = FrameCache(folder)
+    cache.load(path)
+    return tuple(cache.stats())
+
+
+def test_cache_is_shared_by_processes(tmp_path, frame_files):
+    folder = str(tmp_path / 'cache')
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        stats = list(pool.map(load_in_worker, [folder] * 3, frame_files))
+    assert stats == [(0, 1, 0)] * 3
+    cache = FrameCache(folder)
+    for path in frame_files:
+        cache.load(path)
+    assert cache.stats() == (3, 0, 0)
+
+
+def test_cached_restack_skips_decoding(tmp_path, frame_files):
+    options = native_stacker.StackOptions(cache_mb=64, cache_dir=str(tmp_path / 'cache'))
+    image_loader.reset_decode_counts()
+    first = native_stacker.stack_job(str(tmp_path / 'first'), frame_files, options)
+    assert image_loader.decode_counts() == {'full': len(frame_files)}
+    #  Re-run with another blending method
+    weighted = options._replace(method=native_stacker.METHOD_WEIGHTED)
+    second = native_stacker.stack_job(str(tmp_path / 'second'), frame_files, weighted)
+    assert image_loader.decode_counts() == {'full': len(frame_files)}
+    for result, method in ((first, native_stacker.METHOD_MAX), (second, native_stacker.METHOD_WEIGHTED)):
+        plain = native_stacker.stack_job(str(tmp_path / method), frame_files, native_stacker.StackOptions(method))
+        assert np.array_equal(image_loader.load_image(result.path), image_loader.load_image(plain.path))
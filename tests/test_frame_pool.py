@@ -0,0 +1,69 @@
+"""
+Tests for the shared-memory frame pool.
+"""
+
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import frame_pool  # noqa: E402
+
+
+def fill(handle, value):
+    """Worker: write `value` into every pixel of slot."""
+    frame_pool.write_frame(handle, np.full(handle.shape, value, dtype=np.uint8))
+    return handle
+
+
+def die(handle):
+    """Worker: crash while holding slot."""
+    os._exit(1)
+
+
+def test_workers_write_frames_through_handles():
+    with frame_pool.FramePool(2, 30 * 40 * 3) as pool, ProcessPoolExecutor(2) as executor:
+        handles = [pool.acquire((30, 40, 3)) for _ in range(2)]
+        #  Workers get names and layout only, never pixels
+        assert all(len(pickle.dumps(handle)) < 200 for handle in handles)
+        returned = list(executor.map(fill, handles, (5, 9)))
+        assert returned == handles
+        assert [int(pool.view(handle).mean()) for handle in handles] == [5, 9]
+
+
+def test_slots_are_recycled_from_free_list():
+    with frame_pool.FramePool(2, 100) as pool:
+        first = pool.acquire((10, 10))
+        second = pool.acquire((10,))
+        with pytest.raises(frame_pool.PoolExhaustedError):
+            pool.acquire((10,))
+        pool.release(first)
+        assert pool.acquire((5, 5)).name == first.name
+        with pytest.raises(ValueError):
+            pool.acquire((101,))
+        pool.release(second)
+        with pytest.raises(ValueError):
+            pool.release(second)
+        assert pool.free == 1
+
+
+def test_crashed_worker_leaks_no_slot():
+    pool = frame_pool.FramePool(1, 100)
+    handle = pool.acquire((100,))
+    with ProcessPoolExecutor(1) as executor:
+        with pytest.raises(BrokenProcessPool):
+            executor.submit(die, handle).result()
+    pool.release(handle)
+    assert pool.acquire((100,)).name == handle.name
+    pool.close()
+    #  Segments are unlinked, leased or not
+    with pytest.raises(FileNotFoundError):
+        with frame_pool.open_frame(handle):
+            pass
@@ -0,0 +1,320 @@
+"""
+Tests for grouper.py library functions on the sample photo archives in test/.
+"""
+
+import contextlib
+import errno
+import functools
+import io
+import os
+import random
+import shutil
+import sqlite3
+import sys
+from array import array
+from datetime import datetime, timedelta
+from zipfile import ZipFile
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import grouper  # noqa: E402
+import journal  # noqa: E402
+import manifest  # noqa: E402
+import vector_grouper  # noqa: E402
+from folder_manager import get_folder_state  # noqa: E402
+from metadata_cache import CacheKey, MetadataCache  # noqa: E402
+from photo_model import PhotoRecord, PhotoTable, Stack, to_seconds  # noqa: E402
+
+
+def extract(archive: str, folder: str) -> str:
+    """Unpack test/<archive>.zip into folder and return the folder."""
+    with ZipFile(os.path.join(ROOT_DIR, 'test', f'{archive}.zip'), 'r') as myzip:
+        myzip.extractall(folder)
+    return folder
+
+
+def rows(table: PhotoTable) -> list:
+    """Table contents as comparable tuples."""
+    return [(r.name, r.size, r.timestamp, r.subsec, r.camera) for r in table]
+
+
+def synthetic_table(dates: list) -> PhotoTable:
+    table = PhotoTable('/photos')
+    for i, date in enumerate(dates):
+        table.append(PhotoRecord(f'IMG_{i:05}.JPG', '', 0, to_seconds(date)))
+    return table
+
+
+@pytest.fixture
+def photos_97(tmp_path):
+    return extract('test_97f', str(tmp_path / 'photos'))
+
+
+@pytest.mark.parametrize('workers, use_processes', [(4, False), (2, True)])
+def test_read_jpg_concurrent_matches_sequential(photos_97, workers, use_processes):
+    broken = os.path.join(photos_97, 'IMG_0000.JPG')
+    with open(broken, 'wb') as f:
+        f.write(b'not a jpeg')
+    shutil.copy(os.path.join(ROOT_DIR, 'README.md'), os.path.join(photos_97, 'IMG_0001.png'))
+
+    sequential_out, concurrent_out = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(sequential_out):
+        expected = grouper.read_jpg(photos_97)
+    with contextlib.redirect_stdout(concurrent_out):
+        result = grouper.read_jpg(photos_97, workers, use_processes)
+
+    assert rows(result) == rows(expected)
+    assert len(result) == 97
+    assert concurrent_out.getvalue() == sequential_out.getvalue()
+    assert 'Skipped 2 files' in concurrent_out.getvalue()
+
+
+def test_metadata_cache_serves_unchanged_files(photos_97, tmp_path, monkeypatch):
+    cache_path = str(tmp_path / 'cache.sqlite')
+    with contextlib.redirect_stdout(io.StringIO()):
+        with MetadataCache(cache_path) as cache:
+            expected = grouper.read_jpg(photos_97, cache=cache)
+        assert cache.misses == 97
+
+        touched = os.path.join(photos_97, expected.names[0])
+        os.utime(touched, ns=(0, 0))
+
+        def read_header(file_path):
+            assert file_path == touched, 'unchanged file was read again'
+            return grouper.read_exif_header(file_path)
+
+        monkeypatch.setattr(grouper, 'read_header', read_header)
+        with MetadataCache(cache_path) as cache:
+            assert rows(grouper.read_jpg(photos_97, cache=cache)) == rows(expected)
+        assert (cache.hits, cache.misses) == (96, 1)
+
+
+def test_metadata_cache_eviction(tmp_path):
+    header = grouper.ExifHeader('2023:12:02 13:30:39', None, None, None, None, None, None, 0)
+    cache_path = str(tmp_path / 'cache.sqlite')
+    with MetadataCache(cache_path, max_entries=3) as cache:
+        for i in range(5):
+            cache.store(CacheKey(str(tmp_path / f'{i}.jpg'), i, i), header)
+    with MetadataCache(cache_path, max_entries=3) as cache:
+        found = cache.lookup([CacheKey(str(tmp_path / f'{i}.jpg'), i, i) for i in range(5)])
+    assert sum(entry is not None for entry in found) == 3
+
+
+def test_iter_stacks_matches_get_stacks_on_shuffled_input(photos_97):
+    with contextlib.redirect_stdout(io.StringIO()):
+        table = grouper.read_jpg(photos_97)
+        expected = grouper.get_stacks(table)
+        photos = list(table)
+        # Swap neighbours: files read by name are out of time order by one position
+        for i in range(0, len(photos) - 1, 2):
+            photos[i], photos[i + 1] = photos[i + 1], photos[i]
+        stack_stat = {}
+        late = []
+        streamed = PhotoTable(photos_97)
+        result = list(grouper.iter_stacks(iter(photos), streamed, stack_stat, 4, late))
+    assert result == expected
+    assert late == []
+    assert sum(stack_stat.values()) == len(expected) == 9
+
+
+def test_iter_stacks_yields_before_input_ends():
+    start = datetime(2023, 12, 2, 13, 0, 0)
+    consumed = []
+
+    def photos():
+        for i in range(100):
+            consumed.append(i)
+            date = start + timedelta(seconds=i if i < 5 else 100 + i)
+            yield PhotoRecord(f'IMG_{i:04}.JPG', '', 0, to_seconds(date))
+
+    first = next(grouper.iter_stacks(photos(), PhotoTable('/photos'), {}, reorder_window=2))
+    assert first == [f'IMG_{i:04}.JPG' for i in range(5)]
+    assert len(consumed) < 10
+
+
+def test_vectorized_engine_matches_python_engine():
+    rng = random.Random(5)
+    start = datetime(2023, 12, 2, 13, 0, 0)
+    dates, moment = [], start
+    for _ in range(5000):
+        moment += timedelta(seconds=rng.choice([0, 1, 1, 2, 2, 3, 30]))
+        dates.append(moment)
+    table = synthetic_table(dates)
+    python_out, numpy_out = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(python_out):
+        expected = grouper.get_stacks(table)
+    with contextlib.redirect_stdout(numpy_out):
+        result = grouper.get_stacks_vectorized(table)
+    assert [(s.start, s.end) for s in result] == [(s.start, s.end) for s in expected]
+    assert numpy_out.getvalue() == python_out.getvalue()
+
+
+def test_vectorized_grouping_takes_plain_lists():
+    names = [f'IMG_{i:04}.JPG' for i in range(6)]
+    seconds = [0, 1, 2, 60, 61, 62]
+    ranges, stat = vector_grouper.group(names, seconds, 5, 3, 10)
+    buffer_ranges, _ = vector_grouper.group(names, array('q', seconds), 5, 3, 10)
+    assert ranges.starts.tolist() == buffer_ranges.starts.tolist() == [0, 3]
+    assert ranges.ends.tolist() == [3, 6] and stat == {3: 2}
+
+
+def test_stack_is_view_of_table_rows():
+    start = datetime(2023, 12, 2, 13, 0, 0)
+    table = synthetic_table([start + timedelta(seconds=i) for i in range(8)])
+    stack = Stack(table, 2, 7)
+    assert len(stack) == 5
+    assert stack == [f'IMG_{i:05}.JPG' for i in range(2, 7)]
+    assert (stack[0], stack[-1]) == ('IMG_00002.JPG', 'IMG_00006.JPG')
+    assert [r.datetime for r in stack.records()] == [
+        start + timedelta(seconds=i) for i in range(2, 7)
+    ]
+    assert grouper.stack_dirname(stack) == 'IMG_00002_to_IMG_00006'
+
+
+def test_run_grouping_returns_result(photos_97):
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = grouper.run_grouping(photos_97, cache_mode=grouper.CACHE_OFF)
+    assert len(result.stacks) == len(result.stack_paths) == 9
+    assert result.file_count == 64
+    assert sum(result.stack_stat.values()) == 9
+    assert all(os.path.isdir(path) for path in result.stack_paths)
+    assert set(result.timings) == {'read', 'group', 'move', 'total'}
+
+
+def test_cache_that_cant_be_saved_does_not_fail_grouping(photos_97, tmp_path, monkeypatch):
+    def full_disk(cache):
+        raise sqlite3.OperationalError('database or disk is full')
+
+    monkeypatch.setattr(MetadataCache, 'flush', full_disk)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        result = grouper.run_grouping(photos_97, cache_path=str(tmp_path / 'cache.sqlite'))
+    assert len(result.stacks) == 9
+    assert 'Metadata cache could not be saved (database or disk is full)' in out.getvalue()
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_run_grouping_raises_typed_errors(tmp_path, stream):
+    folder = tmp_path / 'photos'
+    folder.mkdir()
+    run = functools.partial(grouper.run_grouping, str(folder), cache_mode=grouper.CACHE_OFF, stream=stream)
+    with contextlib.redirect_stdout(io.StringIO()):
+        with pytest.raises(grouper.NoImageFilesError):
+            run()
+        (folder / 'IMG_0001.JPG').write_bytes(b'not a jpeg')
+        with pytest.raises(grouper.NoValidTimestampsError):
+            run()
+        extract('test_no_st', str(folder))
+        with pytest.raises(grouper.NoStacksError) as error:
+            run()
+        assert error.value.exit_code == 2
+        (folder / grouper.FOLDER_NAME_ROOT).mkdir()
+        with pytest.raises(grouper.FolderExistsError):
+            run()
+
+
+def tree(folder: str) -> list:
+    return sorted(
+        os.path.relpath(os.path.join(root, name), folder)
+        for root, dirs, files in os.walk(folder)
+        for name in dirs + files
+    )
+
+
+def interrupt_after(monkeypatch, moves: int) -> None:
+    """Make the move number `moves` fail, as if the disk was unplugged."""
+    rename = os.rename
+    count = 0
+
+    def failing(src, dst):
+        nonlocal count
+        count += 1
+        if count == moves:
+            raise OSError(errno.EIO, 'Disk unplugged', src)
+        rename(src, dst)
+
+    monkeypatch.setattr(os, 'rename', failing)
+
+
+@pytest.fixture
+def grouped_97(tmp_path):
+    folder = extract('test_97f', str(tmp_path / 'expected'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        grouper.run_grouping(folder, cache_mode=grouper.CACHE_OFF)
+    return tree(folder)
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_interrupted_move_resumes_from_journal(photos_97, grouped_97, monkeypatch, stream):
+    monkeypatch.setattr(journal, 'COMMIT_BATCH', 8)
+    run = functools.partial(grouper.run_grouping, photos_97, cache_mode=grouper.CACHE_OFF, stream=stream)
+    with contextlib.redirect_stdout(io.StringIO()):
+        with monkeypatch.context() as patch:
+            interrupt_after(patch, 30)
+            with pytest.raises(grouper.MoveError):
+                run()
+        assert get_folder_state(photos_97, grouper.FOLDER_NAME_ROOT) == 'interrupted'
+        state = journal.read_journal(photos_97)
+        assert state.committed == 24
+        if not stream:
+            # Whole plan is in the journal: resuming reads no EXIF
+            monkeypatch.setattr(grouper, 'read_header', None)
+        result = run()
+    assert len(result.stacks) == 9
+    assert tree(photos_97) == grouped_97
+    assert get_folder_state(photos_97, grouper.FOLDER_NAME_ROOT) == 'stacking_incomplete'
+
+
+def test_interrupted_move_rolls_back(photos_97, monkeypatch):
+    original = tree(photos_97)
+    with contextlib.redirect_stdout(io.StringIO()):
+        interrupt_after(monkeypatch, 30)
+        with pytest.raises(grouper.MoveError):
+            grouper.run_grouping(photos_97, cache_mode=grouper.CACHE_OFF)
+        monkeypatch.undo()
+        assert grouper.rollback_moves(photos_97) == 29
+        with pytest.raises(grouper.GroupingError):
+            grouper.rollback_moves(photos_97)
+    assert tree(photos_97) == original
+
+
+@pytest.mark.parametrize('mode', [grouper.MODE_HARDLINK, grouper.MODE_SYMLINK])
+def test_link_modes_build_tree_in_place(photos_97, grouped_97, mode):
+    original = tree(photos_97)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = grouper.run_grouping(photos_97, cache_mode=grouper.CACHE_OFF, mode=mode)
+    assert len(result.stack_paths) == 9
+    # Same 'fs' tree as after moving, every photo still in place
+    fs_tree = [path for path in tree(photos_97) if path.startswith(grouper.FOLDER_NAME_ROOT)]
+    assert fs_tree == [path for path in grouped_97 if path.startswith(grouper.FOLDER_NAME_ROOT)]
+    assert set(original) <= set(tree(photos_97))
+    link = os.path.join(result.stack_paths[0], result.stacks[0][0])
+    assert os.path.samefile(link, os.path.join(photos_97, result.stacks[0][0]))
+    assert os.path.islink(link) == (mode == grouper.MODE_SYMLINK)
+    assert get_folder_state(photos_97, grouper.FOLDER_NAME_ROOT) == 'stacking_incomplete'
+
+
+def test_unknown_mode_moves_nothing(photos_97):
+    original = tree(photos_97)
+    with pytest.raises(ValueError, match='symlinks'):
+        grouper.run_grouping(photos_97, cache_mode=grouper.CACHE_OFF, mode='symlinks')
+    assert tree(photos_97) == original
+
+
+def test_manifest_mode_moves_nothing(photos_97):
+    original = tree(photos_97)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = grouper.run_grouping(photos_97, cache_mode=grouper.CACHE_OFF, mode=grouper.MODE_MANIFEST)
+        path = manifest.manifest_path(photos_97, grouper.FOLDER_NAME_ROOT)
+        assert tree(photos_97) == sorted(original + [os.path.basename(path)])
+        mode, stacks = manifest.read_manifest(path)
+        assert mode == grouper.MODE_MANIFEST
+        assert [stack.files for stack in stacks] == [list(stack) for stack in result.stacks]
+        assert stacks[0].id == grouper.stack_dirname(result.stacks[0])
+        assert stacks[0].start <= stacks[0].end
+        assert get_folder_state(photos_97, grouper.FOLDER_NAME_ROOT) == 'stacking_incomplete'
+        with pytest.raises(grouper.FolderExistsError):
+            grouper.run_grouping(photos_97, cache_mode=grouper.CACHE_OFF)
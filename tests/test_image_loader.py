@@ -0,0 +1,95 @@
+"""
+Tests for reduced-resolution decoding and decode counters of the image loader.
+"""
+
+import io
+import os
+import struct
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import image_loader  # noqa: E402
+import native_stacker  # noqa: E402
+
+
+def gradient(height: int = 1200, width: int = 1600) -> np.ndarray:
+    ys, xs = np.mgrid[0:height, 0:width]
+    return np.stack([xs * 255 // width, ys * 255 // height, (xs + ys) % 256], axis=-1).astype(np.uint8)
+
+
+def exif_with_thumbnail(thumbnail: np.ndarray, orientation: int = 1) -> bytes:
+    """EXIF block with Orientation in IFD0 and a JPEG thumbnail in IFD1."""
+    data = io.BytesIO()
+    Image.fromarray(thumbnail).save(data, 'JPEG')
+    jpeg = data.getvalue()
+    tiff = b'II*\x00' + struct.pack('<I', 8)
+    tiff += struct.pack('<H', 1) + struct.pack('<HHIHH', 0x0112, 3, 1, orientation, 0) + struct.pack('<I', 26)
+    tiff += struct.pack('<H', 2) + struct.pack('<HHII', 0x0201, 4, 1, 56)
+    tiff += struct.pack('<HHII', 0x0202, 4, 1, len(jpeg))
+    tiff += struct.pack('<I', 0) + jpeg
+    return b'Exif\x00\x00' + tiff
+
+
+@pytest.fixture(autouse=True)
+def counts():
+    image_loader.reset_decode_counts()
+    yield
+    image_loader.reset_decode_counts()
+
+
+def test_draft_decoding_scales_dct(tmp_path):
+    path = str(tmp_path / 'IMG_0001.JPG')
+    image_loader.save_jpeg(path, gradient())
+    reduced = image_loader.load_image(path, 400)
+    assert reduced.shape == (300, 400, 3)
+    full = image_loader.load_image(path)
+    assert np.abs(reduced.astype(int) - full[2::4, 2::4]).mean() < 4
+    assert image_loader.decode_counts() == {'1/4': 1, 'full': 1}
+
+
+def test_draft_is_reduced_to_fit_max_size(tmp_path):
+    path = str(tmp_path / 'IMG_0001.JPG')
+    image_loader.save_jpeg(path, gradient())
+    assert max(image_loader.load_image(path, 500).shape) == 500
+    assert image_loader.decode_counts() == {'1/2': 1}
+
+
+def test_exif_thumbnail_is_used_when_large_enough(tmp_path):
+    path = str(tmp_path / 'IMG_0001.JPG')
+    frame = gradient()
+    thumbnail = frame[::5, ::5]
+    #  Stored rotated, shown upright
+    image_loader.save_jpeg(path, frame, exif_with_thumbnail(thumbnail, orientation=6))
+    image = image_loader.load_image(path, 200)
+    assert image.shape == (200, 150, 3)
+    assert image_loader.image_shape(path) == (1600, 1200, 3)
+    assert image_loader.decode_counts() == {'thumbnail': 1}
+    #  Thumbnail smaller than asked for: draft decoding
+    assert image_loader.load_image(path, 600).shape == (600, 450, 3)
+    assert image_loader.decode_counts() == {'thumbnail': 1, '1/2': 1}
+
+
+def test_letterboxed_thumbnail_is_not_used(tmp_path):
+    path = str(tmp_path / 'IMG_0001.JPG')
+    image_loader.save_jpeg(path, gradient(), exif_with_thumbnail(np.zeros((120, 120, 3), np.uint8)))
+    assert image_loader.load_image(path, 100).shape == (75, 100, 3)
+    assert 'thumbnail' not in image_loader.decode_counts()
+
+
+def test_non_jpeg_is_decoded_in_full_and_reduced(tmp_path):
+    path = str(tmp_path / 'IMG_0001.PNG')
+    Image.fromarray(gradient(120, 160)).save(path)
+    assert image_loader.load_image(path, 80).shape == (60, 80, 3)
+    assert image_loader.decode_counts() == {'full': 1}
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_stacking_decodes_every_frame_in_full_once(tmp_path, frame_files, streaming):
+    native_stacker.stack_files(frame_files, str(tmp_path), streaming=streaming)
+    assert image_loader.decode_counts() == {'full': len(frame_files)}
@@ -0,0 +1,93 @@
+"""
+Tests for incremental re-stacking of stacks that gained frames.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import image_loader  # noqa: E402
+import incremental  # noqa: E402
+import native_stacker  # noqa: E402
+
+
+def stack(paths, out_folder, method=native_stacker.METHOD_MAX):
+    image_loader.reset_decode_counts()
+    result = incremental.stack_files(paths, str(out_folder), method)
+    return result, image_loader.decode_counts().get('full', 0)
+
+
+def full_stack(paths, out_folder, method=native_stacker.METHOD_MAX):
+    os.makedirs(out_folder, exist_ok=True)
+    result = native_stacker.stack_files(paths, str(out_folder), method, streaming=True)
+    return image_loader.load_image(result.path)
+
+
+@pytest.mark.parametrize('method', native_stacker.METHODS)
+def test_appended_frame_is_the_only_one_decoded(tmp_path, frame_files, method):
+    out = tmp_path / 'fs'
+    out.mkdir()
+    _, decoded = stack(frame_files[:2], out, method)
+    assert decoded == 2
+    result, decoded = stack(frame_files, out, method)
+    assert decoded == 1
+    assert np.array_equal(image_loader.load_image(result.path), full_stack(frame_files, tmp_path / 'full', method))
+    #  Result of the stack before it grew is replaced, and so is its state
+    assert sorted(os.listdir(out)) == [incremental.STATE_FOLDER_NAME, 'IMG_0003_fs.jpg']
+    assert len(incremental.read_states(incremental.state_root(str(out)))) == 1
+
+
+def test_unchanged_stack_is_saved_from_its_state(tmp_path, frame_files):
+    first, _ = stack(frame_files, tmp_path)
+    expected = image_loader.load_image(first.path)
+    os.remove(first.path)
+    again, decoded = stack(frame_files, tmp_path)
+    assert decoded == 0
+    assert np.array_equal(image_loader.load_image(again.path), expected)
+    assert again.transforms == first.transforms and again.crop == first.crop
+
+
+def test_prepended_frame_is_aligned_to_the_stored_first_frame(tmp_path, frame_files, scene):
+    stack(frame_files[1:], tmp_path)
+    result, decoded = stack(frame_files, tmp_path)
+    assert decoded == 1
+    #  Transforms are from the frame stacked first: the second one here
+    assert result.transforms[1] == native_stacker.aligner.Transform()
+    assert result.transforms[0].ty == pytest.approx(3, abs=0.3)
+    assert result.transforms[0].tx == pytest.approx(-2, abs=0.3)
+    #  As sharp as a full restack, in the coordinates of the second frame
+    top, bottom, left, right = result.crop
+    sharp = native_stacker.aligner.warp(scene(), native_stacker.aligner.Transform(tx=-2, ty=3))[0]
+    error = np.abs(image_loader.load_image(result.path) - sharp[top:bottom, left:right].astype(np.float32)).mean()
+    os.makedirs(tmp_path / 'full')
+    full = native_stacker.stack_files(frame_files, str(tmp_path / 'full'), streaming=True)
+    top, bottom, left, right = full.crop
+    expected = np.abs(image_loader.load_image(full.path) - scene()[top:bottom, left:right].astype(np.float32)).mean()
+    assert error < expected + 1
+    assert os.path.basename(result.path) == 'IMG_0003_fs.jpg'
+
+
+def test_edited_member_or_other_method_stacks_everything(tmp_path, frame_files):
+    stack(frame_files[:2], tmp_path)
+    stat = os.stat(frame_files[0])
+    os.utime(frame_files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    _, decoded = stack(frame_files, tmp_path)
+    assert decoded == 3
+    _, decoded = stack(frame_files, tmp_path, native_stacker.METHOD_WEIGHTED)
+    assert decoded == 3
+    #  State of the other method is replaced
+    assert len(incremental.read_states(incremental.state_root(str(tmp_path)))) == 1
+
+
+def test_stack_job_stacks_incrementally(tmp_path, frame_files):
+    options = native_stacker.StackOptions(incremental=True, prefetch=4)
+    assert native_stacker.run_prefetcher([(str(tmp_path), frame_files)], options) is None
+    native_stacker.stack_job(str(tmp_path), frame_files[:2], options)
+    image_loader.reset_decode_counts()
+    native_stacker.stack_job(str(tmp_path), frame_files, options)
+    assert image_loader.decode_counts() == {'full': 1}
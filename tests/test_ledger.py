@@ -0,0 +1,97 @@
+"""
+Tests for the results ledger skipping stacks already stacked on re-run.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import ledger  # noqa: E402
+import runner  # noqa: E402
+import scheduler  # noqa: E402
+from image_loader import save_jpeg  # noqa: E402
+from manifest import find_jobs, read_jobs  # noqa: E402
+
+SETTINGS = {'profile': 'batch/max'}
+
+
+def write_results(jobs):
+    for out_folder, files in jobs:
+        with open(ledger.result_path(out_folder, files), 'wb') as f:
+            f.write(b'result')
+
+
+def test_only_changed_or_missing_stacks_are_pending(grouped):
+    jobs = find_jobs(str(grouped))
+    results = ledger.Ledger(ledger.ledger_path(str(grouped)))
+    assert results.pending(jobs, ledger.BACKEND_NATIVE, SETTINGS) == jobs
+    write_results(jobs)
+    for job in jobs:
+        results.record(job, ledger.BACKEND_NATIVE, SETTINGS)
+    results.save()
+
+    results = ledger.Ledger(ledger.ledger_path(str(grouped)))
+    assert results.pending(jobs, ledger.BACKEND_NATIVE, SETTINGS) == []
+    #  Other settings or backend: everything again
+    assert results.pending(jobs, ledger.BACKEND_NATIVE, {'profile': 'batch/pyramid'}) == jobs
+    assert results.pending(jobs, ledger.BACKEND_PHOTOSHOP, SETTINGS) == jobs
+    #  Member edited, result deleted
+    member = jobs[0][1][1]
+    stat = os.stat(member)
+    os.utime(member, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    os.remove(ledger.result_path(*jobs[2]))
+    assert results.pending(jobs, ledger.BACKEND_NATIVE, SETTINGS) == [jobs[0], jobs[2]]
+
+
+def test_unreadable_ledger_is_empty(grouped):
+    path = ledger.ledger_path(str(grouped))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"version": 1, "stac')
+    jobs = find_jobs(str(grouped))
+    assert ledger.Ledger(path).pending(jobs, ledger.BACKEND_NATIVE, SETTINGS) == jobs
+
+
+def test_native_rerun_stacks_only_changed_stacks(grouped, scene, bracket):
+    with contextlib.redirect_stdout(io.StringIO()):
+        first = scheduler.schedule(str(grouped), workers=1)
+        second = scheduler.schedule(str(grouped), workers=1)
+    assert len(first.outcomes) == 3 and second.outcomes == []
+    #  A frame replaced in the middle stack
+    stack = sorted(p for p in grouped.iterdir() if p.is_dir())[1]
+    save_jpeg(str(stack / 'IMG_0005.JPG'), bracket(scene(120, 160))[0])
+    with contextlib.redirect_stdout(io.StringIO()):
+        third = scheduler.schedule(str(grouped), workers=1)
+        forced = scheduler.schedule(str(grouped), workers=1, skip_done=False)
+    assert [outcome.name for outcome in third.outcomes] == ['IMG_0006']
+    assert len(forced.outcomes) == 3
+
+
+def test_photoshop_gets_job_list_of_pending_stacks(grouped, tmp_path, monkeypatch):
+    script = tmp_path / 'stacker.js'
+    script.write_text('// stacker')
+    calls = []
+
+    def crashing_script(stacker, path, photoshop_app):
+        #  Photoshop stacks the first two stacks of the list, then crashes
+        jobs = read_jobs(path)
+        calls.append(jobs)
+        write_results(jobs[:2])
+        return False
+
+    monkeypatch.setattr(runner, 'run_photoshop_script', crashing_script)
+    jobs = find_jobs(str(grouped))
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert not runner.run_photoshop_stacks(str(script), str(grouped), 'Photoshop')
+        assert not runner.run_photoshop_stacks(str(script), str(grouped), 'Photoshop')
+    assert calls == [jobs, jobs[2:]]
+    #  Edited script stacks everything again
+    time.sleep(0.01)
+    script.write_text('// stacker, edited')
+    with contextlib.redirect_stdout(io.StringIO()):
+        runner.run_photoshop_stacks(str(script), str(grouped), 'Photoshop')
+    assert calls[-1] == jobs
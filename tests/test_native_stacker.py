@@ -0,0 +1,91 @@
+"""
+Tests for the native NumPy focus stacking backend on synthetic focus brackets.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tracemalloc
+
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import aligner  # noqa: E402
+import native_stacker  # noqa: E402
+from image_loader import load_image, save_jpeg  # noqa: E402
+
+
+def test_frames_are_aligned_and_cropped(scene, bracket, shifts):
+    _, transforms, crop = native_stacker.stack_images(bracket(scene()))
+    #  First frame pixel p is pixel p - (dy, dx) of the others. Sharp and blurred
+    #  bands differ, so subpixel estimates are off by a fraction of a pixel
+    assert [(-t.ty, -t.tx) for t in transforms] == [pytest.approx(shift, abs=0.25) for shift in shifts]
+    assert np.abs(np.subtract(crop, (5, 240, 1, 318))).max() <= 1
+
+
+@pytest.mark.parametrize('method', native_stacker.METHODS)
+def test_stack_is_sharp_everywhere(method, scene, bracket):
+    sharp = scene()
+    merged, _, (top, bottom, left, right) = native_stacker.stack_images(bracket(sharp), method)
+    error = np.abs(merged.astype(int) - sharp[top:bottom, left:right].astype(int))
+    #  Band borders mix frames within the focus measure radius, subpixel warps
+    #  resample the texture, pyramid collapse rounds every pixel a little
+    assert np.median(error) <= (1 if method == native_stacker.METHOD_PYRAMID else 0)
+    assert error.mean() < (4 if method != native_stacker.METHOD_WEIGHTED else 12)
+
+
+@pytest.mark.parametrize('method', native_stacker.METHODS)
+def test_streaming_matches_batch(method, scene, bracket):
+    frames = bracket(scene())
+    batch, batch_transforms, batch_crop = native_stacker.stack_images(frames, method)
+    merged, transforms, crop = native_stacker.stack_stream(iter(frames), method)
+    assert transforms == batch_transforms and crop == batch_crop
+    #  Focus measures differ within their radius of the crop border, pyramid
+    #  levels reach further
+    error = np.abs(merged.astype(int) - batch)
+    assert error.mean() < (1 if method == native_stacker.METHOD_PYRAMID else 0.5)
+
+
+def test_streaming_source_index_map(scene, bracket, shifts):
+    accumulator = native_stacker.StackAccumulator((240, 320, 3))
+    frames = bracket(scene())
+    for frame in frames:
+        #  Frames are already shifted: blend them unaligned, every band has its frame
+        accumulator.add(frame)
+    bands = np.array_split(np.arange(240), len(shifts))
+    for index, band in enumerate(bands):
+        assert np.median(accumulator.index[band[10:-10], 10:-10]) == index
+
+
+def test_streaming_memory_does_not_grow_with_stack_length(scene):
+    sharp = scene(480, 640)
+
+    def peak(count: int) -> int:
+        def frames():
+            for i in range(count):
+                yield aligner.warp(sharp, aligner.Transform(tx=i % 3, ty=i % 2))[0]
+
+        tracemalloc.start()
+        native_stacker.stack_stream(frames())
+        size = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return size
+
+    assert peak(12) < 1.1 * peak(3)
+
+
+def test_grouped_folder_is_stacked_like_photoshop_step(tmp_path, scene, bracket):
+    stack_folder = tmp_path / 'fs' / 'IMG_0001_to_IMG_0003'
+    stack_folder.mkdir(parents=True)
+    for i, frame in enumerate(bracket(scene()), 1):
+        save_jpeg(str(stack_folder / f'IMG_000{i}.JPG'), frame)
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = native_stacker.stack_all(str(tmp_path / 'fs'))
+    assert [os.path.basename(r.path) for r in results] == ['IMG_0003_fs.jpg']
+    assert os.path.dirname(results[0].path) == str(tmp_path / 'fs')
+    top, bottom, left, right = results[0].crop
+    assert load_image(results[0].path).shape == (bottom - top, right - left, 3)
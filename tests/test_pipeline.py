@@ -0,0 +1,34 @@
+"""
+Tests for the stacking pipeline decoding frames in worker processes.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import native_stacker  # noqa: E402
+import pipeline  # noqa: E402
+from image_loader import load_image  # noqa: E402
+
+#  Six frames: the bracket twice
+pytestmark = pytest.mark.parametrize('frame_files', [{'copies': 2}], indirect=True)
+
+
+@pytest.mark.parametrize('decoders', [1, 3])
+def test_pipeline_matches_streaming(frame_files, decoders):
+    expected, transforms, crop = native_stacker.stack_stream(load_image(path) for path in frame_files)
+    merged, pipeline_transforms, pipeline_crop = pipeline.stack_pipelined(frame_files, decoders=decoders)
+    assert np.array_equal(merged, expected)
+    assert pipeline_transforms == transforms and pipeline_crop == crop
+
+
+def test_bad_frame_fails_stack(frame_files):
+    with open(frame_files[3], 'wb') as f:
+        f.write(b'not a jpeg')
+    with pytest.raises(OSError):
+        pipeline.stack_pipelined(frame_files, decoders=2)
@@ -0,0 +1,130 @@
+"""
+Tests for read-ahead decoding of frames.
+"""
+
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import native_stacker  # noqa: E402
+from image_loader import load_image  # noqa: E402
+from prefetcher import Prefetcher  # noqa: E402
+
+#  Six frames: the bracket twice
+pytestmark = pytest.mark.parametrize('frame_files', [{'copies': 2}], indirect=True)
+
+
+class RecordingLoader:
+    """Loader recording decoded paths, taking `delay` seconds per frame."""
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.decoded = []
+        self._lock = threading.Lock()
+
+    def __call__(self, path):
+        time.sleep(self.delay)
+        with self._lock:
+            self.decoded.append(path)
+        return load_image(path)
+
+
+def wait_decoded(loader, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while len(loader.decoded) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_frames_are_decoded_ahead_up_to_depth(frame_files):
+    loader = RecordingLoader()
+    with Prefetcher(frame_files, depth=2, loader=loader) as prefetcher:
+        wait_decoded(loader, 2)
+        time.sleep(0.05)
+        assert loader.decoded == frame_files[:2]
+        for path in frame_files:
+            assert np.array_equal(prefetcher.take(path), load_image(path))
+        timings = prefetcher.timings()
+    assert sorted(loader.decoded) == frame_files
+    assert timings.frames == len(frame_files)
+    assert timings.prefetched == len(frame_files)
+
+
+def test_prefetch_stops_at_memory_budget(frame_files):
+    loader = RecordingLoader()
+    frame_bytes = load_image(frame_files[0]).nbytes
+    with Prefetcher(frame_files, depth=8, memory_budget=2 * frame_bytes + 1, loader=loader) as prefetcher:
+        wait_decoded(loader, 2)
+        time.sleep(0.05)
+        assert len(loader.decoded) == 2
+        prefetcher.take(frame_files[0])
+        wait_decoded(loader, 3)
+        assert len(loader.decoded) == 3
+
+
+def test_skipped_frames_are_dropped(frame_files):
+    loader = RecordingLoader(0.02)
+    with Prefetcher(frame_files, depth=2, loader=loader) as prefetcher:
+        #  Stack of the first three frames given up after its first frame
+        prefetcher.take(frame_files[0])
+        image = prefetcher.take(frame_files[3])
+        assert np.array_equal(image, load_image(frame_files[3]))
+        for path in frame_files[4:]:
+            prefetcher.take(path)
+        assert prefetcher.timings().frames == len(frame_files) - 2
+
+
+def test_frame_out_of_order_is_decoded_in_line(frame_files):
+    with Prefetcher(frame_files[:2], depth=1) as prefetcher:
+        image = prefetcher.take(frame_files[4])
+        timings = prefetcher.timings()
+    assert np.array_equal(image, load_image(frame_files[4]))
+    assert timings.frames == 1 and timings.prefetched == 0
+
+
+def test_unreadable_frame_fails_take(frame_files):
+    with open(frame_files[1], 'wb') as f:
+        f.write(b'not a jpeg')
+    with Prefetcher(frame_files, depth=3) as prefetcher:
+        prefetcher.take(frame_files[0])
+        with pytest.raises(OSError):
+            prefetcher.take(frame_files[1])
+        assert prefetcher.take(frame_files[2]).shape == load_image(frame_files[2]).shape
+
+
+def test_timings_show_decoding_overlapped_with_stacking(frame_files):
+    loader = RecordingLoader(0.05)
+    with Prefetcher(frame_files, depth=4, threads=2, loader=loader) as prefetcher:
+        for path in frame_files:
+            prefetcher.take(path)
+            #  Stacking of the frame
+            time.sleep(0.05)
+        timings = prefetcher.timings()
+    assert timings.decode >= 0.05 * len(frame_files)
+    assert timings.wait < timings.decode / 2
+    assert timings.overlapped > timings.decode / 2
+    assert 'overlapped' in timings.describe()
+
+
+def test_prefetched_stacks_match_plain_ones(tmp_path, frame_files):
+    first, second = tmp_path / 'fs' / 'first', tmp_path / 'fs' / 'second'
+    for folder, paths in ((first, frame_files[:3]), (second, frame_files[3:])):
+        folder.mkdir(parents=True)
+        for path in paths:
+            os.replace(path, folder / os.path.basename(path))
+    plain = tmp_path / 'plain'
+    plain.mkdir()
+    expected = [
+        load_image(native_stacker.stack_files(sorted(str(p) for p in folder.iterdir()), str(plain)).path)
+        for folder in (first, second)
+    ]
+    results = native_stacker.stack_all(str(tmp_path / 'fs'), prefetch=4, prefetch_mb=64)
+    assert [np.array_equal(load_image(result.path), image) for result, image in zip(results, expected)] == [True] * 2
+    assert all(result.stages is not None for result in results)
+    assert sum(result.stages.frames for result in results) == len(frame_files)
@@ -0,0 +1,64 @@
+"""
+Tests for runner.py calling the grouper in-process.
+"""
+
+import os
+import sys
+from zipfile import ZipFile
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import runner  # noqa: E402
+from scanner import DirectoryScans  # noqa: E402
+
+
+def extract(archive: str, folder: str) -> str:
+    with ZipFile(os.path.join(ROOT_DIR, 'test', f'{archive}.zip'), 'r') as myzip:
+        myzip.extractall(folder)
+    return folder
+
+
+def test_run_grouper_statuses(tmp_path, capsys):
+    empty = tmp_path / 'empty'
+    empty.mkdir()
+    assert runner.run_grouper(str(empty), cache_mode='off') == 'no_files'
+    assert runner.run_grouper(str(tmp_path / 'missing'), cache_mode='off') == 'error'
+    no_stacks = extract('test_no_st', str(tmp_path / 'no_stacks'))
+    assert runner.run_grouper(no_stacks, cache_mode='off') == 'no_groups'
+
+    photos = extract('test_97f', str(tmp_path / 'photos'))
+    scans = DirectoryScans()
+    assert runner.run_grouper(photos, cache_mode='off', scans=scans) == 'success'
+    assert runner.run_grouper(photos, cache_mode='off', scans=scans) == 'error'
+    out = capsys.readouterr().out
+    # Progress is printed live by the grouper itself, not relayed after the run
+    assert 'Got 97 valid timestamps' in out
+    assert 'Grouper completed successfully: 9 stacks, 64 files' in out
+    assert 'FOLDER "fs" ALREADY EXISTS!' in out
+
+
+def test_run_grouper_reports_unexpected_errors(tmp_path, capsys):
+    photos = extract('test_97f', str(tmp_path / 'photos'))
+    assert runner.run_grouper(photos, cache_mode='off', mode='copy') == 'error'
+    assert 'Error running grouper: Unknown grouping mode' in capsys.readouterr().out
+    assert not os.path.exists(os.path.join(photos, 'fs'))
+
+
+def test_unknown_stacking_backend_is_a_settings_error(monkeypatch, capsys):
+    settings = {
+        'stacker': 'stacker.js',
+        'folder_grouped': 'fs',
+        'path_all_storing': '/photos',
+        'folder_current_storing': '!newstack',
+        'photoshop_app': 'Adobe Photoshop 2025',
+        'hours_icloud': 24,
+        'stacking_backend': 'nativ',
+    }
+    monkeypatch.setattr(runner, 'load_settings', lambda: settings)
+    with pytest.raises(SystemExit) as error:
+        runner.main()
+    assert error.value.code == 1
+    assert 'Unknown stacking_backend "nativ", expected one of: photoshop, native, daemon' in capsys.readouterr().out
@@ -0,0 +1,115 @@
+"""
+Tests for the process-pool stacking scheduler.
+"""
+
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import signal
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import cost_model  # noqa: E402
+import native_stacker  # noqa: E402
+import scheduler  # noqa: E402
+from image_loader import save_jpeg  # noqa: E402
+from manifest import find_jobs  # noqa: E402
+
+#  Middle stack has an undecodable frame
+BROKEN_MIDDLE = pytest.mark.parametrize('grouped', [{'broken': 1}], indirect=True)
+
+
+def run(path, workers=2):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return scheduler.schedule(str(path), workers=workers)
+
+
+@BROKEN_MIDDLE
+def test_failed_stack_does_not_stop_others(grouped):
+    report = run(grouped)
+    assert [outcome.name for outcome in report.outcomes] == ['IMG_0003', 'IMG_0006', 'IMG_0009']
+    assert [outcome.ok for outcome in report.outcomes] == [True, False, True]
+    assert report.failed[0].output == '' and 'IMG_0005' in report.failed[0].error
+    assert sorted(name for name in os.listdir(grouped) if name.endswith('.jpg')) == [
+        'IMG_0003_fs.jpg',
+        'IMG_0009_fs.jpg',
+    ]
+    assert not [name for name in os.listdir(grouped) if name.endswith('.part')]
+
+
+@BROKEN_MIDDLE
+def test_run_report_is_saved(grouped):
+    report = run(grouped, workers=1)
+    with open(grouped / scheduler.REPORT_NAME, encoding='utf-8') as f:
+        data = json.load(f)
+    assert (data['succeeded'], data['failed']) == (2, 1)
+    assert [stack['output'] for stack in data['stacks']] == [o.output for o in report.outcomes]
+    assert all(stack['seconds'] >= 0 for stack in data['stacks'])
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='workers must inherit the patch')
+@BROKEN_MIDDLE
+def test_dead_worker_fails_its_stack_only(grouped, monkeypatch):
+    stack_job = native_stacker.stack_job
+
+    def crash_on_last(out_folder, files, options, prefetcher=None):
+        if files[-1].endswith('IMG_0009.JPG'):
+            os.kill(os.getpid(), signal.SIGKILL)
+        return stack_job(out_folder, files, options, prefetcher)
+
+    monkeypatch.setattr(native_stacker, 'stack_job', crash_on_last)
+    report = run(grouped)
+    assert [outcome.ok for outcome in report.outcomes] == [True, False, False]
+    assert report.outcomes[2].error == 'worker process died'
+
+
+def estimates(*memories):
+    return [cost_model.JobEstimate(1, 1, float(memory), memory) for memory in memories]
+
+
+def test_largest_stacks_go_first():
+    assert scheduler.largest_first(estimates(10, 30, 20, 30)) == [1, 3, 2, 0]
+
+
+def test_admission_keeps_memory_in_flight_within_budget():
+    jobs = estimates(60, 50, 30)
+    #  Nothing running: the largest stack starts even over the budget
+    assert scheduler.admit([0, 1, 2], jobs, 0, 0, 40) == 0
+    #  50 doesn't fit next to 60, the smaller one fills the room
+    assert scheduler.admit([1, 2], jobs, 60, 1, 100) == 2
+    assert scheduler.admit([1], jobs, 60, 1, 100) is None
+    assert scheduler.admit([1], jobs, 60, 1, 0) == 1
+
+
+@BROKEN_MIDDLE
+def test_stacks_run_largest_first(grouped, scene, bracket):
+    #  Last stack gets two more frames
+    last = sorted(os.listdir(grouped))[-1]
+    for name in ('IMG_0010.JPG', 'IMG_0011.JPG'):
+        save_jpeg(str(grouped / last / name), bracket(scene(120, 160))[0])
+    finished = []
+    jobs = find_jobs(str(grouped))
+    report = scheduler.run_jobs(jobs, workers=1, on_outcome=finished.append)
+    assert [outcome.name for outcome in finished] == ['IMG_0011', 'IMG_0003', 'IMG_0006']
+    assert [outcome.name for outcome in report.outcomes] == ['IMG_0003', 'IMG_0006', 'IMG_0011']
+    assert [estimate.frames for estimate in report.estimates] == [3, 3, 5]
+
+
+@BROKEN_MIDDLE
+def test_run_history_calibrates_estimates(grouped, tmp_path):
+    history = str(tmp_path / cost_model.HISTORY_FILE_NAME)
+    for trace_memory in (False, True):
+        with contextlib.redirect_stdout(io.StringIO()):
+            scheduler.schedule(str(grouped), workers=2, history=history, skip_done=False, trace_memory=trace_memory)
+    records = cost_model.read_history(history)
+    assert len(records) == 4 and {record.profile for record in records} == {'batch/max'}
+    assert all(record.pixels == 120 * 160 for record in records)
+    #  Memory is traced on request only
+    assert [record.memory > 0 for record in records] == [False, False, True, True]
+    assert cost_model.CostModel(records).coefficients_of('batch/max').samples == 4
@@ -0,0 +1,122 @@
+"""
+Tests for the stacking daemon and its job queue, with the fake backend.
+"""
+
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import image_loader  # noqa: E402
+import ledger  # noqa: E402
+import native_stacker  # noqa: E402
+import runner  # noqa: E402
+import stack_daemon  # noqa: E402
+from manifest import find_jobs  # noqa: E402
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    backend = stack_daemon.FakeBackend(fail=lambda files: files[-1].endswith('IMG_0006.JPG'))
+    daemon = stack_daemon.StackDaemon(backend, str(tmp_path / 'stackd'))
+    daemon.start()
+    yield daemon
+    daemon.close()
+
+
+def test_queue_runs_jobs_in_order_of_submission(tmp_path):
+    with stack_daemon.JobQueue(str(tmp_path / 'queue.sqlite')) as queue:
+        ids = queue.submit([('out', ['a', 'b']), ('out', ['c'])])
+        #  Stack submitted again while queued keeps its job
+        assert queue.submit([('out', ['c']), ('out', ['d'])]) == [ids[1], ids[1] + 1]
+        first = queue.claim()
+        assert (first.id, first.files, first.state) == (ids[0], ['a', 'b'], stack_daemon.STATE_RUNNING)
+        queue.finish(first.id, 'out/b_fs.jpg', seconds=1.5)
+        queue.finish(queue.claim().id, error='OSError: broken')
+        records = queue.records(ids + [ids[1] + 1, 999])
+        assert [record.state for record in records] == ['done', 'failed', 'queued']
+        assert records[0].output == 'out/b_fs.jpg' and records[1].error == 'OSError: broken'
+        assert queue.claim().files == ['d'] and queue.claim() is None
+
+
+def test_running_jobs_are_queued_again_on_restart(tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    with stack_daemon.JobQueue(path) as queue:
+        ids = queue.submit([('out', ['a']), ('out', ['b'])])
+        queue.claim()
+    with stack_daemon.JobQueue(path) as queue:
+        assert [record.state for record in queue.records(ids)] == ['queued', 'queued']
+        assert queue.claim().id == ids[0]
+
+
+def test_client_gets_jobs_as_they_finish(daemon, grouped):
+    jobs = find_jobs(str(grouped))
+    with stack_daemon.DaemonClient(daemon.folder) as client:
+        assert client.info() == (stack_daemon.BACKEND_FAKE, {'backend': stack_daemon.BACKEND_FAKE})
+        ids = client.submit(jobs)
+        finished = list(client.wait(ids))
+        assert [record.id for record in finished] == ids
+        assert [record.state for record in client.status(ids)] == ['done', 'failed', 'done']
+    assert 'Fake failure of IMG_0006' in finished[1].error
+    assert finished[0].output == ledger.result_path(*jobs[0]) and os.path.isfile(finished[0].output)
+    assert daemon.backend.stacked == [jobs[0][1], jobs[2][1]]
+
+
+def test_native_backend_keeps_its_frame_cache(tmp_path, frame_files):
+    options = native_stacker.StackOptions(cache_mb=64, cache_dir=str(tmp_path / 'cache'))
+    backend = stack_daemon.NativeBackend(options)
+    backend.stack(str(tmp_path / 'first'), frame_files)
+    image_loader.reset_decode_counts()
+    output = backend.stack(str(tmp_path / 'second'), frame_files)
+    assert image_loader.decode_counts() == {} and os.path.isfile(output)
+    #  Same cache for both stacks: hits of the second, misses of the first
+    assert tuple(backend._loader.__self__.stats())[:2] == (3, 3)
+
+
+def test_bad_request_gets_error_and_connection_goes_on(daemon):
+    with stack_daemon.DaemonClient(daemon.folder) as client:
+        with pytest.raises(OSError, match='Unknown request'):
+            client.request({'op': 'restack'})
+        assert client.status([12345]) == []
+
+
+def test_second_daemon_on_same_folder_is_refused(daemon):
+    assert stack_daemon.ping(daemon.folder)
+    with pytest.raises(OSError, match='already running'):
+        stack_daemon.StackDaemon(stack_daemon.FakeBackend(), daemon.folder)
+
+
+def test_runner_submits_only_stacks_not_stacked(daemon, grouped):
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert not runner.run_daemon_stacks(str(grouped), daemon.folder)
+        #  Backend stays warm: the same one stacks the failed stack of the last run only
+        daemon.backend.fail = lambda files: False
+        assert runner.run_daemon_stacks(str(grouped), daemon.folder)
+    assert [ledger.stack_id(files) for files in daemon.backend.stacked] == ['IMG_0003', 'IMG_0009', 'IMG_0006']
+
+
+def test_stacks_left_by_stopped_daemon_are_failures(daemon, grouped):
+    def stop_on_first(files):
+        daemon.stop()
+        return False
+
+    daemon.backend.fail = stop_on_first
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        records = stack_daemon.submit_stacks(str(grouped), daemon.folder)
+        assert not runner.run_daemon_stacks(str(grouped), daemon.folder)
+    assert [record.state for record in records] == ['done', 'failed', 'failed']
+    assert records[2].error == stack_daemon.STOPPED_ERROR
+    assert 'completed: 1 of 3 stack(s)' not in out.getvalue()
+
+
+def test_runner_reports_missing_daemon(tmp_path, grouped):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        assert not runner.run_daemon_stacks(str(grouped), str(tmp_path / 'nothing'))
+    assert 'Stacking daemon is not available' in out.getvalue()
@@ -0,0 +1,71 @@
+"""
+Tests for tiled out-of-core stacking over memory-mapped frames.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import native_stacker  # noqa: E402
+import tiled_stacker  # noqa: E402
+from image_loader import load_image  # noqa: E402
+
+#  Small budget: frames of 400x600 are split into 256-pixel tiles
+BUDGET = 1 << 20
+
+#  Frames of 400x600
+LARGE_FRAMES = pytest.mark.parametrize('frame_files', [{'size': (400, 600)}], indirect=True)
+
+
+@LARGE_FRAMES
+@pytest.mark.parametrize('method', native_stacker.METHODS)
+def test_tiles_match_whole_frame_blending(frame_files, tmp_path, method):
+    assert len(tiled_stacker.tiles(400, 600, tiled_stacker.tile_side(BUDGET, method))) > 1
+    spill = tiled_stacker.spill_frames(frame_files, str(tmp_path / 'scratch'), 'similarity', BUDGET)
+    merged, crop = tiled_stacker.blend_tiles(spill, method, memory_budget=BUDGET)
+    frames = (load_image(path) for path in frame_files)
+    expected, transforms, expected_crop = native_stacker.stack_stream(frames, method)
+    top, bottom, left, right = crop
+    assert crop == expected_crop and spill.transforms == transforms
+    error = np.abs(merged[top:bottom, left:right].astype(int) - expected)
+    if method == native_stacker.METHOD_PYRAMID:
+        #  Tiles are limited to TILED_LEVELS pyramid levels
+        assert error.mean() < 0.5
+    else:
+        assert error.max() == 0
+
+
+@LARGE_FRAMES
+def test_scratch_is_removed_after_stacking(frame_files, tmp_path):
+    scratch = tmp_path / 'scratch'
+    result = tiled_stacker.stack_files(frame_files, str(tmp_path), memory_budget=BUDGET, scratch_dir=str(scratch))
+    top, bottom, left, right = result.crop
+    assert load_image(result.path).shape == (bottom - top, right - left, 3)
+    assert os.listdir(scratch) == []
+
+
+@LARGE_FRAMES
+def test_spill_is_reused_by_rerun(frame_files, tmp_path, monkeypatch):
+    folder = str(tmp_path / 'scratch' / tiled_stacker.stack_key(frame_files, 'similarity'))
+    spill = tiled_stacker.spill_frames(frame_files, folder, 'similarity', BUDGET)
+
+    def fail(path):
+        raise AssertionError(f'{path} decoded again')
+
+    monkeypatch.setattr(tiled_stacker, 'load_image', fail)
+    assert tiled_stacker.spill_frames(frame_files, folder, 'similarity', BUDGET) == spill
+    os.utime(frame_files[0], ns=(0, 0))
+    assert tiled_stacker.stack_key(frame_files, 'similarity') != os.path.basename(folder)
+
+
+def test_memory_budget_drives_tile_side():
+    sides = [tiled_stacker.tile_side(mb << 20, native_stacker.METHOD_MAX) for mb in (1, 64, 1024)]
+    assert sides == sorted(sides) and sides[0] == tiled_stacker.MIN_TILE
+    assert all(side % tiled_stacker.TILE_ALIGN == 0 for side in sides)
+    window = sides[-1] + 2 * tiled_stacker.halo(native_stacker.METHOD_MAX)
+    assert window**2 * tiled_stacker.BYTES_PER_PIXEL[native_stacker.METHOD_MAX] <= 1024 << 20
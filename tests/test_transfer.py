@@ -0,0 +1,110 @@
+"""
+Tests for transfer.py moving files across devices.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import transfer  # noqa: E402
+
+
+@pytest.fixture
+def cross_device_engine(monkeypatch):
+    """Engine that copies as if target folders were on another volume."""
+    engine = transfer.TransferEngine(workers=3, verify=True)
+    monkeypatch.setattr(engine, 'same_device', lambda src_folder, dst_folder: False)
+    return engine
+
+
+def test_cross_device_move_copies_durably(tmp_path, cross_device_engine):
+    src, dst = tmp_path / 'src', tmp_path / 'dst'
+    src.mkdir()
+    dst.mkdir()
+    names = [f'IMG_{i:04}.JPG' for i in range(10)]
+    for i, name in enumerate(names):
+        (src / name).write_bytes(os.urandom(1000 * i + 1))
+        os.utime(src / name, ns=(1_600_000_000_000_000_000, 1_600_000_000_000_000_000 + i))
+    digests = [transfer.file_digest(str(src / name)) for name in names]
+
+    moved = list(cross_device_engine.move_many(str(src), str(dst), names))
+
+    assert moved == names
+    assert os.listdir(src) == []
+    assert sorted(os.listdir(dst)) == names
+    assert [transfer.file_digest(str(dst / name)) for name in names] == digests
+    assert [os.stat(dst / name).st_mtime_ns % 100 for name in names] == list(range(10))
+    report = cross_device_engine.report()
+    assert (report.renamed, report.copied) == (0, 10)
+    assert report.bytes_copied == sum(1000 * i + 1 for i in range(10))
+    assert 'copied across devices' in report.summary()
+
+
+def test_failed_copy_keeps_source(tmp_path, cross_device_engine, monkeypatch):
+    src, dst = tmp_path / 'src', tmp_path / 'dst'
+    src.mkdir()
+    dst.mkdir()
+    (src / 'IMG_0001.JPG').write_bytes(b'photo')
+    monkeypatch.setattr(transfer, 'file_digest', lambda path: os.urandom(8))
+    with pytest.raises(OSError):
+        list(cross_device_engine.move_many(str(src), str(dst), ['IMG_0001.JPG']))
+    assert os.listdir(src) == ['IMG_0001.JPG']
+    assert os.listdir(dst) == []
+
+
+def test_same_device_move_renames(tmp_path):
+    (tmp_path / 'IMG_0001.JPG').write_bytes(b'photo')
+    (tmp_path / 'fs').mkdir()
+    engine = transfer.TransferEngine()
+    assert list(engine.move_many(str(tmp_path), str(tmp_path / 'fs'), ['IMG_0001.JPG'])) == [
+        'IMG_0001.JPG'
+    ]
+    assert engine.report()[:3] == (1, 0, 0)
+
+
+@pytest.mark.parametrize('syscall', ['copy_file_range', 'sendfile'])
+def test_in_kernel_copy_of_nothing_falls_back_to_buffered_copy(tmp_path, monkeypatch, syscall):
+    if not hasattr(os, syscall):
+        pytest.skip(f'no os.{syscall} here')
+    monkeypatch.setattr(os, syscall, lambda *args: 0)
+    data = os.urandom(100000)
+    (tmp_path / 'IMG_0001.JPG').write_bytes(data)
+    assert transfer.copy_file(str(tmp_path / 'IMG_0001.JPG'), str(tmp_path / 'copy.JPG')) == len(data)
+    assert (tmp_path / 'copy.JPG').read_bytes() == data
+
+
+def test_short_in_kernel_copy_keeps_source(tmp_path, cross_device_engine, monkeypatch):
+    if not hasattr(os, 'copy_file_range'):
+        pytest.skip('no os.copy_file_range here')
+    copy_file_range = os.copy_file_range
+    sent = []
+
+    def copy_once(src_fd, dst_fd, count):
+        #  First chunk is copied, then the kernel copies nothing more
+        sent.append(copy_file_range(src_fd, dst_fd, 1000) if not sent else 0)
+        return sent[-1]
+
+    monkeypatch.setattr(os, 'copy_file_range', copy_once)
+    src, dst = tmp_path / 'src', tmp_path / 'dst'
+    src.mkdir()
+    dst.mkdir()
+    (src / 'IMG_0001.JPG').write_bytes(os.urandom(100000))
+    with pytest.raises(OSError, match='Copy stopped after 1000 of 100000 bytes'):
+        list(cross_device_engine.move_many(str(src), str(dst), ['IMG_0001.JPG']))
+    assert os.listdir(src) == ['IMG_0001.JPG']
+    assert os.listdir(dst) == []
+
+
+def test_copy_shorter_than_source_is_not_renamed(tmp_path, monkeypatch):
+    if not hasattr(os, 'copy_file_range'):
+        pytest.skip('no os.copy_file_range here')
+    #  Copy reported as whole, nothing written
+    monkeypatch.setattr(os, 'copy_file_range', lambda src_fd, dst_fd, count: count)
+    (tmp_path / 'IMG_0001.JPG').write_bytes(os.urandom(100000))
+    with pytest.raises(OSError, match='Copied 0 of 100000 bytes'):
+        transfer.copy_file(str(tmp_path / 'IMG_0001.JPG'), str(tmp_path / 'copy.JPG'))
+    assert os.listdir(tmp_path) == ['IMG_0001.JPG']
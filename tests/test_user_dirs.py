@@ -0,0 +1,44 @@
+"""
+Tests for the per-user folders in the system temporary folder.
+"""
+
+import os
+import stat
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import stack_daemon  # noqa: E402
+from user_dirs import make_private_dir, user_temp_dir  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'getuid'), reason='POSIX owners and modes')
+
+
+def test_folder_is_named_by_user_and_created_private(tmp_path):
+    assert user_temp_dir('pyfocusstack-stackd').endswith(f'pyfocusstack-stackd-{os.getuid()}')
+    path = make_private_dir(str(tmp_path / 'private'))
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o700
+    assert make_private_dir(path) == path
+
+
+def test_folder_open_to_others_or_not_a_folder_is_refused(tmp_path):
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    shared.chmod(0o777)
+    with pytest.raises(OSError, match='not private'):
+        make_private_dir(str(shared))
+    (tmp_path / 'link').symlink_to(shared)
+    with pytest.raises(OSError, match='Not a folder'):
+        make_private_dir(str(tmp_path / 'link'))
+
+
+def test_daemon_refuses_shared_folder(tmp_path):
+    folder = tmp_path / 'stackd'
+    folder.mkdir()
+    folder.chmod(0o775)
+    with pytest.raises(OSError, match='not private'):
+        stack_daemon.StackDaemon(stack_daemon.FakeBackend(), str(folder))
+    assert os.listdir(folder) == []